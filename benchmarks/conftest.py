@@ -0,0 +1,56 @@
+"""
+Fixtures for the benchmark suite.
+
+The benchmarks run on synthetic data written by
+urban_backscatter.synthetic, a region of UBS_BENCH_SCALE (default
+0.02) of the CMG rows and columns around Boston with the time axes of
+the real files.  Set UBS_BENCH_DATADIR to benchmark an existing data
+directory instead, e.g. full-size files from ``ubs-synthetic -s 1``.
+"""
+
+import os
+
+import pandas as pd
+import pytest
+
+from urban_backscatter import synthetic
+
+BENCH_SCALE = float(os.environ.get("UBS_BENCH_SCALE", "0.02"))
+
+# cities inside the default benchmark region
+BENCH_CITIES = pd.DataFrame(
+    {
+        "locname": [
+            "Boston",
+            "Providence",
+            "Worcester",
+            "Manchester",
+            "Hartford",
+            "Springfield",
+            "Portland",
+            "Lowell",
+        ],
+        "lat": [42.36, 41.82, 42.26, 42.99, 41.76, 42.10, 43.66, 42.63],
+        "lon": [-71.06, -71.41, -71.80, -71.46, -72.68, -72.59, -70.26, -71.32],
+    }
+)
+
+
+@pytest.fixture(scope="session")
+def bench_datadir(tmp_path_factory):
+    """
+    directory with the monthly and seasonal netcdf files to benchmark
+    """
+
+    datadir = os.environ.get("UBS_BENCH_DATADIR")
+    if datadir is not None:
+        return datadir
+
+    datadir = str(tmp_path_factory.mktemp("benchdata"))
+    synthetic.write_synthetic_data(datadir, scale=BENCH_SCALE)
+    return datadir
+
+
+@pytest.fixture(scope="session")
+def bench_cities():
+    return BENCH_CITIES.copy()
@@ -0,0 +1,103 @@
+"""
+Benchmarks of the extraction paths: a single city as extracted by the
+extract scripts, batch extraction, seasonal_ds_to_df and the data
+behind the timeseries plot.  Each loader call starts from an empty
+dataset cache, like a fresh run of a script.
+"""
+
+import pandas as pd
+import pytest
+
+import urban_backscatter as ubs
+from urban_backscatter import batch
+from urban_backscatter import plot_seasonal_timeseries as plot
+
+pytest.importorskip("pytest_benchmark")
+
+INSTRUMENTS = batch.SEASONAL_INSTRUMENTS
+
+
+def extract_seasonal(datadir, lat, lon, season="JAS"):
+    # the reads and merges of extract_grid_cells_from_seasonal.py
+    ubs.ncfileio.clear_cache()
+    bbox = ubs.cmgutils.box11(lon, lat)
+    df = None
+    for instrument, srctag in INSTRUMENTS.items():
+        data = ubs.ncfileio.get_all_seasons_data(
+            datadir, instrument, seasons=[season], bbox=bbox
+        )
+        idf = ubs.dsutils.seasonal_ds_to_df(data[season], season, srctag)
+        if df is None:
+            df = idf
+        else:
+            df = pd.merge(df, idf, how="left", on=["latitude", "longitude"])
+    return df
+
+
+def extract_monthly(datadir, lat, lon):
+    # the reads and merges of extract_grid_cells_from_monthly.py
+    ubs.ncfileio.clear_cache()
+    bbox = ubs.cmgutils.box11(lon, lat)
+    df = None
+    for instrument, (srctag, start, end) in batch.MONTHLY_INSTRUMENTS.items():
+        data = ubs.ncfileio.get_monthly_data(datadir, instrument, bbox=bbox)
+        data = data.sel(time=slice(start, end))
+        idf = ubs.dsutils.monthly_ds_to_df(data, srctag)
+        if df is None:
+            df = idf
+        else:
+            df = pd.merge(df, idf, how="left", on=["latitude", "longitude"])
+    return df
+
+
+def plot_data(datadir, lat, lon, season="JAS"):
+    # the box means and power ratios of plot_seasonal_timeseries.py
+    ubs.ncfileio.clear_cache()
+    bbox = ubs.cmgutils.box11(lon, lat)
+    dfs = []
+    for instrument in INSTRUMENTS:
+        data = ubs.ncfileio.get_all_seasons_data(
+            datadir, instrument, seasons=[season], bbox=bbox
+        )
+        dfs.append(plot.box_timeseries(data[season], instrument))
+    return plot.power_ratio(pd.concat(dfs))
+
+
+def test_single_city_seasonal(benchmark, bench_datadir):
+    df = benchmark(extract_seasonal, bench_datadir, 42.36, -71.06)
+    assert len(df) == 121
+
+
+def test_single_city_monthly(benchmark, bench_datadir):
+    df = benchmark(extract_monthly, bench_datadir, 42.36, -71.06)
+    assert len(df) == 121
+
+
+@pytest.mark.parametrize("mode", batch.MODES)
+def test_batch(benchmark, bench_datadir, bench_cities, tmp_path, mode):
+    def run():
+        ubs.ncfileio.clear_cache()
+        return batch.run_batch(
+            bench_cities, bench_datadir, str(tmp_path), mode=mode, incremental=False
+        )
+
+    written, failed = benchmark(run)
+    assert len(written) == len(bench_cities)
+    assert not failed
+
+
+@pytest.mark.parametrize("engine", ubs.dsutils.ENGINES)
+def test_seasonal_ds_to_df(benchmark, bench_datadir, engine):
+    bbox = ubs.cmgutils.box11(-71.06, 42.36)
+    data = ubs.ncfileio.get_all_seasons_data(
+        bench_datadir, "ASCAT", seasons=["JAS"], bbox=bbox
+    )
+    df = benchmark(
+        ubs.dsutils.seasonal_ds_to_df, data["JAS"], "JAS", "ASCAT", engine=engine
+    )
+    assert len(df) == 121
+
+
+def test_plot_data(benchmark, bench_datadir):
+    df = benchmark(plot_data, bench_datadir, 42.36, -71.06)
+    assert set(df["instr"]) == set(INSTRUMENTS)
@@ -1,24 +1,51 @@
 import sys
+import importlib
 
-if sys.version_info[:2] >= (3, 8):
-    # TODO: Import directly (no need for conditional) when
-    # `python_requires = >= 3.8`
-    from importlib.metadata import PackageNotFoundError, version
-else:
-    from importlib_metadata import PackageNotFoundError, version
-
-try:
-    # Change here if project is renamed and does not equal the
-    # package name
-    dist_name = __name__
-    __version__ = version(dist_name)
-except PackageNotFoundError:  # pragma: no cover
-    __version__ = "unknown"
-finally:
-    del version, PackageNotFoundError
-
-from . import ncfileio
-from . import cmgutils
-from . import dsutils
-
-__all__ = ["ncfileio", "cmgutils", "dsutils"]
+# the submodules (and xarray, pandas, ... they need) are imported on
+# first use, e.g. ubs.ncfileio, so importing the package for a script's
+# --help or an argument error stays fast
+__all__ = [
+    "ncfileio",
+    "cmgutils",
+    "dsutils",
+    "rawcube",
+    "manifest",
+    "integral",
+    "zonal",
+    "climatology",
+    "windows",
+    "profiling",
+    "resultcache",
+]
+
+
+def _version():
+    if sys.version_info[:2] >= (3, 8):
+        # TODO: Import directly (no need for conditional) when
+        # `python_requires = >= 3.8`
+        from importlib.metadata import PackageNotFoundError, version
+    else:
+        from importlib_metadata import PackageNotFoundError, version
+
+    try:
+        # Change here if project is renamed and does not equal the
+        # package name
+        dist_name = __name__
+        return version(dist_name)
+    except PackageNotFoundError:  # pragma: no cover
+        return "unknown"
+
+
+def __getattr__(name):
+    if name in __all__:
+        # importing the submodule also sets it as a package attribute
+        return importlib.import_module("." + name, __name__)
+    if name == "__version__":
+        globals()["__version__"] = _version()
+        return globals()["__version__"]
+    errmsg = "module {!r} has no attribute {!r}".format(__name__, name)
+    raise AttributeError(errmsg)
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | {"__version__"})
@@ -0,0 +1,858 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Batch extraction of the 11x11 grid cell CSV files for a list of cities.
+Each instrument is opened once and the boxes for all cities are pulled
+from the resident data, instead of running the extract scripts once per
+city.  The city list is a CSV or TSV file with columns locname, lat, lon
+and optionally season.
+"""
+
+import sys
+import os
+import argparse
+import datetime
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import urban_backscatter as ubs
+
+# monthly instruments: (srctag, start date, end date) as in
+# extract_grid_cells_from_monthly.py
+MONTHLY_INSTRUMENTS = {
+    "ERS": ("ERS", "1993-01-01", "2001-01-01"),
+    "QuikSCAT": ("QuikSCAT", "1999-07-01", "2009-12-01"),
+    "ASCAT": ("ASCAT", "2007-01-01", "2020-12-31"),
+}
+
+# seasonal instruments: srctag as in extract_grid_cells_from_seasonal.py
+SEASONAL_INSTRUMENTS = {"ERS": "ERS", "QuikSCAT": "QSCAT", "ASCAT": "ASCAT"}
+
+MODES = ["monthly", "seasonal"]
+
+# largest region (number of values per variable) read in one piece when
+# gathering boxes from the netcdf files, otherwise boxes are read one
+# city at a time
+REGION_LIMIT = 2**27
+
+
+def read_city_list(path):
+    """
+    Read a CSV/TSV city list with columns locname, lat, lon and an
+    optional season column and return it as a dataframe.
+    """
+
+    cities = pd.read_csv(path, sep=None, engine="python", dtype={"locname": str})
+    cities.columns = [x.strip().lower() for x in cities.columns]
+
+    for col in ["locname", "lat", "lon"]:
+        if col not in cities.columns:
+            errmsg = "city list should have columns locname, lat, lon [, season]"
+            raise ValueError(errmsg)
+
+    if "season" in cities.columns:
+        cities["season"] = cities["season"].str.strip()
+        bad = ~cities["season"].isin(ubs.ncfileio.SEASON_LIST)
+        if bad.any():
+            errmsg = "season should be one of 'JFM', 'AMJ', 'JAS' or 'OND'"
+            raise ValueError(errmsg)
+
+    return cities
+
+
+def load_monthly(datadir, cubedir=None, verbose=False):
+    """
+    Open the monthly data for each instrument once and return a dictionary
+    of (time subset) datasets keyed by instrument.  If cubedir is given
+    the memory-mapped cubes are used instead of the netcdf files.
+    """
+
+    monthly_data = {}
+    for instrument, (srctag, start_date, end_date) in MONTHLY_INSTRUMENTS.items():
+        if cubedir is not None:
+            ds = ubs.rawcube.get_monthly_rawcube_data(
+                cubedir, instrument, verbose=verbose
+            )
+        else:
+            ds = ubs.ncfileio.get_monthly_data(datadir, instrument, verbose=verbose)
+        monthly_data[instrument] = ds.sel(time=slice(start_date, end_date))
+
+    return monthly_data
+
+
+def load_seasonal(datadir, seasons, cubedir=None, masked=False, verbose=False):
+    """
+    Open the seasonal data for each instrument once and return a
+    dictionary keyed by instrument of dictionaries keyed by season.
+    """
+
+    seasonal_data = {}
+    for instrument in SEASONAL_INSTRUMENTS:
+        if cubedir is not None:
+            seasonal_data[instrument] = {
+                season: ubs.rawcube.get_seasonal_rawcube_data(
+                    cubedir, instrument, season=season, masked=masked
+                )
+                for season in seasons
+            }
+        else:
+            seasonal_data[instrument] = ubs.ncfileio.get_all_seasons_data(
+                datadir, instrument, seasons=seasons, masked=masked, verbose=verbose
+            )
+
+    return seasonal_data
+
+
+def gather(ds, rows, cols, variables=("sig0", "sig0std"), instrument=None):
+    """
+    Gather the boxes given by the CMG rows and cols from ds.  The region
+    covering all boxes is read in one piece if it is small enough,
+    otherwise each box is read separately.  instrument only labels the
+    profiling stages.
+    """
+
+    with ubs.profiling.stage("gather", instrument):
+        return _gather(ds, rows, cols, variables)
+
+
+def _load(region):
+    # read a region, counting the bytes read when profiling
+    with ubs.profiling.stage("load") as stage:
+        region = region.load()
+        if stage.enabled:
+            stage.add_bytes(ubs.profiling.dataset_bytes(region))
+    return region
+
+
+def _gather(ds, rows, cols, variables):
+    row0, col0 = ubs.dsutils.grid_offset(ds)
+    rmin = max(int(rows.min()) - row0, 0)
+    rmax = max(int(rows.max()) - row0 + 1, 0)
+    cmin = max(int(cols.min()) - col0, 0)
+    cmax = max(int(cols.max()) - col0 + 1, 0)
+    nvalues = (rmax - rmin) * (cmax - cmin) * ds.sizes["time"]
+
+    if nvalues <= REGION_LIMIT:
+        region = _load(ds.isel(lat=slice(rmin, rmax), lon=slice(cmin, cmax)))
+        return ubs.dsutils.gather_boxes(region, rows, cols, variables)
+
+    boxes = []
+    for i in range(len(rows)):
+        rmin = max(int(rows[i].min()) - row0, 0)
+        cmin = max(int(cols[i].min()) - col0, 0)
+        region = _load(
+            ds.isel(
+                lat=slice(rmin, rmin + rows.shape[1]),
+                lon=slice(cmin, cmin + cols.shape[1]),
+            )
+        )
+        boxes.append(
+            ubs.dsutils.gather_boxes(
+                region, rows[i : i + 1], cols[i : i + 1], variables
+            )
+        )
+    return xr.concat(boxes, dim="city")
+
+
+def convert_box(box, mode, instrument, srctag, season=None, layout="wide"):
+    """
+    Convert a single (time, lat, lon) box to its wide or long dataframe
+    """
+
+    if layout == "long":
+        return ubs.dsutils.long_table(box, instrument)
+    if mode == "monthly":
+        return ubs.dsutils.monthly_ds_to_df(box, srctag)
+    return ubs.dsutils.seasonal_ds_to_df(box, season, srctag)
+
+
+def table_specs(mode, season=None, layout="wide"):
+    """
+    Return a list of (instrument, (mode, instrument, srctag, season,
+    layout)) pairs giving the instruments combined into one table and
+    how to convert each box.
+    """
+
+    if mode == "monthly":
+        return [
+            (instrument, (mode, instrument, srctag, None, layout))
+            for instrument, (srctag, start, end) in MONTHLY_INSTRUMENTS.items()
+        ]
+    return [
+        (instrument, (mode, instrument, srctag, season, layout))
+        for instrument, srctag in SEASONAL_INSTRUMENTS.items()
+    ]
+
+
+def city_table(boxes, specs, city):
+    """
+    Build the table for one city from the gathered boxes of each
+    instrument.  Wide tables are merged with a left join as in the
+    extract scripts, long tables are stacked.
+    """
+
+    dfs = [
+        convert_box(ubs.dsutils.city_box(box_ds, city), *spec)
+        for box_ds, spec in zip(boxes, specs)
+    ]
+    return merge_tables(dfs, specs[0][-1])
+
+
+def merge_tables(dfs, layout="wide"):
+    """
+    Combine the tables of several instruments for one city, wide tables
+    are merged with a left join as in the extract scripts, long tables
+    are stacked
+    """
+
+    if layout == "long":
+        return pd.concat(dfs, ignore_index=True)
+
+    df = dfs[0]
+    for df2 in dfs[1:]:
+        df = pd.merge(df, df2, how="left", on=["latitude", "longitude"])
+    return df
+
+
+def city_tables(datasets, specs, lons, lats, halfwidth=ubs.cmgutils.HALFWIDTH):
+    """
+    Build the merged wide table for each city.  datasets is a list of
+    Datasets, one per instrument, and specs the matching list of
+    conversions from table_specs.  Returns a list
+    with one dataframe per city.
+    """
+
+    rows, cols = ubs.cmgutils.box_indices(lons, lats, halfwidth=halfwidth)
+    boxes = [
+        gather(ds, rows, cols, instrument=spec[1]) for ds, spec in zip(datasets, specs)
+    ]
+    return [city_table(boxes, specs, i) for i in range(len(rows))]
+
+
+def output_name(locname, mode, season=None, layout="wide", fmt="csv"):
+    """
+    Return the file name used by the extract scripts for a city
+    """
+
+    if mode == "monthly":
+        period = "monthly"
+    else:
+        period = season
+    if layout == "long":
+        return "{}_bs_grid_{}_long.{}".format(locname, period, fmt)
+    return "{}_bs_grid_{}.{}".format(locname, period, fmt)
+
+
+def process_cities(boxes, specs, tasks, fmt="csv", callback=None, keep=False):
+    """
+    Build the table for each (city, outpath) task.  The table is written
+    to outpath, or returned if outpath is None (or keep is True).  Errors are caught so a
+    failing city does not stop the others.  Returns a list of
+    (city, dataframe or None, error message or None).  If given,
+    callback is called with each result as soon as it is available.
+    """
+
+    results = []
+    for city, outpath in tasks:
+        try:
+            df = city_table(boxes, specs, city)
+            if outpath is not None:
+                ubs.dsutils.write_table(df, outpath, fmt)
+                if not keep:
+                    df = None
+            result = (city, df, None)
+        except Exception as err:
+            result = (city, None, "{}: {}".format(type(err).__name__, err))
+        if callback is not None:
+            callback(result)
+        results.append(result)
+    return results
+
+
+# boxes attached by each worker process
+_WORKER_BOXES = None
+
+
+def _share_boxes(boxes, tmpdir):
+    """
+    Save the gathered box arrays to .npy files so worker processes can
+    memory-map them instead of each receiving a pickled copy.  Returns
+    a picklable description of the boxes.
+    """
+
+    shared = []
+    for k, box_ds in enumerate(boxes):
+        arrays = {}
+        for var in box_ds.data_vars:
+            path = os.path.join(tmpdir, "boxes{}_{}.npy".format(k, var))
+            np.save(path, box_ds[var].values)
+            arrays[var] = path
+        coords = {
+            "time": box_ds["time"].values,
+            "lat": box_ds["lat"].values,
+            "lon": box_ds["lon"].values,
+        }
+        shared.append((arrays, coords))
+    return shared
+
+
+def _attach_boxes(shared):
+    """
+    Worker initializer: memory-map the box arrays written by _share_boxes
+    """
+
+    global _WORKER_BOXES
+
+    _WORKER_BOXES = []
+    for arrays, coords in shared:
+        data_vars = {
+            var: (("time", "city", "y", "x"), np.load(path, mmap_mode="r"))
+            for var, path in arrays.items()
+        }
+        box_coords = {
+            "time": coords["time"],
+            "lat": (("city", "y"), coords["lat"]),
+            "lon": (("city", "x"), coords["lon"]),
+        }
+        _WORKER_BOXES.append(xr.Dataset(data_vars, coords=box_coords))
+
+
+def _process_chunk(specs, tasks, fmt, keep=False):
+    return process_cities(_WORKER_BOXES, specs, tasks, fmt=fmt, keep=keep)
+
+
+def run_tasks(
+    boxes,
+    specs,
+    tasks,
+    workers=1,
+    fmt="csv",
+    tmpdir=None,
+    callback=None,
+    keep=False,
+):
+    """
+    Run process_cities for all tasks, fanned out over a pool of worker
+    processes if workers > 1.  Results are returned in task order, the
+    callback is called in order of completion.  If a worker process
+    dies, the cities it had not finished are returned as failed.
+    """
+
+    if workers <= 1 or len(tasks) <= 1:
+        return process_cities(
+            boxes, specs, tasks, fmt=fmt, callback=callback, keep=keep
+        )
+
+    # a few chunks per worker to balance the load
+    nchunks = min(len(tasks), workers * 4)
+    chunks = [tasks[k::nchunks] for k in range(nchunks)]
+
+    with tempfile.TemporaryDirectory(dir=tmpdir) as sharedir:
+        shared = _share_boxes(boxes, sharedir)
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_attach_boxes, initargs=(shared,)
+        ) as pool:
+            futures = {
+                pool.submit(_process_chunk, specs, chunk, fmt, keep): chunk
+                for chunk in chunks
+            }
+            results = []
+            for future in as_completed(futures):
+                try:
+                    chunk_results = future.result()
+                except BrokenProcessPool as err:
+                    # a worker died (e.g. killed for memory), the cities
+                    # of its chunk and of the chunks not yet done fail
+                    error = "BrokenProcessPool: {}".format(err)
+                    chunk_results = [(city, None, error) for city, _ in futures[future]]
+                for result in chunk_results:
+                    if callback is not None:
+                        callback(result)
+                    results.append(result)
+
+    # deterministic (input) order
+    order = {city: k for k, (city, outpath) in enumerate(tasks)}
+    results.sort(key=lambda x: order[x[0]])
+    return results
+
+
+def input_paths(datadir, mode, cubedir=None):
+    """
+    Return the list of input files read for a monthly or seasonal batch
+    """
+
+    paths = []
+    if mode == "monthly":
+        instruments = MONTHLY_INSTRUMENTS
+    else:
+        instruments = SEASONAL_INSTRUMENTS
+
+    for instrument in instruments:
+        if cubedir is not None:
+            sidecar, arrays = ubs.rawcube.cube_paths(cubedir, instrument, mode, "land")
+            paths.append(sidecar)
+            paths.extend(arrays[var] for var in ubs.rawcube.VARIABLES)
+        else:
+            prefix = "{}_{}_land_sig0".format(instrument, mode)
+            paths.append(os.path.join(datadir, prefix + "_mean.nc"))
+            paths.append(os.path.join(datadir, prefix + "_StdDev.nc"))
+    return paths
+
+
+def city_params(
+    locname,
+    lat,
+    lon,
+    mode,
+    season,
+    layout="wide",
+    fmt="csv",
+    halfwidth=ubs.cmgutils.HALFWIDTH,
+):
+    """
+    Return the parameters recorded in the manifest for one city output
+    """
+
+    row, col = ubs.cmgutils.grid_index(lon, lat)
+    return {
+        "locname": locname,
+        "lat": float(lat),
+        "lon": float(lon),
+        "center": [int(row), int(col)],
+        "halfwidth": halfwidth,
+        "mode": mode,
+        "season": season,
+        "layout": layout,
+        "format": fmt,
+    }
+
+
+def run_batch(
+    cities,
+    datadir,
+    outdir,
+    mode="seasonal",
+    seasons=("JAS",),
+    cubedir=None,
+    combined=None,
+    workers=1,
+    incremental=True,
+    layout="wide",
+    fmt="csv",
+    cache=None,
+    verbose=False,
+):
+    """
+    Extract the grid cell tables for every city in the cities dataframe
+    and write one file per city to <outdir>, or a single file with a
+    locname column if combined is a file name.  layout selects wide or
+    long tables and fmt the csv, parquet or feather file format, a
+    combined parquet output is written as a dataset partitioned by
+    locname.  If the city list has a season column it overrides seasons
+    for that city.  With workers > 1
+    the tables are built by a pool of processes.  With incremental=True
+    outputs recorded as up to date in the output manifest are skipped
+    and every new output is recorded as soon as it is written, so an
+    interrupted run picks up where it stopped.  If cache (a
+    resultcache.ResultCache) is given, tables found in it are written
+    without reading the data and new tables are added to it, the cache
+    is not used with cubedir.  Returns the list of
+    files written and a list of (locname, season, error message) for the
+    cities that failed.
+    """
+
+    if mode not in MODES:
+        errmsg = "mode should be one of 'monthly' or 'seasonal'"
+        raise ValueError(errmsg)
+
+    os.makedirs(outdir, exist_ok=True)
+
+    inputs = ubs.ncfileio.file_fingerprint(input_paths(datadir, mode, cubedir))
+    if incremental:
+        manifest = ubs.manifest.Manifest(outdir)
+    else:
+        manifest = None
+
+    # a combined output is only up to date as a whole
+    if combined is not None and manifest is not None:
+        if "season" in cities.columns:
+            city_seasons = list(cities["season"])
+        else:
+            city_seasons = [list(seasons)] * len(cities)
+        params = [
+            city_params(locname, lat, lon, mode, season, layout, fmt)
+            for locname, lat, lon, season in zip(
+                cities["locname"], cities["lat"], cities["lon"], city_seasons
+            )
+        ]
+        combined_key = ubs.manifest.output_key(inputs, params)
+        if manifest.is_current(combined, combined_key):
+            if verbose:
+                print("{} is up to date".format(combined))
+            return [], []
+
+    # list of (season, cities, datasets) to extract
+    jobs = []
+    if mode == "monthly":
+        monthly_data = load_monthly(datadir, cubedir=cubedir, verbose=verbose)
+        jobs.append((None, cities, monthly_data))
+    else:
+        if "season" in cities.columns:
+            seasons = [
+                x for x in ubs.ncfileio.SEASON_LIST if x in set(cities["season"])
+            ]
+        seasonal_data = load_seasonal(
+            datadir, seasons, cubedir=cubedir, verbose=verbose
+        )
+        for season in seasons:
+            if "season" in cities.columns:
+                subset = cities[cities["season"] == season]
+            else:
+                subset = cities
+            season_data = {
+                instrument: seasonal_data[instrument][season]
+                for instrument in SEASONAL_INSTRUMENTS
+            }
+            jobs.append((season, subset, season_data))
+
+    written = []
+    failed = []
+    dfs = []
+    nskipped = 0
+    for season, subset, data in jobs:
+        specs = table_specs(mode, season, layout)
+
+        # skip outputs that are up to date
+        keys = {}
+        if manifest is not None and combined is None:
+            pending = []
+            for locname, lat, lon in zip(
+                subset["locname"], subset["lat"], subset["lon"]
+            ):
+                key = ubs.manifest.output_key(
+                    inputs, city_params(locname, lat, lon, mode, season, layout, fmt)
+                )
+                name = output_name(locname, mode, season, layout, fmt)
+                keys[name] = key
+                pending.append(not manifest.is_current(name, key))
+            nskipped += len(pending) - sum(pending)
+            subset = subset[pending]
+            if len(subset) == 0:
+                continue
+
+        # tables already in the result cache
+        hits = []
+        cache_keys = []
+        if cache is not None and cubedir is None:
+            cache_keys = [
+                ubs.resultcache.result_key(
+                    datadir, lon, lat, mode, season, layout=layout
+                )
+                for lat, lon in zip(subset["lat"], subset["lon"])
+            ]
+            cached = [cache.get(key) for key in cache_keys]
+            for locname, df in zip(subset["locname"], cached):
+                if df is not None:
+                    hits.append((locname, df))
+            missing = [df is None for df in cached]
+            subset = subset[missing]
+            cache_keys = [key for key, miss in zip(cache_keys, missing) if miss]
+
+        for locname, df in hits:
+            if combined is None:
+                outpath = os.path.join(
+                    outdir, output_name(locname, mode, season, layout, fmt)
+                )
+                ubs.dsutils.write_table(df, outpath, fmt)
+                if manifest is not None:
+                    name = os.path.basename(outpath)
+                    manifest.record(name, keys[name])
+                written.append(outpath)
+            else:
+                df.insert(0, "locname", locname)
+                dfs.append(df)
+        if verbose and hits:
+            print("{} table(s) from the result cache".format(len(hits)))
+        if len(subset) == 0:
+            continue
+
+        rows, cols = ubs.cmgutils.box_indices(
+            subset["lon"].values, subset["lat"].values
+        )
+        boxes = [
+            gather(data[instrument], rows, cols, instrument=instrument)
+            for instrument, spec in specs
+        ]
+
+        locnames = list(subset["locname"])
+        tasks = []
+        for city, locname in enumerate(locnames):
+            if combined is None:
+                outpath = os.path.join(
+                    outdir, output_name(locname, mode, season, layout, fmt)
+                )
+            else:
+                outpath = None
+            tasks.append((city, outpath))
+
+        def record(result):
+            city, df, error = result
+            outpath = tasks[city][1]
+            if error is None and outpath is not None and manifest is not None:
+                name = os.path.basename(outpath)
+                manifest.record(name, keys[name])
+
+        results = run_tasks(
+            boxes,
+            [spec for instrument, spec in specs],
+            tasks,
+            workers,
+            fmt=fmt,
+            callback=record,
+            keep=bool(cache_keys),
+        )
+        for (city, df, error), (_, outpath) in zip(results, tasks):
+            if error is None and cache_keys:
+                cache.put(cache_keys[city], df)
+            if error is not None:
+                failed.append((locnames[city], season, error))
+                if verbose:
+                    print("failed: {} {}".format(locnames[city], error))
+            elif combined is None:
+                written.append(outpath)
+            else:
+                df.insert(0, "locname", locnames[city])
+                dfs.append(df)
+
+    if combined is not None and dfs:
+        outpath = os.path.join(outdir, combined)
+        if fmt == "parquet":
+            partition_cols = ["locname"]
+        else:
+            partition_cols = None
+        ubs.dsutils.write_table(
+            pd.concat(dfs, ignore_index=True), outpath, fmt, partition_cols
+        )
+        written.append(outpath)
+        if manifest is not None and not failed:
+            manifest.record(combined, combined_key)
+
+    if manifest is not None:
+        manifest.compact()
+
+    if verbose:
+        print("wrote {} file(s) to {}".format(len(written), outdir))
+        print("skipped {} up to date file(s)".format(nskipped))
+
+    return written, failed
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description=(
+            "create CSVs with values for each grid"
+            + " cell in a 11x11 rectangular region around"
+            + " each location in a city list."
+        )
+    )
+
+    parser.add_argument(
+        "-m",
+        "--mode",
+        choices=MODES,
+        help="extract monthly or seasonal values. Default: seasonal",
+        default="seasonal",
+    )
+
+    parser.add_argument(
+        "-s",
+        "--season",
+        action="append",
+        choices=["JFM", "AMJ", "JAS", "OND", "all"],
+        help=(
+            "season/quarter to select (default: JAS). Repeat for several"
+            + " seasons or use 'all' for all four. Ignored if the city"
+            + " list has a season column"
+        ),
+    )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        help="increase output verbosity",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "-d",
+        "--datadir",
+        help="directory with the netcdf files. Default: ./data",
+        default="./data",
+    )
+
+    parser.add_argument(
+        "-c",
+        "--cubedir",
+        help="read the memory-mapped cubes in CUBEDIR instead of the netcdf files",
+        default=None,
+    )
+
+    parser.add_argument(
+        "-o",
+        "--outdir",
+        help="output directory. Default: <datadir>/CSV",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--combined",
+        metavar="FILENAME",
+        help=(
+            "write all cities to one file in the output directory"
+            + " (a dataset partitioned by locname for parquet)"
+        ),
+        default=None,
+    )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="number of worker processes. Default: 1",
+        default=1,
+    )
+
+    parser.add_argument(
+        "--format",
+        choices=ubs.dsutils.FORMATS,
+        help="output file format. Default: csv",
+        default="csv",
+    )
+
+    parser.add_argument(
+        "--layout",
+        choices=ubs.dsutils.LAYOUTS,
+        help=(
+            "wide: one row per grid cell, long: one row per grid cell,"
+            + " instrument and time. Default: wide"
+        ),
+        default="wide",
+    )
+
+    parser.add_argument(
+        "-f",
+        "--force",
+        help="rewrite all outputs, even those the manifest lists as up to date",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        help=(
+            "keep the extracted tables in CACHE_DIR and reuse them in later"
+            + " runs while the netcdf files are unchanged (not used with"
+            + " --cubedir)"
+        ),
+        default=None,
+    )
+
+    parser.add_argument(
+        "--profile",
+        help=(
+            "print the time, bytes read/written and peak memory of each"
+            + " stage and write a JSON trace (see --trace). Only the stages"
+            + " run in the main process are recorded"
+        ),
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--trace",
+        help="JSON trace file for --profile. Default: <outdir>/batch_profile.json",
+        default=None,
+    )
+
+    # add positional arguments
+    parser.add_argument(
+        "citylist", help="CSV/TSV file with columns locname, lat, lon [, season]"
+    )
+
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+    verbose = args.verbose
+    datadir = args.datadir
+    outdir = args.outdir
+    if outdir is None:
+        outdir = os.path.join(datadir, "CSV")
+
+    if args.profile:
+        ubs.profiling.enable()
+
+    if args.season is None:
+        seasons = ["JAS"]
+    elif "all" in args.season:
+        seasons = ubs.ncfileio.SEASON_LIST
+    else:
+        seasons = [x for x in ubs.ncfileio.SEASON_LIST if x in args.season]
+
+    cities = read_city_list(args.citylist)
+
+    cache = None
+    if args.cache_dir is not None:
+        ubs.resultcache.set_cache_dir(args.cache_dir)
+        cache = ubs.resultcache.RESULT_CACHE
+
+    if verbose:
+        today = datetime.date.today()
+        print("date: {}".format(today))
+        print("mode: {}".format(args.mode))
+        print("cities: {}".format(len(cities)))
+        print("data directory: {}".format(datadir))
+        print("output directory: {}".format(outdir))
+
+    written, failed = run_batch(
+        cities,
+        datadir,
+        outdir,
+        mode=args.mode,
+        seasons=seasons,
+        cubedir=args.cubedir,
+        combined=args.combined,
+        workers=args.workers,
+        incremental=not args.force,
+        layout=args.layout,
+        fmt=args.format,
+        cache=cache,
+        verbose=verbose,
+    )
+
+    for locname, season, error in failed:
+        print("{} {}: {}".format(locname, season or "monthly", error), file=sys.stderr)
+
+    if args.profile:
+        print(ubs.profiling.format_summary())
+        trace = args.trace or os.path.join(outdir, "batch_profile.json")
+        ubs.profiling.write_trace(trace)
+        print("trace written to {}".format(trace))
+
+    return 1 if failed else 0
+
+
+def run():
+    sys.exit(main(sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    run()
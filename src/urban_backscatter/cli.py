@@ -0,0 +1,526 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+The ubs command: the extract and plot scripts as subcommands of one
+program.  Several subcommands can follow each other on the command line
+and run for the same locations in one process, sharing a Session that
+opens each instrument once and reads the 11x11 boxes of all locations
+once per mode and season, e.g.
+
+    ubs -l 42.36 -71.06 boston extract-seasonal -s all plot -s JAS
+
+The output files have the names used by the scripts.
+"""
+
+import sys
+import os
+import argparse
+import datetime
+
+import urban_backscatter as ubs
+
+COMMANDS = ["extract-monthly", "extract-seasonal", "plot"]
+
+SEASON_CHOICES = ["JFM", "AMJ", "JAS", "OND", "all"]
+
+
+class Session:
+    """
+    Data shared by the subcommands of one run: the datasets of each
+    instrument, opened once (as batch.load_monthly and batch.load_seasonal),
+    the boxes of all locations gathered from them for each mode and
+    season, and the urban weights used by plot.  If cache (a
+    resultcache.ResultCache) is given, tables are taken from it when
+    possible and added to it otherwise (not with cubedir).
+    """
+
+    def __init__(self, datadir, lons, lats, cubedir=None, cache=None, verbose=False):
+        self.datadir = datadir
+        self.cubedir = cubedir
+        self.cache = cache
+        self.lons = list(lons)
+        self.lats = list(lats)
+        self.verbose = verbose
+        self._monthly = None
+        self._seasonal = {}
+        self._boxes = {}
+        self._weights = {}
+
+    def datasets(self, mode, season=None):
+        """
+        return the datasets of all instruments for a mode (and season)
+        keyed by instrument
+        """
+
+        from urban_backscatter import batch
+
+        if mode == "monthly":
+            if self._monthly is None:
+                self._monthly = batch.load_monthly(
+                    self.datadir, cubedir=self.cubedir, verbose=self.verbose
+                )
+            return self._monthly
+
+        if season not in self._seasonal:
+            data = batch.load_seasonal(
+                self.datadir, [season], cubedir=self.cubedir, verbose=self.verbose
+            )
+            self._seasonal[season] = {x: seasons[season] for x, seasons in data.items()}
+        return self._seasonal[season]
+
+    def boxes(self, mode, season=None):
+        """
+        return the boxes of all locations, gathered once per mode and
+        season, as a dictionary of (time, city, y, x) Datasets keyed by
+        instrument
+        """
+
+        from urban_backscatter import batch
+
+        key = (mode, season if mode == "seasonal" else None)
+        if key not in self._boxes:
+            rows, cols = ubs.cmgutils.box_indices(self.lons, self.lats)
+            boxes = {}
+            for instrument, ds in self.datasets(*key).items():
+                if self.verbose:
+                    print("reading {} {} boxes".format(instrument, season or mode))
+                boxes[instrument] = batch.gather(ds, rows, cols, instrument=instrument)
+            self._boxes[key] = boxes
+        return self._boxes[key]
+
+    def box(self, mode, instrument, location, season=None):
+        """
+        return the (time, lat, lon) box of one location (its position in
+        the location list)
+        """
+
+        boxes = self.boxes(mode, season)
+        return ubs.dsutils.city_box(boxes[instrument], location)
+
+    def table(self, mode, location, season=None, layout="wide"):
+        """
+        return the table the extract scripts write for one location
+        """
+
+        from urban_backscatter import batch
+
+        key = None
+        if self.cache is not None and self.cubedir is None:
+            key = ubs.resultcache.result_key(
+                self.datadir,
+                self.lons[location],
+                self.lats[location],
+                mode,
+                season,
+                layout=layout,
+            )
+            df = self.cache.get(key)
+            if df is not None:
+                return df
+
+        specs = batch.table_specs(mode, season, layout)
+        boxes = self.boxes(mode, season)
+        df = batch.city_table(
+            [boxes[x] for x, spec in specs], [spec for x, spec in specs], location
+        )
+        if key is not None:
+            self.cache.put(key, df)
+        return df
+
+    def weights(self, instrument, layer=None):
+        """
+        return the urban weights of an instrument, cached in
+        <datadir>/weights as in plot_seasonal_timeseries.py
+        """
+
+        key = (instrument, layer)
+        if key not in self._weights:
+            self._weights[key] = ubs.zonal.get_urban_weights(
+                self.datadir,
+                instrument,
+                cachedir=os.path.join(self.datadir, "weights"),
+                layer=layer,
+                verbose=self.verbose,
+            )
+        return self._weights[key]
+
+
+def extract_monthly(session, locnames, outdir=".", fmt="csv", layout="wide"):
+    """
+    Write the monthly table of each location (see
+    extract_grid_cells_from_monthly.py) and return the paths written
+    """
+
+    from urban_backscatter import batch
+
+    paths = []
+    for i, locname in enumerate(locnames):
+        df = session.table("monthly", i, layout=layout)
+        outpath = os.path.join(
+            outdir, batch.output_name(locname, "monthly", None, layout, fmt)
+        )
+        ubs.dsutils.write_table(df, outpath, fmt)
+        paths.append(outpath)
+    return paths
+
+
+def extract_seasonal(
+    session, locnames, seasons=("JAS",), outdir=".", fmt="csv", layout="wide"
+):
+    """
+    Write the seasonal table of each location and season (see
+    extract_grid_cells_from_seasonal.py) and return the paths written
+    """
+
+    from urban_backscatter import batch
+
+    paths = []
+    for season in seasons:
+        for i, locname in enumerate(locnames):
+            df = session.table("seasonal", i, season, layout)
+            outpath = os.path.join(
+                outdir, batch.output_name(locname, "seasonal", season, layout, fmt)
+            )
+            ubs.dsutils.write_table(df, outpath, fmt)
+            paths.append(outpath)
+    return paths
+
+
+def plot(
+    session, locnames, seasons=("JAS",), outdir=".", urban_weights=False, layer=None
+):
+    """
+    Plot the box mean power ratio timeseries of each location and
+    season (see plot_seasonal_timeseries.py) and return the paths written
+    """
+
+    import pandas as pd
+    from urban_backscatter import plot_seasonal_timeseries as pst
+
+    instruments = ["ERS", "QuikSCAT", "ASCAT"]
+    paths = []
+    for season in seasons:
+        for i, locname in enumerate(locnames):
+            dfs = []
+            for instrument in instruments:
+                weights = None
+                if urban_weights:
+                    weights = session.weights(instrument, layer)
+                box = session.box("seasonal", instrument, i, season)
+                dfs.append(pst.box_timeseries(box, instrument, weights))
+            prdf = pst.power_ratio(pd.concat(dfs))
+
+            outfile = os.path.join(
+                outdir, "{}_{}_timeseries_plot.pdf".format(locname, season)
+            )
+            lat, lon = session.lats[i], session.lons[i]
+            pst.plot_timeseries(prdf, locname, lat, lon, season, outfile)
+            paths.append(outfile)
+    return paths
+
+
+def split_commands(args):
+    """
+    Split the arguments following the global options into a list of
+    (command, arguments) pairs, a new command starts at each command name
+    """
+
+    if not args or args[0] not in COMMANDS:
+        errmsg = "expected a command, one of {}".format(", ".join(COMMANDS))
+        raise ValueError(errmsg)
+
+    commands = []
+    for arg in args:
+        if arg in COMMANDS:
+            commands.append((arg, []))
+        else:
+            commands[-1][1].append(arg)
+    return commands
+
+
+def seasons_arg(season):
+    """
+    return the seasons selected by a list of -s options (default JAS)
+    """
+
+    if season is None:
+        return ["JAS"]
+    if "all" in season:
+        return ubs.ncfileio.SEASON_LIST
+    return [x for x in ubs.ncfileio.SEASON_LIST if x in season]
+
+
+def command_parser(command):
+    """
+    return the argument parser of a command
+    """
+
+    parser = argparse.ArgumentParser(prog="ubs {}".format(command))
+
+    if command == "extract-monthly":
+        parser.description = (
+            "create a file with monthly values for each grid cell in a 11x11"
+            + " region around each location."
+        )
+    elif command == "extract-seasonal":
+        parser.description = (
+            "create a file with seasonal values for each grid cell in a 11x11"
+            + " region around each location."
+        )
+    else:
+        parser.description = (
+            "plot the seasonal mean power ratio over the 11x11 region around"
+            + " each location."
+        )
+
+    if command in ["extract-seasonal", "plot"]:
+        parser.add_argument(
+            "-s",
+            "--season",
+            action="append",
+            choices=SEASON_CHOICES,
+            help=(
+                "season/quarter to select (default: JAS). Repeat for several"
+                + " seasons or use 'all' for all four"
+            ),
+        )
+
+    if command == "plot":
+        parser.add_argument(
+            "-u",
+            "--urban-weights",
+            help=(
+                "weight the box means by the urban mask of each instrument"
+                + " (or the built fraction in --fraction-layer)"
+            ),
+            action="store_true",
+            default=False,
+        )
+
+        parser.add_argument(
+            "--fraction-layer",
+            help="netcdf file with a (lat, lon) built-fraction layer for -u",
+            default=None,
+        )
+    else:
+        parser.add_argument(
+            "--format",
+            choices=["csv", "parquet", "feather"],
+            help="output file format. Default: csv",
+            default="csv",
+        )
+
+        parser.add_argument(
+            "--layout",
+            choices=["wide", "long"],
+            help=(
+                "wide (one row per grid cell) or long (one row per grid cell"
+                + " and time step) output table. Default: wide"
+            ),
+            default="wide",
+        )
+
+    return parser
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        prog="ubs",
+        description=(
+            "extract and plot the backscatter around one or more locations."
+            + " Several commands can be given, each followed by its own"
+            + " options, and run on the same data read once."
+        ),
+        epilog=(
+            "commands: {}. Use 'ubs <command> --help' for the options"
+            + " of a command."
+        ).format(", ".join(COMMANDS)),
+    )
+
+    parser.add_argument(
+        "-l",
+        "--location",
+        nargs=3,
+        action="append",
+        metavar=("LAT", "LON", "LOCNAME"),
+        help="location (lon -180-180) and its name. Repeat for several",
+        default=[],
+    )
+
+    parser.add_argument(
+        "--cities",
+        help=(
+            "CSV/TSV file with columns locname, lat, lon (as for ubs-batch,"
+            + " a season column is not used)"
+        ),
+        default=None,
+    )
+
+    parser.add_argument(
+        "-d",
+        "--datadir",
+        help="directory with the netcdf files. Default: ./data",
+        default="./data",
+    )
+
+    parser.add_argument(
+        "-c",
+        "--cubedir",
+        help="read the memory-mapped cubes in CUBEDIR instead of the netcdf files",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        help=(
+            "keep the extracted tables in CACHE_DIR and reuse them in later"
+            + " runs while the netcdf files are unchanged (not used with"
+            + " --cubedir)"
+        ),
+        default=None,
+    )
+
+    parser.add_argument(
+        "-o",
+        "--outdir",
+        help="directory for the output files. Default: .",
+        default=".",
+    )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        help="increase output verbosity",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--profile",
+        help=(
+            "print the time, bytes read/written and peak memory of each"
+            + " stage and write a JSON trace (see --trace)"
+        ),
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--trace",
+        help="JSON trace file for --profile. Default: <outdir>/ubs_profile.json",
+        default=None,
+    )
+
+    parser.add_argument(
+        "command",
+        nargs=argparse.REMAINDER,
+        help="{} followed by its options".format(" | ".join(COMMANDS)),
+    )
+
+    parsed = parser.parse_args(args)
+
+    try:
+        commands = split_commands(parsed.command)
+    except ValueError as err:
+        parser.error(str(err))
+    parsed.commands = [
+        (command, command_parser(command).parse_args(cargs))
+        for command, cargs in commands
+    ]
+
+    locations = []
+    for lat, lon, locname in parsed.location:
+        try:
+            locations.append((locname, float(lat), float(lon)))
+        except ValueError:
+            parser.error("LAT and LON of --location should be numbers")
+    parsed.locations = locations
+    if not locations and parsed.cities is None:
+        parser.error("give at least one --location or a --cities file")
+
+    return parsed
+
+
+def main(args):
+    args = parse_args(args)
+    verbose = args.verbose
+
+    if args.profile:
+        ubs.profiling.enable()
+
+    locations = list(args.locations)
+    if args.cities is not None:
+        from urban_backscatter import batch
+
+        cities = batch.read_city_list(args.cities)
+        locations.extend(
+            (str(x.locname), float(x.lat), float(x.lon))
+            for x in cities.itertuples(index=False)
+        )
+    locnames = [x[0] for x in locations]
+
+    if verbose:
+        today = datetime.date.today()
+        print("date: {}".format(today))
+        print("data directory: {}".format(args.datadir))
+        print("locations: {}".format(len(locations)))
+        print("commands: {}".format(" ".join(x for x, cargs in args.commands)))
+
+    os.makedirs(args.outdir, exist_ok=True)
+    cache = None
+    if args.cache_dir is not None:
+        ubs.resultcache.set_cache_dir(args.cache_dir)
+        cache = ubs.resultcache.RESULT_CACHE
+    session = Session(
+        args.datadir,
+        [x[2] for x in locations],
+        [x[1] for x in locations],
+        cubedir=args.cubedir,
+        cache=cache,
+        verbose=verbose,
+    )
+
+    for command, cargs in args.commands:
+        with ubs.profiling.stage(command):
+            if command == "extract-monthly":
+                paths = extract_monthly(
+                    session, locnames, args.outdir, cargs.format, cargs.layout
+                )
+            elif command == "extract-seasonal":
+                paths = extract_seasonal(
+                    session,
+                    locnames,
+                    seasons_arg(cargs.season),
+                    args.outdir,
+                    cargs.format,
+                    cargs.layout,
+                )
+            else:
+                paths = plot(
+                    session,
+                    locnames,
+                    seasons_arg(cargs.season),
+                    args.outdir,
+                    cargs.urban_weights,
+                    cargs.fraction_layer,
+                )
+        if verbose:
+            for path in paths:
+                print("written: {}".format(path))
+
+    if args.profile:
+        print(ubs.profiling.format_summary())
+        trace = args.trace or os.path.join(args.outdir, "ubs_profile.json")
+        ubs.profiling.write_trace(trace)
+        print("trace written to {}".format(trace))
+
+    return 0
+
+
+def run():
+    sys.exit(main(sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Monthly climatologies and anomalies.  The per-cell, per-calendar-month
+# mean, std and valid count of each instrument's monthly cube are built
+# in a single pass over bands of rows and stored as netcdf.  Anomalies
+# are computed from the stored climatology as boxes are extracted, so
+# no anomaly cube is ever written and the monthly cube is read once.
+
+import os
+
+import numpy as np
+import xarray as xr
+
+from . import batch
+from . import cmgutils
+from . import ncfileio
+
+VARIABLES = ["sig0", "sig0std"]
+
+# number of latitude rows read at a time by the builder
+BAND_ROWS = 64
+
+# number of cities whose boxes are gathered at a time
+CITY_CHUNK = 256
+
+MONTHS = np.arange(1, 13)
+
+
+def climatology(ds, variables=VARIABLES, band_rows=BAND_ROWS):
+    """
+    Return the per-cell mean, (population) std and valid count of each
+    variable for every calendar month as a (month, lat, lon) Dataset
+    with <var>_mean, <var>_std and <var>_count variables.  ds is read
+    one band of rows at a time.
+    """
+
+    months = ds["time"].dt.month.values
+    nlat, nlon = ds.sizes["lat"], ds.sizes["lon"]
+    shape = (len(MONTHS), nlat, nlon)
+
+    data_vars = {}
+    for var in variables:
+        mean = np.full(shape, np.nan, dtype="float32")
+        std = np.full(shape, np.nan, dtype="float32")
+        count = np.zeros(shape, dtype="int32")
+        for start in range(0, nlat, band_rows):
+            band = ds[var].isel(lat=slice(start, start + band_rows))
+            band = band.transpose("time", "lat", "lon").values
+            stop = start + band.shape[1]
+            for i, month in enumerate(MONTHS):
+                values = band[months == month].astype("float64")
+                valid = ~np.isnan(values)
+                n = valid.sum(axis=0)
+                total = np.where(valid, values, 0.0).sum(axis=0)
+                total2 = np.where(valid, values * values, 0.0).sum(axis=0)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    m = total / n
+                    s = np.sqrt(np.maximum(total2 / n - m * m, 0.0))
+                mean[i, start:stop] = m
+                std[i, start:stop] = s
+                count[i, start:stop] = n
+
+        data_vars[var + "_mean"] = (("month", "lat", "lon"), mean)
+        data_vars[var + "_std"] = (("month", "lat", "lon"), std)
+        data_vars[var + "_count"] = (("month", "lat", "lon"), count)
+
+    coords = {"month": MONTHS, "lat": ds["lat"].values, "lon": ds["lon"].values}
+    if "spatial_ref" in ds.coords:
+        coords["spatial_ref"] = ds["spatial_ref"]
+    clim = xr.Dataset(data_vars, coords=coords)
+    clim.attrs["time_start"] = str(ds["time"].values[0])
+    clim.attrs["time_end"] = str(ds["time"].values[-1])
+    return clim
+
+
+def climatology_path(climdir, instrument):
+    """
+    return the path of the stored climatology of an instrument
+    """
+
+    return os.path.join(climdir, "{}_monthly_climatology.nc".format(instrument))
+
+
+def build_climatology(datadir, climdir, cubedir=None, verbose=False):
+    """
+    build and store the monthly climatology of each instrument over the
+    time range used by the monthly extraction.  Returns the list of
+    files written.
+    """
+
+    os.makedirs(climdir, exist_ok=True)
+
+    written = []
+    datasets = batch.load_monthly(datadir, cubedir=cubedir, verbose=verbose)
+    for instrument, ds in datasets.items():
+        outpath = climatology_path(climdir, instrument)
+        if verbose:
+            print("writing climatology: {}".format(outpath))
+        climatology(ds).to_netcdf(outpath)
+        written.append(outpath)
+
+    return written
+
+
+def get_climatology(climdir, instrument):
+    """
+    return the stored climatology of an instrument (opened lazily and
+    kept in the dataset cache)
+    """
+
+    if instrument not in ["SASS", "ERS", "QuikSCAT", "ASCAT"]:
+        errmsg = "instrument should be one of 'SASS' " + "'ERS', 'QuikSCAT' or 'ASCAT'"
+        raise ValueError(errmsg)
+
+    path = climatology_path(climdir, instrument)
+    return ncfileio.DATASET_CACHE.get((path,), xr.open_dataset)
+
+
+def anomalies(ds, clim, standardize=False):
+    """
+    Subtract the climatology from the sig0 and sig0std values of ds.
+    clim should cover the same cells as ds, see box_climatology and
+    city_climatology.  With standardize=True the anomalies are divided
+    by the climatological std.
+    """
+
+    months = ds["time"].dt.month
+    anoms = {}
+    for var in VARIABLES:
+        if var not in ds.data_vars or var + "_mean" not in clim.data_vars:
+            continue
+        mean = clim[var + "_mean"].sel(month=months).drop_vars("month")
+        anoms[var] = ds[var] - mean
+        if standardize:
+            std = clim[var + "_std"].sel(month=months).drop_vars("month")
+            anoms[var] = anoms[var] / std.where(std > 0)
+
+    return xr.Dataset(anoms)
+
+
+def box_climatology(clim, ds):
+    """
+    Return the climatology for the cells of a box read with the loaders'
+    bbox option
+    """
+
+    return clim.reindex_like(ds, method="nearest", tolerance=cmgutils.GRDSIZE / 2.0)
+
+
+def city_climatology(clim, rows, cols):
+    """
+    Return the climatology for a batch of city boxes given by the CMG
+    row and column index arrays from cmgutils.box_indices, with the
+    (month, city, y, x) layout of dsutils.gather_boxes
+    """
+
+    names = [x for x in clim.data_vars if not x.endswith("_count")]
+    boxes = batch.gather(clim.rename(month="time"), rows, cols, names)
+    return boxes.rename(time="month")
+
+
+def iter_anomaly_boxes(ds, clim, rows, cols, chunk=CITY_CHUNK, standardize=False):
+    """
+    Generator yielding (first city, anomaly boxes) for chunks of the city
+    boxes given by the CMG row and column index arrays.  The boxes of
+    each chunk are gathered from ds and clim (see batch.gather) and the
+    climatology is subtracted, so memory depends on the chunk size.
+    """
+
+    rows = np.atleast_2d(rows)
+    cols = np.atleast_2d(cols)
+    for start in range(0, len(rows), chunk):
+        chunk_rows = rows[start : start + chunk]
+        chunk_cols = cols[start : start + chunk]
+        boxes = batch.gather(ds, chunk_rows, chunk_cols)
+        clim_boxes = city_climatology(clim, chunk_rows, chunk_cols)
+        yield start, anomalies(boxes, clim_boxes, standardize)
@@ -4,11 +4,22 @@
 # Functions related to the region of the Climate Modelling Grid (CMG)
 # used for the urban backscatter data.
 
+import numpy as np
 
 LONMIN = -180.0
 LATMIN = -60.0
 GRDSIZE = 0.05
 
+LONMAX = 180.0
+LATMAX = 90.0
+
+# number of grid rows (north to south) and columns (west to east)
+NROWS = int(round((LATMAX - LATMIN) / GRDSIZE))
+NCOLS = int(round((LONMAX - LONMIN) / GRDSIZE))
+
+# half-width in grid cells of the default 11x11 box
+HALFWIDTH = 5
+
 
 def box11(lon, lat, verbose=False):
 
@@ -27,3 +38,67 @@ def box11(lon, lat, verbose=False):
     lonmin = lon0 - 0.275
     lonmax = lon0 + 0.275
     return lonmin, latmin, lonmax, latmax
+
+
+def box_bounds(lon, lat, halfwidth=HALFWIDTH):
+
+    # bounding box (lonmin, latmin, lonmax, latmax) of the box of
+    # (2 * halfwidth + 1) x (2 * halfwidth + 1) cells around the cell
+    # containing lon/lat.  halfwidth=5 gives the box of box11.
+
+    if halfwidth < 0:
+        errmsg = "halfwidth should be zero or a positive number of cells"
+        raise ValueError(errmsg)
+
+    x0 = int((lon - LONMIN) / GRDSIZE)
+    y0 = int((lat - LATMIN) / GRDSIZE)
+
+    lon0 = (x0 * GRDSIZE + GRDSIZE / 2.0) + LONMIN
+    lat0 = (y0 * GRDSIZE + GRDSIZE / 2.0) + LATMIN
+    extent = (halfwidth + 0.5) * GRDSIZE
+    return lon0 - extent, lat0 - extent, lon0 + extent, lat0 + extent
+
+
+def grid_index(lon, lat):
+
+    # vectorized function which returns the integer (row, col)
+    # index of the CMG cell containing each lon/lat.  Rows count
+    # from the northern edge (LATMAX) so they follow the row order
+    # of the netcdf files, columns count east from LONMIN.  The
+    # cell is the same one used as the center cell in box11.
+
+    lon = np.asarray(lon, dtype="float64")
+    lat = np.asarray(lat, dtype="float64")
+
+    col = np.floor((lon - LONMIN) / GRDSIZE).astype("int64")
+    row = NROWS - 1 - np.floor((lat - LATMIN) / GRDSIZE).astype("int64")
+    return row, col
+
+
+def box_indices(lon, lat, halfwidth=HALFWIDTH):
+
+    # vectorized counterpart of box11 for arrays of city
+    # locations.  Returns (rows, cols) integer arrays of shape
+    # (ncity, 2 * halfwidth + 1) with the CMG row indices of each
+    # box from north to south and the column indices from west to
+    # east.  halfwidth=5 gives the same 11x11 box as box11.
+
+    if halfwidth < 0:
+        errmsg = "halfwidth should be zero or a positive number of cells"
+        raise ValueError(errmsg)
+
+    row, col = grid_index(np.atleast_1d(lon), np.atleast_1d(lat))
+    offsets = np.arange(-halfwidth, halfwidth + 1)
+    rows = row[:, np.newaxis] + offsets
+    cols = col[:, np.newaxis] + offsets
+    return rows, cols
+
+
+def cell_centers(rows, cols):
+
+    # return the lon/lat of the center of CMG cells given
+    # their row and column indices
+
+    lon = LONMIN + (np.asarray(cols) + 0.5) * GRDSIZE
+    lat = LATMAX - (np.asarray(rows) + 0.5) * GRDSIZE
+    return lon, lat
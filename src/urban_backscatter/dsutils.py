@@ -1,17 +1,31 @@
 import sys
 import os
+import shutil
 import argparse
 import datetime
+import numpy as np
 import pandas as pd
+import xarray as xr
 
 import urban_backscatter as ubs
+from . import profiling
 
+# conversion engines for the wide tables
+ENGINES = ["numpy", "pandas"]
 
-def seasonal_ds_to_df(ds, season, srctag, keep_nodata=False):
+# output table layouts and file formats (also used as file extensions)
+LAYOUTS = ["wide", "long"]
+FORMATS = ["csv", "parquet", "feather"]
+
+
+@profiling.profiled("seasonal_ds_to_df", "srctag")
+def seasonal_ds_to_df(ds, season, srctag, keep_nodata=False, engine="numpy"):
     """
     Take a xarray Dataset with seasonal mean and stddev sig0 values and
     convert it to a (wide) dataframe with mean and std for each year.
     The srctag parameter should be one of 'SASS', 'ERS', 'QSCAT', 'ASCAT'.
+    The default engine builds the table directly from the arrays, use
+    engine='pandas' for the original to_dataframe/pivot/merge path.
     """
 
     # check season
@@ -24,6 +38,14 @@ def seasonal_ds_to_df(ds, season, srctag, keep_nodata=False):
         errmsg = "instrument should be one of 'SASS', 'ERS', " + "'QSCAT' or 'ASCAT'"
         raise ValueError(errmsg)
 
+    if engine not in ENGINES:
+        errmsg = "engine should be one of 'numpy' or 'pandas'"
+        raise ValueError(errmsg)
+
+    if engine == "numpy":
+        mean_names, std_names = seasonal_colnames(ds["time"].values, season, srctag)
+        return wide_table(ds, mean_names, std_names, dropna=True)
+
     # convert mean sig0 DataArray to dataframe
     da = ds["sig0"]
     df_mean = da.to_dataframe()
@@ -92,3 +114,321 @@ def seasonal_ds_to_df(ds, season, srctag, keep_nodata=False):
     )
 
     return df_season
+
+
+def grid_offset(ds):
+    """
+    Return the CMG (row, col) index of the first lat/lon cell of a
+    Dataset.  Latitudes should run north to south as in the netcdf files.
+    """
+
+    lat = ds["lat"].values
+    if len(lat) > 1 and lat[0] < lat[-1]:
+        errmsg = "latitudes should be in descending (north to south) order"
+        raise ValueError(errmsg)
+
+    row, col = ubs.cmgutils.grid_index(ds["lon"].values[0], lat[0])
+    return int(row), int(col)
+
+
+@profiling.profiled("gather_boxes")
+def gather_boxes(ds, rows, cols, variables=("sig0", "sig0std")):
+    """
+    Pull the boxes for many cities out of a loaded (or memory-mapped)
+    Dataset in one fancy-indexing gather.  rows and cols are the CMG
+    index arrays returned by cmgutils.box_indices.  Returns a Dataset
+    with dimensions (time, city, y, x) and per-city lat/lon
+    coordinates.  Cells outside the Dataset are filled with NaN.
+    """
+
+    rows = np.atleast_2d(rows)
+    cols = np.atleast_2d(cols)
+
+    # positions in the Dataset arrays
+    row0, col0 = grid_offset(ds)
+    nlat = ds.sizes["lat"]
+    nlon = ds.sizes["lon"]
+    irow = rows - row0
+    icol = cols - col0
+    row_ok = (irow >= 0) & (irow < nlat)
+    col_ok = (icol >= 0) & (icol < nlon)
+    irow = np.clip(irow, 0, nlat - 1)
+    icol = np.clip(icol, 0, nlon - 1)
+    valid = row_ok[:, :, np.newaxis] & col_ok[:, np.newaxis, :]
+
+    data_vars = {}
+    for var in variables:
+        cube = ds[var].transpose("time", "lat", "lon").values
+        boxes = cube[:, irow[:, :, np.newaxis], icol[:, np.newaxis, :]]
+        if not valid.all():
+            boxes = np.where(valid, boxes, np.nan)
+        data_vars[var] = (("time", "city", "y", "x"), boxes)
+
+    # use the Dataset coordinates where available
+    lon, lat = ubs.cmgutils.cell_centers(rows, cols)
+    lat = np.where(row_ok, ds["lat"].values[irow], lat)
+    lon = np.where(col_ok, ds["lon"].values[icol], lon)
+
+    coords = {
+        "time": ds["time"].values,
+        "lat": (("city", "y"), lat),
+        "lon": (("city", "x"), lon),
+    }
+    if "spatial_ref" in ds.coords:
+        coords["spatial_ref"] = ds["spatial_ref"]
+
+    return xr.Dataset(data_vars, coords=coords)
+
+
+def city_box(boxes, city):
+    """
+    Return the box for one city from the output of gather_boxes as a
+    (time, lat, lon) Dataset, the same shape as the box selected with
+    the loaders' bbox option.
+    """
+
+    return boxes.isel(city=city).swap_dims({"y": "lat", "x": "lon"})
+
+
+@profiling.profiled("monthly_ds_to_df", "srctag")
+def monthly_ds_to_df(sig0_monthly, srctag, engine="numpy"):
+    """
+    Take a xarray DataSet with monthly sig0 mean and StdDev values and
+    convert it to a (wide) dataframe with mean and std for each time
+    period.  The srctag parameter should be one of 'SASS', 'ERS',
+    'QuikSCAT', 'ASCAT'.  The default engine builds the table directly
+    from the arrays, use engine='pandas' for the original
+    to_dataframe/pivot/merge path.
+    """
+
+    # check srctag
+    if srctag not in ["SASS", "ERS", "QuikSCAT", "ASCAT"]:
+        errmsg = (
+            "instrument should be one of 'SASS', "
+            + "'ERS', 'QuikSCAT',"
+            + " or 'ASCAT'"
+        )
+        raise ValueError(errmsg)
+
+    if engine not in ENGINES:
+        errmsg = "engine should be one of 'numpy' or 'pandas'"
+        raise ValueError(errmsg)
+
+    if engine == "numpy":
+        mean_names, std_names = monthly_colnames(sig0_monthly["time"].values, srctag)
+        return wide_table(sig0_monthly, mean_names, std_names, dropna=False)
+
+    # extract sig0 DataArray from dataset
+    sig0_monthly_mean = sig0_monthly["sig0"]
+    sig0_monthly_std = sig0_monthly["sig0std"]
+
+    # convert DataArray to dataframe
+    df = sig0_monthly_mean.to_dataframe()
+    df_test = df.reset_index()
+
+    # convert from long to wide format
+    df_wide = df_test.pivot(
+        index=["lat", "lon"], columns="time", values="sig0"
+    ).reset_index()
+    column_list = list(df_wide.columns[2:])
+
+    # rename columns to match earthengine outputs
+    time_colnames = [
+        srctag + str(x.year) + "_" + "{:02d}".format(x.month) + "_mean"
+        for x in column_list
+    ]
+    newcolnames = ("latitude", "longitude") + tuple(time_colnames)
+    df_wide.columns = newcolnames
+
+    # reduce sigfigs for output
+    col_sigfigs = {}
+    for col in df_wide.columns:
+        if srctag in col:
+            col_sigfigs[col] = 3
+        else:
+            col_sigfigs[col] = 4
+    df_mean = df_wide.round(col_sigfigs)
+
+    # repeat for std()
+
+    # convert DataArray to dataframe
+    df = sig0_monthly_std.to_dataframe()
+    df_test = df.reset_index()
+
+    # convert from long to wide format
+    df_wide = df_test.pivot(
+        index=["lat", "lon"], columns="time", values="sig0std"
+    ).reset_index()
+    column_list = list(df_wide.columns[2:])
+
+    # rename columns to match earthengine outputs
+    time_colnames = [
+        srctag + str(x.year) + "_" + "{:02d}".format(x.month) + "_std"
+        for x in column_list
+    ]
+    newcolnames = ("latitude", "longitude") + tuple(time_colnames)
+    df_wide.columns = newcolnames
+
+    # reduce sigfigs for output
+    col_sigfigs = {}
+    for col in df_wide.columns:
+        if srctag in col:
+            col_sigfigs[col] = 3
+        else:
+            col_sigfigs[col] = 4
+    df_std = df_wide.round(col_sigfigs)
+
+    # merge two dataframes
+    df = pd.merge(df_mean, df_std, on=["latitude", "longitude"])
+
+    # reorder columns
+    newcols = ["latitude", "longitude"] + sorted(df.columns[2:])
+    df = df[newcols]
+    df.sort_values(by=["latitude", "longitude"], ascending=[False, True], inplace=True)
+
+    return df
+
+
+def seasonal_colnames(times, season, srctag):
+    """
+    Return the mean and std column names used by seasonal_ds_to_df for
+    each time step.
+    """
+
+    years = pd.DatetimeIndex(times).year
+    mean_names = [srctag + str(x) + "_{}_mean".format(season) for x in years]
+    std_names = [srctag + str(x) + "_{}_std".format(season) for x in years]
+    return mean_names, std_names
+
+
+def monthly_colnames(times, srctag):
+    """
+    Return the mean and std column names used by monthly_ds_to_df for
+    each time step.
+    """
+
+    prefixes = [
+        srctag + str(x.year) + "_" + "{:02d}".format(x.month)
+        for x in pd.DatetimeIndex(times)
+    ]
+    mean_names = [x + "_mean" for x in prefixes]
+    std_names = [x + "_std" for x in prefixes]
+    return mean_names, std_names
+
+
+def wide_table(ds, mean_names, std_names, dropna=False):
+    """
+    Build the wide table (one row per grid cell, one column per time
+    step and variable) for the sig0 and sig0std variables of ds directly
+    from the (time, lat, lon) arrays.  mean_names and std_names are the
+    column names for each time step.  With dropna=True cells and time
+    steps without any data are left out, matching the dropna() in the
+    pandas path of seasonal_ds_to_df.  Rows are sorted by latitude
+    (descending) and longitude, and values are rounded as in the pandas
+    path so the CSV output is identical.
+    """
+
+    lat = ds["lat"].values
+    lon = ds["lon"].values
+    ncell = len(lat) * len(lon)
+    cell_lat = np.repeat(lat, len(lon))
+    cell_lon = np.tile(lon, len(lat))
+
+    # rows ordered by latitude (descending) and longitude
+    order = np.lexsort((cell_lon, -cell_lat))
+
+    keep_rows = np.ones(ncell, dtype=bool)
+    blocks = []
+    names = []
+    for var, colnames in [("sig0", mean_names), ("sig0std", std_names)]:
+        values = ds[var].transpose("time", "lat", "lon").values
+        values = values.reshape(len(colnames), ncell)[:, order]
+        if dropna:
+            valid = ~np.isnan(values)
+            keep_rows &= valid.any(axis=0)
+            keep_cols = valid.any(axis=1)
+            values = values[keep_cols]
+            colnames = [x for x, keep in zip(colnames, keep_cols) if keep]
+        blocks.append(values)
+        names.extend(colnames)
+
+    # sort columns by name as in the pandas path and transpose to rows
+    colorder = sorted(range(len(names)), key=names.__getitem__)
+    values = np.concatenate(blocks)[colorder].T[keep_rows]
+    values = np.round(values, 3)
+
+    df_cells = pd.DataFrame(
+        {
+            "latitude": np.round(cell_lat[order][keep_rows], 4),
+            "longitude": np.round(cell_lon[order][keep_rows], 4),
+        }
+    )
+    df_values = pd.DataFrame(values, columns=[names[i] for i in colorder])
+    return pd.concat([df_cells, df_values], axis=1)
+
+
+@profiling.profiled("long_table", "instrument")
+def long_table(ds, instrument, dropna=True):
+    """
+    Build the long table (one row per grid cell and time step) with
+    columns latitude, longitude, instrument, time, sig0, sig0std
+    directly from the (time, lat, lon) arrays of ds.  Rows are sorted by
+    latitude (descending), longitude and time, values are rounded as in
+    the wide tables.  With dropna=True rows where both sig0 and sig0std
+    are missing are left out.
+    """
+
+    lat = ds["lat"].values
+    lon = ds["lon"].values
+    time = ds["time"].values
+    ncell = len(lat) * len(lon)
+    ntime = len(time)
+
+    # cells ordered by latitude (descending) and longitude
+    cell_lat = np.repeat(lat, len(lon))
+    cell_lon = np.tile(lon, len(lat))
+    order = np.lexsort((cell_lon, -cell_lat))
+
+    columns = {
+        "latitude": np.repeat(np.round(cell_lat[order], 4), ntime),
+        "longitude": np.repeat(np.round(cell_lon[order], 4), ntime),
+        "instrument": np.full(ncell * ntime, instrument, dtype=object),
+        "time": np.tile(time, ncell),
+    }
+    for var in ["sig0", "sig0std"]:
+        values = ds[var].transpose("time", "lat", "lon").values
+        values = values.reshape(ntime, ncell)[:, order].T.ravel()
+        columns[var] = np.round(values, 3)
+
+    df = pd.DataFrame(columns)
+    if dropna:
+        keep = ~(np.isnan(columns["sig0"]) & np.isnan(columns["sig0std"]))
+        df = df[keep].reset_index(drop=True)
+    return df
+
+
+@profiling.profiled("write_table")
+def write_table(df, outpath, fmt="csv", partition_cols=None):
+    """
+    Write a wide or long table as csv (with -9999.0 for missing values),
+    parquet or feather.  partition_cols writes a partitioned parquet
+    dataset (a directory) instead of a single file.
+    """
+
+    if fmt not in FORMATS:
+        errmsg = "format should be one of 'csv', 'parquet' or 'feather'"
+        raise ValueError(errmsg)
+
+    if fmt == "csv":
+        df.to_csv(outpath, na_rep="-9999.0", index=False)
+    elif fmt == "parquet":
+        # a partitioned dataset adds new files to an existing directory
+        if partition_cols and os.path.isdir(outpath):
+            shutil.rmtree(outpath)
+        df.to_parquet(outpath, index=False, partition_cols=partition_cols)
+    else:
+        df.reset_index(drop=True).to_feather(outpath)
+
+    timer = profiling.current()
+    if timer.enabled:
+        timer.add_bytes(profiling.path_bytes(outpath))
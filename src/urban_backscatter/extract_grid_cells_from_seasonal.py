@@ -14,7 +14,6 @@ import sys
 import os
 import argparse
 import datetime
-import pandas as pd
 
 import urban_backscatter as ubs
 
@@ -33,10 +32,12 @@ if __name__ == "__main__":
     parser.add_argument(
         "-s",
         "--season",
-        nargs=1,
-        choices=["JFM", "AMJ", "JAS", "OND"],
-        help="season/quarter to select",
-        default=["JAS"],
+        action="append",
+        choices=["JFM", "AMJ", "JAS", "OND", "all"],
+        help=(
+            "season/quarter to select (default: JAS). Repeat for several"
+            + " seasons or use 'all' for all four"
+        ),
     )
 
     # add command options
@@ -64,6 +65,39 @@ if __name__ == "__main__":
         default="./data",
     )
 
+    parser.add_argument(
+        "--format",
+        choices=["csv", "parquet", "feather"],
+        help="output file format. Default: csv",
+        default="csv",
+    )
+
+    parser.add_argument(
+        "--layout",
+        choices=["wide", "long"],
+        help=(
+            "wide (one row per grid cell) or long (one row per grid cell"
+            + " and time step) output table. Default: wide"
+        ),
+        default="wide",
+    )
+
+    parser.add_argument(
+        "--profile",
+        help=(
+            "print the time, bytes read/written and peak memory of each"
+            + " stage and write a JSON trace (see --trace)"
+        ),
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--trace",
+        help="JSON trace file for --profile. Default: <locname>_profile.json",
+        default=None,
+    )
+
     # add positional arguments
     parser.add_argument("lat", type=float, help="Latitude of location")
 
@@ -72,118 +106,156 @@ if __name__ == "__main__":
     parser.add_argument("locname", help="location name")
 
     args = parser.parse_args()
+
+    # imported after parsing, so --help and usage errors return quickly
+    import pandas as pd
+
+    if args.profile:
+        ubs.profiling.enable()
+
     verbose = args.verbose
-    season = args.season[0]
+    if args.season is None:
+        seasons = ["JAS"]
+    elif "all" in args.season:
+        seasons = ubs.ncfileio.SEASON_LIST
+    else:
+        seasons = [x for x in ubs.ncfileio.SEASON_LIST if x in args.season]
     lat = args.lat
     lon = args.lon
     locname = args.locname
     # withsass = args.with_sass
     withsass = False
     datadir = args.datadir
+    fmt = args.format
+    layout = args.layout
 
     if verbose:
         today = datetime.date.today()
         print("date: {}".format(today))
-        print("season: {}".format(season))
+        print("seasons: {}".format(" ".join(seasons)))
         print("location: {} {}".format(lon, lat))
         print("name: {}".format(locname))
         # print("include SASS: {}".format(withsass))
         print("data directory: {}".format(datadir))
+        print("output: {} {}".format(layout, fmt))
 
     # get 11x11 box around center location
-    lonmin, latmin, lonmax, latmax = ubs.cmgutils.box11(lon, lat, verbose=True)
+    bbox = ubs.cmgutils.box11(lon, lat, verbose=True)
+    lonmin, latmin, lonmax, latmax = bbox
 
     if verbose:
         print("Bounding Box:  {} {} {} {}".format(lonmin, latmin, lonmax, latmax))
 
+    # read each instrument once for all requested seasons
     if withsass:
         # extract SeaSAT data
-        sass_data = ubs.ncfileio.get_seasonal_data(
-            datadir, "SASS", season=season, masked=False, verbose=True
-        )
-
-        # subset DataSet
-        sass_data_subset = sass_data.sel(
-            lon=slice(lonmin, lonmax), lat=slice(latmax, latmin),
+        sass_data = ubs.ncfileio.get_all_seasons_data(
+            datadir, "SASS", seasons=seasons, masked=False, verbose=True, bbox=bbox
         )
-        if verbose:
-            print("SASS data size: {}".format(sass_data_subset["sig0"].shape))
-
-        sass_df = ubs.dsutils.seasonal_ds_to_df(sass_data_subset, season, "SASS")
-
-        if verbose:
-            print(sass_df.head())
 
     # extract ERS1/2 data
-    ers_data = ubs.ncfileio.get_seasonal_data(
-        datadir, "ERS", season=season, masked=False, verbose=True
+    ers_data = ubs.ncfileio.get_all_seasons_data(
+        datadir, "ERS", seasons=seasons, masked=False, verbose=True, bbox=bbox
     )
 
-    # subset DataSet
-    ers_data_subset = ers_data.sel(
-        lon=slice(lonmin, lonmax), lat=slice(latmax, latmin),
+    # extract QSCAT data
+    qscat_data = ubs.ncfileio.get_all_seasons_data(
+        datadir, "QuikSCAT", seasons=seasons, masked=False, verbose=True, bbox=bbox
     )
-    if verbose:
-        print("ERS data size: {}".format(ers_data_subset["sig0"].shape))
 
-    ers_df = ubs.dsutils.seasonal_ds_to_df(ers_data_subset, season, "ERS")
+    # extract ASCAT data
+    ascat_data = ubs.ncfileio.get_all_seasons_data(
+        datadir, "ASCAT", seasons=seasons, masked=False, verbose=True, bbox=bbox
+    )
 
-    if verbose:
-        print(ers_df.head())
+    for season in seasons:
+        if withsass:
+            if verbose:
+                print("SASS data size: {}".format(sass_data[season]["sig0"].shape))
 
-    # extract QSCAT data
-    qscat_data = ubs.ncfileio.get_seasonal_data(
-        datadir, "QuikSCAT", season=season, masked=False, verbose=True
-    )
+            if layout == "wide":
+                sass_df = ubs.dsutils.seasonal_ds_to_df(
+                    sass_data[season], season, "SASS"
+                )
+            else:
+                sass_df = ubs.dsutils.long_table(sass_data[season], "SASS")
 
-    # subset DataSet
-    qscat_data_subset = qscat_data.sel(
-        lon=slice(lonmin, lonmax), lat=slice(latmax, latmin),
-    )
-    if verbose:
-        print("QSCAT data size: {}".format(qscat_data_subset["sig0"].shape))
+            if verbose:
+                print(sass_df.head())
 
-    qscat_df = ubs.dsutils.seasonal_ds_to_df(qscat_data_subset, season,
-                                             "QSCAT")
+        if verbose:
+            print("ERS data size: {}".format(ers_data[season]["sig0"].shape))
 
-    if verbose:
-        print(qscat_df.head())
+        if layout == "wide":
+            ers_df = ubs.dsutils.seasonal_ds_to_df(ers_data[season], season, "ERS")
+        else:
+            ers_df = ubs.dsutils.long_table(ers_data[season], "ERS")
 
-    # extract ASCAT data
-    ascat_data = ubs.ncfileio.get_seasonal_data(
-        datadir, "ASCAT", season=season, masked=False, verbose=True
-    )
+        if verbose:
+            print(ers_df.head())
 
-    # subset DataSet
-    ascat_data_subset = ascat_data.sel(
-        lon=slice(lonmin, lonmax), lat=slice(latmax, latmin),
-    )
-    if verbose:
-        print("ASCAT data size: {}".format(ascat_data_subset["sig0"].shape))
+        if verbose:
+            print("QSCAT data size: {}".format(qscat_data[season]["sig0"].shape))
 
-    ascat_df = ubs.dsutils.seasonal_ds_to_df(ascat_data_subset, season, "ASCAT")
+        if layout == "wide":
+            qscat_df = ubs.dsutils.seasonal_ds_to_df(
+                qscat_data[season], season, "QSCAT"
+            )
+        else:
+            qscat_df = ubs.dsutils.long_table(qscat_data[season], "QuikSCAT")
 
-    if verbose:
-        print(ascat_df.head())
+        if verbose:
+            print(qscat_df.head())
 
-    # merge data from all four/three instruments
-    if withsass:
-        df = pd.merge(sass_df, ers_df, how="left", on=["latitude", "longitude"])
-    else:
-        df = ers_df
+        if verbose:
+            print("ASCAT data size: {}".format(ascat_data[season]["sig0"].shape))
 
-    df1 = pd.merge(df, qscat_df, how="left", on=["latitude", "longitude"])
+        if layout == "wide":
+            ascat_df = ubs.dsutils.seasonal_ds_to_df(
+                ascat_data[season], season, "ASCAT"
+            )
+        else:
+            ascat_df = ubs.dsutils.long_table(ascat_data[season], "ASCAT")
 
-    df2 = pd.merge(df1, ascat_df, how="left", on=["latitude", "longitude"])
+        if verbose:
+            print(ascat_df.head())
+
+        # merge data from all four/three instruments
+        with ubs.profiling.stage("merge_instruments"):
+            if layout == "long":
+                dfs = [ers_df, qscat_df, ascat_df]
+                if withsass:
+                    dfs.insert(0, sass_df)
+                df2 = pd.concat(dfs, ignore_index=True)
+            else:
+                if withsass:
+                    df = pd.merge(
+                        sass_df, ers_df, how="left", on=["latitude", "longitude"]
+                    )
+                else:
+                    df = ers_df
+
+                df1 = pd.merge(df, qscat_df, how="left", on=["latitude", "longitude"])
+
+                df2 = pd.merge(df1, ascat_df, how="left", on=["latitude", "longitude"])
 
-    if verbose:
-        print(df2.head())
-        print(df2.columns)
-
-    # write out CSV
-    outdir = os.path.join(datadir, "csv")
-    if not os.path.isdir(outdir):
-        os.makedirs(outdir)
-    outname = "{}_bs_grid_{}.csv".format(locname, season)
-    outpath = os.path.join(outdir, outname)
-    df2.to_csv(outname, na_rep="-9999.0", index=False)
+        if verbose:
+            print(df2.head())
+            print(df2.columns)
+
+        # write out CSV (or parquet/feather)
+        outdir = os.path.join(datadir, "csv")
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        if layout == "long":
+            outname = "{}_bs_grid_{}_long.{}".format(locname, season, fmt)
+        else:
+            outname = "{}_bs_grid_{}.{}".format(locname, season, fmt)
+        outpath = os.path.join(outdir, outname)
+        ubs.dsutils.write_table(df2, outname, fmt)
+
+    if args.profile:
+        print(ubs.profiling.format_summary())
+        trace = args.trace or "{}_profile.json".format(locname)
+        ubs.profiling.write_trace(trace)
+        print("trace written to {}".format(trace))
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Streaming export of the wide grid cell tables for the whole CMG grid or
+a large region.  The grid is walked in bands of latitude rows and the
+table is written one band at a time, so memory use depends on the band
+size and not on the size of the region.
+"""
+
+import sys
+import argparse
+import datetime
+
+import numpy as np
+
+import urban_backscatter as ubs
+from urban_backscatter import batch
+
+# number of latitude rows converted at a time
+BAND_ROWS = 16
+
+# formats that can be written one block at a time
+STREAM_FORMATS = ["csv", "parquet"]
+
+
+def iter_bands(ds, band_rows=BAND_ROWS):
+    """
+    Yield (start, stop) latitude row ranges covering ds
+    """
+
+    if band_rows < 1:
+        errmsg = "band_rows should be at least 1"
+        raise ValueError(errmsg)
+
+    nlat = ds.sizes["lat"]
+    for start in range(0, nlat, band_rows):
+        yield start, min(start + band_rows, nlat)
+
+
+def valid_times(ds, band_rows=BAND_ROWS):
+    """
+    Return a dictionary with a boolean array for sig0 and sig0std
+    telling which time steps have data anywhere in ds, reading ds one
+    band at a time.
+    """
+
+    ntime = ds.sizes["time"]
+    valid = {var: np.zeros(ntime, dtype=bool) for var in ["sig0", "sig0std"]}
+    for start, stop in iter_bands(ds, band_rows):
+        band = ds.isel(lat=slice(start, stop))
+        for var in valid:
+            values = band[var].transpose("time", "lat", "lon").values
+            valid[var] |= ~np.isnan(values.reshape(ntime, -1)).all(axis=1)
+    return valid
+
+
+def table_columns(ds, mode, srctag, season=None, valid=None):
+    """
+    Return the columns of the wide table for all of ds in the order used
+    by seasonal_ds_to_df and monthly_ds_to_df.  For seasonal tables the
+    time steps without data in valid (see valid_times) are left out, as
+    the dropna() in seasonal_ds_to_df does.
+    """
+
+    times = ds["time"].values
+    if mode == "monthly":
+        mean_names, std_names = ubs.dsutils.monthly_colnames(times, srctag)
+    else:
+        mean_names, std_names = ubs.dsutils.seasonal_colnames(times, season, srctag)
+        if valid is not None:
+            mean_names = [x for x, keep in zip(mean_names, valid["sig0"]) if keep]
+            std_names = [x for x, keep in zip(std_names, valid["sig0std"]) if keep]
+
+    return ["latitude", "longitude"] + sorted(mean_names + std_names)
+
+
+def iter_table_blocks(datasets, mode, season=None, band_rows=BAND_ROWS, progress=None):
+    """
+    Generator yielding the wide table for datasets, a list of (ds,
+    srctag) pairs on the same grid, one band of latitude rows at a time.
+    The tables of the instruments are merged with a left join as in the
+    extract scripts, and the blocks have the same columns (and the rows
+    the same values) as converting the whole region at once with
+    seasonal_ds_to_df or monthly_ds_to_df.  The datasets may be lazy,
+    only one band is read at a time.  progress(rows_done, rows_total)
+    is called after each block has been consumed.
+    """
+
+    if mode not in batch.MODES:
+        errmsg = "mode should be one of 'monthly' or 'seasonal'"
+        raise ValueError(errmsg)
+
+    if mode == "seasonal" and season not in ubs.ncfileio.SEASON_LIST:
+        errmsg = "season should be one of 'JFM', 'AMJ', 'JAS' or 'OND'"
+        raise ValueError(errmsg)
+
+    # columns of the whole table, seasonal tables need a pass over the data
+    columns = []
+    for ds, srctag in datasets:
+        if mode == "seasonal":
+            valid = valid_times(ds, band_rows)
+        else:
+            valid = None
+        columns.append(table_columns(ds, mode, srctag, season, valid))
+
+    ds0 = datasets[0][0]
+    # raises if the latitudes do not run north to south as the bands assume
+    ubs.dsutils.grid_offset(ds0)
+    lat = ds0["lat"].values
+    for start, stop in iter_bands(ds0, band_rows):
+        df = None
+        for (ds, srctag), cols in zip(datasets, columns):
+            # select by latitude so instruments with other extents line up
+            band = ds.sel(lat=slice(lat[start], lat[stop - 1])).load()
+            if mode == "monthly":
+                df2 = ubs.dsutils.monthly_ds_to_df(band, srctag)
+            else:
+                df2 = ubs.dsutils.seasonal_ds_to_df(band, season, srctag)
+            # keep the dtype of the values for columns missing in this band
+            dtype = np.result_type(band["sig0"].dtype, band["sig0std"].dtype)
+            df2 = df2.reindex(columns=cols).astype({x: dtype for x in cols[2:]})
+            if df is None:
+                df = df2
+            else:
+                df = df.merge(df2, how="left", on=["latitude", "longitude"])
+
+        yield df
+        if progress is not None:
+            progress(stop, len(lat))
+
+
+def export_table(
+    datasets,
+    outpath,
+    mode,
+    season=None,
+    fmt="csv",
+    band_rows=BAND_ROWS,
+    progress=None,
+):
+    """
+    Write the wide table for datasets (see iter_table_blocks) to a csv
+    or parquet file, appending one band of latitude rows at a time.
+    Returns the number of rows written.
+    """
+
+    if fmt not in STREAM_FORMATS:
+        errmsg = "format should be one of 'csv' or 'parquet'"
+        raise ValueError(errmsg)
+
+    blocks = iter_table_blocks(datasets, mode, season, band_rows, progress)
+
+    nrows = 0
+    if fmt == "csv":
+        with open(outpath, "w", newline="") as fp:
+            for i, df in enumerate(blocks):
+                df.to_csv(fp, header=(i == 0), na_rep="-9999.0", index=False)
+                nrows += len(df)
+        return nrows
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for df in blocks:
+            if writer is None:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                writer = pq.ParquetWriter(outpath, table.schema)
+            else:
+                table = pa.Table.from_pandas(
+                    df, schema=writer.schema, preserve_index=False
+                )
+            writer.write_table(table)
+            nrows += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return nrows
+
+
+def load_datasets(
+    datadir, mode, season=None, instruments=None, cubedir=None, bbox=None
+):
+    """
+    Open the (lazy) datasets of the instruments for a mode and return a
+    list of (ds, srctag) pairs for iter_table_blocks, optionally limited
+    to bbox = (lonmin, latmin, lonmax, latmax).
+    """
+
+    if mode == "monthly":
+        data = batch.load_monthly(datadir, cubedir=cubedir)
+        srctags = {x: y[0] for x, y in batch.MONTHLY_INSTRUMENTS.items()}
+    else:
+        seasonal_data = batch.load_seasonal(datadir, [season], cubedir=cubedir)
+        data = {x: y[season] for x, y in seasonal_data.items()}
+        srctags = batch.SEASONAL_INSTRUMENTS
+
+    if instruments is None:
+        instruments = list(srctags)
+
+    datasets = []
+    for instrument in instruments:
+        ds = data[instrument]
+        if bbox is not None:
+            ds = ubs.ncfileio.subset_bbox(ds, bbox, load=False)
+        datasets.append((ds, srctags[instrument]))
+    return datasets
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description=(
+            "write a table with values for each grid cell of the CMG grid"
+            + " or a region of it, one band of rows at a time."
+        )
+    )
+
+    parser.add_argument(
+        "-m",
+        "--mode",
+        choices=batch.MODES,
+        help="export monthly or seasonal values. Default: seasonal",
+        default="seasonal",
+    )
+
+    parser.add_argument(
+        "-s",
+        "--season",
+        choices=ubs.ncfileio.SEASON_LIST,
+        help="season/quarter to select. Default: JAS",
+        default="JAS",
+    )
+
+    parser.add_argument(
+        "-i",
+        "--instrument",
+        action="append",
+        choices=list(batch.SEASONAL_INSTRUMENTS),
+        help="instrument to export, repeat for several. Default: all",
+    )
+
+    parser.add_argument(
+        "-b",
+        "--bbox",
+        type=float,
+        nargs=4,
+        metavar=("LONMIN", "LATMIN", "LONMAX", "LATMAX"),
+        help="only export the grid cells inside this box",
+        default=None,
+    )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        help="increase output verbosity",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "-d",
+        "--datadir",
+        help="directory with the netcdf files. Default: ./data",
+        default="./data",
+    )
+
+    parser.add_argument(
+        "-c",
+        "--cubedir",
+        help="read the memory-mapped cubes in CUBEDIR instead of the netcdf files",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--format",
+        choices=STREAM_FORMATS,
+        help="output file format. Default: csv",
+        default="csv",
+    )
+
+    parser.add_argument(
+        "-r",
+        "--rows",
+        type=int,
+        help="latitude rows per band. Default: {}".format(BAND_ROWS),
+        default=BAND_ROWS,
+    )
+
+    # add positional arguments
+    parser.add_argument("outpath", help="output file")
+
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+    verbose = args.verbose
+
+    if verbose:
+        today = datetime.date.today()
+        print("date: {}".format(today))
+        print("mode: {}".format(args.mode))
+        print("data directory: {}".format(args.datadir))
+        print("output file: {}".format(args.outpath))
+
+    datasets = load_datasets(
+        args.datadir,
+        args.mode,
+        season=args.season,
+        instruments=args.instrument,
+        cubedir=args.cubedir,
+        bbox=args.bbox,
+    )
+
+    def progress(done, total):
+        print("rows {}/{}".format(done, total))
+
+    nrows = export_table(
+        datasets,
+        args.outpath,
+        args.mode,
+        season=args.season,
+        fmt=args.format,
+        band_rows=args.rows,
+        progress=progress if verbose else None,
+    )
+
+    if verbose:
+        print("wrote {} grid cells to {}".format(nrows, args.outpath))
+
+    return 0
+
+
+def run():
+    sys.exit(main(sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Cross-instrument harmonization of the monthly cubes.  For every grid
+cell the offset (and optionally the gain) mapping ERS onto QuikSCAT and
+QuikSCAT onto ASCAT is estimated from the months both instruments
+observed, in one pass over bands of rows of the aligned cubes.  The
+coefficients, chained so ERS and QuikSCAT map onto ASCAT, are saved as
+a grid and used to build a continuous 1993-2020 series for any box or
+batch of city boxes.
+"""
+
+import sys
+import argparse
+import datetime
+
+import numpy as np
+import xarray as xr
+
+import urban_backscatter as ubs
+from urban_backscatter import batch
+
+# instruments from newest (the reference) to oldest, each one is
+# fitted to the one before it over their overlap months
+CHAIN = ["ASCAT", "QuikSCAT", "ERS"]
+
+# number of latitude rows read at a time
+BAND_ROWS = 64
+
+# smallest number of overlap months for a fit
+MIN_OVERLAP = 6
+
+
+def fit_pair(src, ref, gains=False, min_count=MIN_OVERLAP):
+    """
+    Fit ref = gain * src + offset for each cell of (time, ...) arrays of
+    the overlap months, using the months where both are valid.  Without
+    gains only the mean offset is fitted and gain is 1.  Returns gain,
+    offset and count arrays, cells with fewer than min_count months get
+    NaN coefficients.
+    """
+
+    valid = ~np.isnan(src) & ~np.isnan(ref)
+    x = np.where(valid, src, 0.0).astype("float64")
+    y = np.where(valid, ref, 0.0).astype("float64")
+    n = valid.sum(axis=0)
+    sx = x.sum(axis=0)
+    sy = y.sum(axis=0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if gains:
+            sxx = (x * x).sum(axis=0)
+            sxy = (x * y).sum(axis=0)
+            gain = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+        else:
+            gain = np.ones(n.shape)
+        offset = (sy - gain * sx) / n
+
+    bad = (n < min_count) | ~np.isfinite(gain)
+    gain[bad] = np.nan
+    offset[bad] = np.nan
+    return gain, offset, n
+
+
+def overlap(ds1, ds2):
+    """
+    Return the positions of the time steps of ds1 and ds2 falling in the
+    same year and month
+    """
+
+    months1 = ds1["time"].values.astype("datetime64[M]")
+    months2 = ds2["time"].values.astype("datetime64[M]")
+    _, pos1, pos2 = np.intersect1d(months1, months2, return_indices=True)
+    return pos1, pos2
+
+
+def build_coefficients(datasets, gains=False, band_rows=BAND_ROWS, verbose=False):
+    """
+    Estimate the harmonization coefficients from a dictionary of monthly
+    datasets keyed by instrument (as returned by batch.load_monthly) on
+    the same grid.  Returns a (lat, lon) Dataset with <instrument>_gain,
+    <instrument>_offset and <instrument>_count variables mapping ERS and
+    QuikSCAT onto ASCAT.
+    """
+
+    reference = datasets[CHAIN[0]]
+    nlat, nlon = reference.sizes["lat"], reference.sizes["lon"]
+    lat = reference["lat"].values
+
+    # overlap months of each pair, src onto the instrument before it
+    pairs = list(zip(CHAIN[:-1], CHAIN[1:]))
+    positions = [overlap(datasets[ref], datasets[src]) for ref, src in pairs]
+    if verbose:
+        for (ref_name, src_name), (ref_pos, _) in zip(pairs, positions):
+            print(
+                "fitting {} to {} over {} months".format(
+                    src_name, ref_name, len(ref_pos)
+                )
+            )
+
+    # each instrument is read once per band, over the months of all its
+    # overlaps, and the pairs index into that band
+    steps = {name: [] for name in CHAIN}
+    for (ref_name, src_name), (ref_pos, src_pos) in zip(pairs, positions):
+        steps[ref_name].append(ref_pos)
+        steps[src_name].append(src_pos)
+    steps = {name: np.unique(np.concatenate(pos)) for name, pos in steps.items()}
+    positions = [
+        (np.searchsorted(steps[ref], ref_pos), np.searchsorted(steps[src], src_pos))
+        for (ref, src), (ref_pos, src_pos) in zip(pairs, positions)
+    ]
+
+    fits = {
+        src_name: (
+            np.full((nlat, nlon), np.nan),
+            np.full((nlat, nlon), np.nan),
+            np.zeros((nlat, nlon), dtype="int32"),
+        )
+        for _, src_name in pairs
+    }
+    for start in range(0, nlat, band_rows):
+        stop = min(start + band_rows, nlat)
+        lat_slice = slice(lat[start], lat[stop - 1])
+        band = {
+            name: datasets[name]["sig0"]
+            .isel(time=steps[name])
+            .sel(lat=lat_slice)
+            .transpose("time", "lat", "lon")
+            .values
+            for name in CHAIN
+        }
+        for (ref_name, src_name), (ref_pos, src_pos) in zip(pairs, positions):
+            fit = fit_pair(band[src_name][src_pos], band[ref_name][ref_pos], gains)
+            for out, values in zip(fits[src_name], fit):
+                out[start:stop] = values
+
+    # chain the pairs so every instrument maps onto the reference
+    data_vars = {}
+    total_gain = np.ones((nlat, nlon))
+    total_offset = np.zeros((nlat, nlon))
+    for src_name in CHAIN[1:]:
+        gain, offset, count = fits[src_name]
+        total_offset = total_gain * offset + total_offset
+        total_gain = total_gain * gain
+        data_vars[src_name + "_gain"] = (("lat", "lon"), total_gain.astype("float32"))
+        data_vars[src_name + "_offset"] = (
+            ("lat", "lon"),
+            total_offset.astype("float32"),
+        )
+        data_vars[src_name + "_count"] = (("lat", "lon"), count)
+
+    coords = {"lat": lat, "lon": reference["lon"].values}
+    if "spatial_ref" in reference.coords:
+        coords["spatial_ref"] = reference["spatial_ref"]
+    coeffs = xr.Dataset(data_vars, coords=coords)
+    coeffs.attrs["reference"] = CHAIN[0]
+    coeffs.attrs["gains"] = int(gains)
+    return coeffs
+
+
+def box_coefficients(coeffs, ds):
+    """
+    Return the coefficients for the cells of a (time, lat, lon) box read
+    with the loaders' bbox option
+    """
+
+    return coeffs.reindex_like(
+        ds, method="nearest", tolerance=ubs.cmgutils.GRDSIZE / 2.0
+    )
+
+
+def city_coefficients(coeffs, rows, cols):
+    """
+    Return the coefficients for a batch of city boxes given by the CMG
+    row and column index arrays from cmgutils.box_indices, with the
+    (city, y, x) layout of dsutils.gather_boxes
+    """
+
+    names = [x for x in coeffs.data_vars if not x.endswith("_count")]
+    boxes = ubs.dsutils.gather_boxes(
+        coeffs.expand_dims(time=[0]), rows, cols, variables=names
+    )
+    return boxes.isel(time=0, drop=True)
+
+
+def merged_series(datasets, coeffs):
+    """
+    Build one continuous series from a dictionary of datasets keyed by
+    instrument, boxes or city boxes of the same cells, with coeffs the
+    matching coefficients (see box_coefficients and city_coefficients).
+    The older instruments are mapped onto the reference and each time
+    step uses the newest instrument with data.  The instrument variable
+    gives the position in CHAIN of the instrument used.
+    """
+
+    merged = None
+    for position, instrument in enumerate(CHAIN):
+        ds = datasets[instrument][["sig0", "sig0std"]]
+        if position > 0:
+            gain = coeffs[instrument + "_gain"]
+            ds = xr.Dataset(
+                {
+                    "sig0": gain * ds["sig0"] + coeffs[instrument + "_offset"],
+                    "sig0std": abs(gain) * ds["sig0std"],
+                }
+            )
+        ds["instrument"] = xr.where(ds["sig0"].notnull(), position, np.nan)
+        if merged is None:
+            merged = ds
+        else:
+            merged = merged.combine_first(ds)
+
+    return merged.transpose("time", ...)
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description=(
+            "estimate per grid cell offsets (and gains) between the"
+            + " monthly ERS, QuikSCAT and ASCAT data over their overlap"
+            + " months and write them as a netcdf grid."
+        )
+    )
+
+    parser.add_argument(
+        "-g",
+        "--gains",
+        help="fit gains as well as offsets",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        help="increase output verbosity",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "-d",
+        "--datadir",
+        help="directory with the netcdf files. Default: ./data",
+        default="./data",
+    )
+
+    parser.add_argument(
+        "-c",
+        "--cubedir",
+        help="read the memory-mapped cubes in CUBEDIR instead of the netcdf files",
+        default=None,
+    )
+
+    # add positional arguments
+    parser.add_argument("outpath", help="output netcdf file")
+
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+    verbose = args.verbose
+
+    if verbose:
+        today = datetime.date.today()
+        print("date: {}".format(today))
+        print("data directory: {}".format(args.datadir))
+        print("output file: {}".format(args.outpath))
+
+    datasets = batch.load_monthly(args.datadir, cubedir=args.cubedir, verbose=verbose)
+    coeffs = build_coefficients(datasets, gains=args.gains, verbose=verbose)
+    coeffs.to_netcdf(args.outpath)
+
+    return 0
+
+
+def run():
+    sys.exit(main(sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    run()
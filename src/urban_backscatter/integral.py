@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Integral images (summed-area tables) of the backscatter cubes.  For
+# each variable the running sum of the valid values and the running
+# count of valid cells over the rows and columns of the grid are stored
+# per time step, so the NaN-skipping mean over any rectangular box of
+# grid cells costs four lookups per time step whatever the box size.
+# The tables are stored as (lat + 1, lon + 1, time) .npy files with a
+# JSON sidecar, like the memory-mapped cubes in rawcube.
+
+import os
+import json
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from numpy.lib.format import open_memmap
+
+from . import cmgutils
+from . import ncfileio
+
+VARIABLES = ["sig0", "sig0std"]
+
+# number of latitude rows accumulated at a time by the builder
+BUILD_ROWS = 64
+
+
+def integral_paths(integraldir, instrument, period, maskname):
+    """
+    return the sidecar path and a dictionary of .npy paths for the sum
+    and count tables of one instrument/product in <integraldir>.
+    """
+
+    prefix = "{}_{}_{}".format(instrument, period, maskname)
+    sidecar = os.path.join(integraldir, prefix + "_integral.json")
+    arrays = {}
+    for var in VARIABLES:
+        for kind in ["sum", "count"]:
+            name = "{}_{}_{}.npy".format(prefix, var, kind)
+            arrays[var + "_" + kind] = os.path.join(integraldir, name)
+    return sidecar, arrays
+
+
+def build_integral(datadir, outdir, instruments=None, verbose=False):
+    """
+    build the integral images for the monthly and seasonal netcdf files
+    found in <datadir> and write them to <outdir>.  Returns the list of
+    sidecar files written.
+    """
+
+    if instruments is None:
+        instruments = ncfileio.PLATFORMS
+
+    os.makedirs(outdir, exist_ok=True)
+
+    sidecars = []
+    for instrument in instruments:
+        for period, maskname in ncfileio.STORE_PRODUCTS:
+            prefix = "{}_{}_{}_sig0".format(instrument, period, maskname)
+            mean_path = os.path.join(datadir, prefix + "_mean.nc")
+            std_path = os.path.join(datadir, prefix + "_StdDev.nc")
+            if not (os.path.exists(mean_path) and os.path.exists(std_path)):
+                continue
+
+            sidecar, arrays = integral_paths(outdir, instrument, period, maskname)
+            if verbose:
+                print("writing integral images: {}".format(sidecar))
+
+            merged_xr = ncfileio._open_merged(mean_path, std_path)
+            try:
+                write_integral(merged_xr, sidecar, arrays)
+            finally:
+                merged_xr.close()
+            sidecars.append(sidecar)
+
+    return sidecars
+
+
+def write_integral(ds, sidecar, arrays):
+    """
+    accumulate the sum and count tables of the variables of a (lat
+    descending) dataset one band of rows at a time and write them with
+    the sidecar.  Entry [i, j] of a table holds the total over the
+    first i rows and j columns, so row 0 and column 0 are zero.
+    """
+
+    lat = ds["lat"].values
+    lon = ds["lon"].values
+    nlat, nlon, ntime = len(lat), len(lon), ds.sizes["time"]
+    if nlat > 1 and lat[0] < lat[-1]:
+        errmsg = "latitudes should be in descending (north to south) order"
+        raise ValueError(errmsg)
+
+    for var in VARIABLES:
+        total = open_memmap(
+            arrays[var + "_sum"],
+            mode="w+",
+            dtype="float64",
+            shape=(nlat + 1, nlon + 1, ntime),
+        )
+        count = open_memmap(
+            arrays[var + "_count"],
+            mode="w+",
+            dtype="int32",
+            shape=(nlat + 1, nlon + 1, ntime),
+        )
+        total[0] = 0.0
+        count[0] = 0
+
+        for start in range(0, nlat, BUILD_ROWS):
+            band = ds[var].isel(lat=slice(start, start + BUILD_ROWS))
+            band = band.transpose("lat", "lon", "time").values
+            valid = ~np.isnan(band)
+            stop = start + band.shape[0]
+
+            # running totals along the columns, then down the rows
+            # starting from the last row of the previous band
+            for table, values in [
+                (total, np.where(valid, band, 0.0).astype("float64")),
+                (count, valid.astype("int32")),
+            ]:
+                block = np.zeros((band.shape[0], nlon + 1, ntime), table.dtype)
+                np.cumsum(values, axis=1, out=block[:, 1:])
+                np.cumsum(block, axis=0, out=block)
+                block += table[start]
+                table[start + 1 : stop + 1] = block
+
+        total.flush()
+        count.flush()
+        del total, count
+
+    row0 = int(round((cmgutils.LATMAX - lat[0]) / cmgutils.GRDSIZE - 0.5))
+    col0 = int(round((lon[0] - cmgutils.LONMIN) / cmgutils.GRDSIZE - 0.5))
+    meta = {
+        "row0": row0,
+        "col0": col0,
+        "nlat": nlat,
+        "nlon": nlon,
+        "time": [str(t) for t in pd.DatetimeIndex(ds["time"].values)],
+    }
+    with open(sidecar, "w") as fp:
+        json.dump(meta, fp, indent=1)
+
+
+def open_integral(sidecar, *npy_paths):
+    """
+    open integral images written by build_integral as an xarray Dataset
+    with (y, x, time) dimensions backed by read-only memory maps.  The
+    CMG row and column of the first grid cell are in the row0 and col0
+    attributes.
+    """
+
+    with open(sidecar) as fp:
+        meta = json.load(fp)
+
+    names = [var + "_" + kind for var in VARIABLES for kind in ["sum", "count"]]
+    data_vars = {
+        name: (("y", "x", "time"), np.load(path, mmap_mode="r"))
+        for name, path in zip(names, npy_paths)
+    }
+    attrs = {"row0": meta["row0"], "col0": meta["col0"]}
+    coords = {"time": pd.DatetimeIndex(meta["time"])}
+    return xr.Dataset(data_vars, coords=coords, attrs=attrs)
+
+
+def get_integral(integraldir, instrument, period="seasonal", masked=False):
+    """
+    return the integral images for one instrument and product from
+    <integraldir>.  The opened tables are kept in the dataset cache.
+    """
+
+    if instrument not in ["SASS", "ERS", "QuikSCAT", "ASCAT"]:
+        errmsg = "instrument should be one of 'SASS' " + "'ERS', 'QuikSCAT' or 'ASCAT'"
+        raise ValueError(errmsg)
+
+    if masked:
+        maskname = "urban"
+    else:
+        maskname = "land"
+
+    if (period, maskname) not in ncfileio.STORE_PRODUCTS:
+        errmsg = "no integral images for the {} {} product".format(period, maskname)
+        raise ValueError(errmsg)
+
+    sidecar, arrays = integral_paths(integraldir, instrument, period, maskname)
+    paths = (sidecar,) + tuple(arrays.values())
+    return ncfileio.DATASET_CACHE.get(paths, open_integral)
+
+
+def box_means(integral, rows, cols, variables=VARIABLES):
+    """
+    Return the NaN-skipping mean of each variable over the boxes given
+    by the CMG row and column index arrays from cmgutils.box_indices,
+    using four lookups per box and time step.  Cells of a box outside
+    the grid of the tables are ignored.  Returns a Dataset with
+    (time, city) dimensions holding the means and the number of valid
+    cells (<var>_count) of each box.
+    """
+
+    rows = np.atleast_2d(rows)
+    cols = np.atleast_2d(cols)
+    nlat = integral.sizes["y"] - 1
+    nlon = integral.sizes["x"] - 1
+
+    # box edges in the tables, clipped to the grid
+    r0 = np.clip(rows[:, 0] - integral.attrs["row0"], 0, nlat)
+    r1 = np.clip(rows[:, -1] + 1 - integral.attrs["row0"], 0, nlat)
+    c0 = np.clip(cols[:, 0] - integral.attrs["col0"], 0, nlon)
+    c1 = np.clip(cols[:, -1] + 1 - integral.attrs["col0"], 0, nlon)
+
+    data_vars = {}
+    for var in variables:
+        sums = []
+        for kind in ["sum", "count"]:
+            table = integral[var + "_" + kind].data
+            sums.append(table[r1, c1] - table[r0, c1] - table[r1, c0] + table[r0, c0])
+        total, count = sums
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(count > 0, total / count, np.nan)
+        data_vars[var] = (("time", "city"), mean.T)
+        data_vars[var + "_count"] = (("time", "city"), count.T)
+
+    return xr.Dataset(data_vars, coords={"time": integral["time"].values})
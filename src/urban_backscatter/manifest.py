@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Output manifest for incremental batch runs.  For each output file the
+# manifest records a key built from the fingerprint of the input files,
+# the box parameters and the package version.  The manifest is an
+# append-only JSON lines file so every finished output is recorded as
+# soon as it is written and an interrupted run can be resumed.
+
+import os
+import json
+import hashlib
+import datetime
+
+import urban_backscatter as ubs
+
+MANIFEST_NAME = "ubs_manifest.jsonl"
+
+
+def output_key(inputs, params):
+    """
+    Return a hex digest identifying an output from the fingerprint of
+    its input files (see ncfileio.file_fingerprint), a dictionary of
+    box/extraction parameters and the package version.
+    """
+
+    record = {
+        "inputs": [list(x) for x in inputs],
+        "params": params,
+        "version": ubs.__version__,
+    }
+    text = json.dumps(record, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class Manifest:
+    """
+    Manifest of the outputs in a directory.  Use is_current() to test if
+    an output is up to date and record() once it has been written.
+    """
+
+    def __init__(self, outdir, name=MANIFEST_NAME):
+        self.outdir = outdir
+        self.path = os.path.join(outdir, name)
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        """
+        read the manifest, the last record for an output wins
+        """
+
+        self.entries = {}
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path) as fp:
+            for line in fp:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # partly written line from an interrupted run
+                    continue
+                self.entries[entry["output"]] = entry
+
+    def is_current(self, output, key):
+        """
+        return True if output exists, has the size recorded in the
+        manifest and was written with the same key
+        """
+
+        entry = self.entries.get(output)
+        if entry is None or entry["key"] != key:
+            return False
+
+        outpath = os.path.join(self.outdir, output)
+        if not os.path.exists(outpath):
+            return False
+        return os.path.getsize(outpath) == entry["size"]
+
+    def record(self, output, key):
+        """
+        add a record for an output that has just been written
+        """
+
+        outpath = os.path.join(self.outdir, output)
+        entry = {
+            "output": output,
+            "key": key,
+            "size": os.path.getsize(outpath),
+            "written": datetime.datetime.now().isoformat(timespec="seconds"),
+        }
+        with open(self.path, "a") as fp:
+            fp.write(json.dumps(entry) + "\n")
+            fp.flush()
+        self.entries[output] = entry
+
+    def compact(self):
+        """
+        rewrite the manifest with one record per output
+        """
+
+        tmppath = self.path + ".tmp"
+        with open(tmppath, "w") as fp:
+            for entry in self.entries.values():
+                fp.write(json.dumps(entry) + "\n")
+        os.replace(tmppath, self.path)
@@ -2,20 +2,236 @@
 # -*- coding: utf-8 -*-
 
 import os
+import threading
+from collections import OrderedDict
+
 import xarray as xr
 
+from . import profiling
+
 PLATFORMS = ["SASS", "ERS", "QuikSCAT", "ASCAT"]
 
 SEASON_LIST = ["JFM", "AMJ", "JAS", "OND"]
 
 SEASON_SEL = {"JFM": 2, "AMJ": 5, "JAS": 8, "OND": 11}
 
+# default number of merged (mean + StdDev) datasets kept open
+CACHE_SIZE = 8
+
+# products converted by build_store: (time step, mask name)
+STORE_PRODUCTS = [("monthly", "land"), ("seasonal", "land"), ("seasonal", "urban")]
+
+# spatial tile size (grid cells) of the chunks in the time series store
+STORE_TILE = 16
+
+
+class DatasetCache:
+    """
+    Process-wide LRU cache of merged mean + StdDev datasets.  Entries
+    are keyed on the input file paths and are only reused while the
+    (path, mtime, size) fingerprint of every input file is unchanged.
+    A maxsize of 0 disables caching, the datasets are then owned by the
+    caller (see release).
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, paths, loader):
+        """
+        return the cached dataset for paths, calling loader(*paths) to
+        open and merge the files on a miss or when a file has changed.
+        With caching disabled the caller has to close the dataset.
+        """
+
+        fingerprint = file_fingerprint(paths)
+        with self._lock:
+            entry = self._entries.get(paths)
+            if entry is not None and entry[0] == fingerprint:
+                self._entries.move_to_end(paths)
+                self.hits += 1
+                return entry[1].copy(deep=False)
+            self.misses += 1
+
+        ds = loader(*paths)
+        if self.maxsize <= 0:
+            return ds
+
+        with self._lock:
+            stale = self._entries.pop(paths, None)
+            if stale is not None:
+                stale[1].close()
+            self._entries[paths] = (fingerprint, ds)
+            self._evict()
+        return ds.copy(deep=False)
+
+    def release(self, ds, result, loaded):
+        """
+        Hand the files of ds, a dataset from get, over to result (a
+        selection from ds) if caching is disabled: they are closed now
+        if result is loaded into memory, otherwise result.close() closes
+        them.  Returns result.
+        """
+
+        if self.maxsize > 0:
+            return result
+        if loaded:
+            ds.close()
+        else:
+            result.set_close(ds.close)
+        return result
+
+    def resize(self, maxsize):
+        """
+        change the number of datasets kept and evict any extra entries
+        """
+
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        """
+        close and drop all cached datasets and reset the counters
+        """
+
+        with self._lock:
+            for fingerprint, ds in self._entries.values():
+                ds.close()
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        """
+        return a dictionary with cache counters and current size
+        """
+
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+            }
+
+    def _evict(self):
+        while len(self._entries) > max(self.maxsize, 0):
+            paths, (fingerprint, ds) = self._entries.popitem(last=False)
+            ds.close()
+            self.evictions += 1
+
+
+DATASET_CACHE = DatasetCache()
+
+
+def file_fingerprint(paths):
+    """
+    return a tuple of (path, mtime, size) for each of the input files
+    """
+
+    fingerprint = []
+    for path in paths:
+        st = os.stat(path)
+        fingerprint.append((path, st.st_mtime_ns, st.st_size))
+    return tuple(fingerprint)
+
+
+def set_cache_size(maxsize):
+    """
+    set the number of merged datasets kept by the dataset cache
+    """
+
+    DATASET_CACHE.resize(maxsize)
+
+
+def clear_cache():
+    """
+    close all datasets held by the dataset cache
+    """
+
+    DATASET_CACHE.clear()
+
 
-def get_monthly_data(datadir, instrument, verbose=False):
+def cache_stats():
+    """
+    return hit/miss/eviction counters for the dataset cache
+    """
+
+    return DATASET_CACHE.stats()
+
+
+def subset_bbox(ds, bbox, load=True):
+    """
+    select the grid cells inside bbox = (lonmin, latmin, lonmax, latmax)
+    (as returned by cmgutils.box11) from a dataset and read just that
+    hyperslab from disk.  With load=False the selection is left lazy.
+    """
+
+    if len(bbox) != 4:
+        errmsg = "bbox should be (lonmin, latmin, lonmax, latmax)"
+        raise ValueError(errmsg)
+
+    lonmin, latmin, lonmax, latmax = bbox
+    if lonmin > lonmax or latmin > latmax:
+        errmsg = "bbox should be (lonmin, latmin, lonmax, latmax)"
+        raise ValueError(errmsg)
+
+    # latitudes in the CMG files run north to south
+    if ds.lat.values[0] > ds.lat.values[-1]:
+        lat_slice = slice(latmax, latmin)
+    else:
+        lat_slice = slice(latmin, latmax)
+
+    with profiling.stage("sel"):
+        ds = ds.sel(lon=slice(lonmin, lonmax), lat=lat_slice)
+    if load:
+        with profiling.stage("load") as timer:
+            ds = ds.load()
+            timer.add_bytes(profiling.dataset_bytes(ds))
+    return ds
+
+
+def _open_merged(mean_path, std_path):
+    """
+    open mean and StdDev netcdf files and merge them into one dataset
+    """
+
+    with profiling.stage("open_dataset"):
+        mean_xr = xr.open_dataset(mean_path)
+        std_xr = xr.open_dataset(std_path)
+
+    # merge two datasets
+    with profiling.stage("merge"):
+        merged_xr = mean_xr.merge(std_xr["sig0std"], join="exact")
+    merged_xr.set_close(_close_all(mean_xr, std_xr))
+    return merged_xr
+
+
+def _close_all(*datasets):
+    def close():
+        for ds in datasets:
+            ds.close()
+
+    return close
+
+
+@profiling.profiled("get_monthly_data", "instrument")
+def get_monthly_data(datadir, instrument, verbose=False, bbox=None):
     """
     function to read in netcdf files for a single instrument and
     return an xarray dataset with sig0 mean and stddev.  It is
     assumed that the netcdf files are in a directory, <datadir>.
+    The merged dataset is kept in the dataset cache so repeated
+    calls do not reopen the files.  If bbox is given only the grid
+    cells inside (lonmin, latmin, lonmax, latmax) are read.
     """
 
     if instrument not in ["SASS", "ERS", "QuikSCAT", "ASCAT"]:
@@ -24,34 +240,38 @@ def get_monthly_data(datadir, instrument, verbose=False):
 
     # set up filepath for sig0 means
     infile = "{}_monthly_land_sig0_mean.nc".format(instrument)
-    inpath = os.path.join(datadir, infile)
+    mean_path = os.path.join(datadir, infile)
     if verbose:
-        print("input file path: {}".format(inpath))
-
-    # Open up the data
-    with xr.open_dataset(inpath) as file_nc:
-        monthly_mean_xr = file_nc
+        print("input file path: {}".format(mean_path))
 
     # repeat for sig0std
     infile = "{}_monthly_land_sig0_StdDev.nc".format(instrument)
-    inpath = os.path.join(datadir, infile)
+    std_path = os.path.join(datadir, infile)
     if verbose:
-        print("input file path: {}".format(inpath))
+        print("input file path: {}".format(std_path))
 
-    # Open up the data
-    with xr.open_dataset(inpath) as file_nc:
-        monthly_std_xr = file_nc
+    # open and merge the two datasets (or reuse the cached copy)
+    monthly_xr = DATASET_CACHE.get((mean_path, std_path), _open_merged)
 
-    # merge two datasets
-    monthly_xr = monthly_mean_xr.merge(monthly_std_xr["sig0std"], join="exact")
-    return monthly_xr
+    # read only the cells inside the bounding box
+    merged_xr = monthly_xr
+    if bbox is not None:
+        monthly_xr = subset_bbox(monthly_xr, bbox)
 
+    return DATASET_CACHE.release(merged_xr, monthly_xr, bbox is not None)
 
-def get_seasonal_data(datadir, instrument, season="JAS", masked=False, verbose=False):
+
+@profiling.profiled("get_seasonal_data", "instrument")
+def get_seasonal_data(
+    datadir, instrument, season="JAS", masked=False, verbose=False, bbox=None
+):
     """
     function to read in netcdf file for a single instrument and return
     an xarray dataset.  It is assumed that the netcdf files are in a
-    directory, <datadir>.
+    directory, <datadir>.  The merged dataset for all seasons is kept
+    in the dataset cache so repeated calls do not reopen the files.
+    If bbox is given only the grid cells inside (lonmin, latmin,
+    lonmax, latmax) are read.
     """
 
     if instrument not in ["SASS", "ERS", "QuikSCAT", "ASCAT"]:
@@ -69,32 +289,253 @@ def get_seasonal_data(datadir, instrument, season="JAS", masked=False, verbose=F
 
     # set up filepath for sig0 means
     infile = "{}_seasonal_{}_sig0_mean.nc".format(instrument, maskname)
-    inpath = os.path.join(datadir, infile)
+    mean_path = os.path.join(datadir, infile)
+    if verbose:
+        print("input file path for mean: {}".format(mean_path))
+
+    # repeat for StdDev
+    infile = "{}_seasonal_{}_sig0_StdDev.nc".format(instrument, maskname)
+    std_path = os.path.join(datadir, infile)
     if verbose:
-        print("input file path for mean: {}".format(inpath))
+        print("input file path for StdDev: {}".format(std_path))
 
-    # Open up the data
-    with xr.open_dataset(inpath) as file_nc:
-        seasonal_xr = file_nc
+    # open and merge the two datasets (or reuse the cached copy)
+    seasonal_xr = DATASET_CACHE.get((mean_path, std_path), _open_merged)
 
     # select season
     month = SEASON_SEL[season]
-    season_mean_xr = seasonal_xr.sel(time=seasonal_xr.time.dt.month == month)
+    with profiling.stage("sel"):
+        season_xr = seasonal_xr.sel(time=seasonal_xr.time.dt.month == month)
+
+    # read only the cells inside the bounding box
+    if bbox is not None:
+        season_xr = subset_bbox(season_xr, bbox)
+
+    return DATASET_CACHE.release(seasonal_xr, season_xr, bbox is not None)
+
+
+@profiling.profiled("get_all_seasons_data", "instrument")
+def get_all_seasons_data(
+    datadir, instrument, seasons=None, masked=False, verbose=False, bbox=None
+):
+    """
+    function to read in the seasonal netcdf files for a single instrument
+    once and return a dictionary of xarray datasets keyed by season.  By
+    default all four seasons are returned.  If bbox is given the box is
+    read once and then split into seasons.
+    """
+
+    if instrument not in ["SASS", "ERS", "QuikSCAT", "ASCAT"]:
+        errmsg = "instrument should be one of 'SASS' " + "'ERS', 'QuikSCAT' or 'ASCAT'"
+        raise ValueError(errmsg)
+
+    if seasons is None:
+        seasons = SEASON_LIST
+
+    for season in seasons:
+        if season not in SEASON_LIST:
+            errmsg = "season should be one of 'JFM', 'AMJ', 'JAS' or 'OND'"
+            raise ValueError(errmsg)
+
+    if masked:
+        maskname = "urban"
+    else:
+        maskname = "land"
+
+    # set up filepath for sig0 means
+    infile = "{}_seasonal_{}_sig0_mean.nc".format(instrument, maskname)
+    mean_path = os.path.join(datadir, infile)
+    if verbose:
+        print("input file path for mean: {}".format(mean_path))
 
     # repeat for StdDev
     infile = "{}_seasonal_{}_sig0_StdDev.nc".format(instrument, maskname)
-    inpath = os.path.join(datadir, infile)
+    std_path = os.path.join(datadir, infile)
+    if verbose:
+        print("input file path for StdDev: {}".format(std_path))
+
+    # open and merge the two datasets (or reuse the cached copy)
+    seasonal_xr = DATASET_CACHE.get((mean_path, std_path), _open_merged)
+
+    # read the box for all seasons at once
+    merged_xr = seasonal_xr
+    if bbox is not None:
+        seasonal_xr = subset_bbox(seasonal_xr, bbox)
+        DATASET_CACHE.release(merged_xr, seasonal_xr, True)
+
+    # split into seasons
+    months = seasonal_xr.time.dt.month
+    season_data = {}
+    with profiling.stage("sel"):
+        for season in seasons:
+            month = SEASON_SEL[season]
+            season_data[season] = seasonal_xr.sel(time=months == month)
+
+    # without caching closing any of the seasons closes the files
+    if bbox is None:
+        for season in seasons:
+            DATASET_CACHE.release(merged_xr, season_data[season], False)
+
+    return season_data
+
+
+def build_store(datadir, outdir, instruments=None, tile=STORE_TILE, verbose=False):
+    """
+    rewrite the monthly and seasonal netcdf files found in <datadir> into
+    zarr stores in <outdir> laid out for time series access.  Each store
+    holds the merged sig0 mean and StdDev cubes chunked as all time steps
+    over tile x tile grid cells, so extracting a small box touches only a
+    few compressed chunks.  The cubes are converted one band of tile
+    latitude rows at a time to keep memory use bounded.  Returns the
+    list of stores written.
+    """
+
+    if instruments is None:
+        instruments = PLATFORMS
+
+    os.makedirs(outdir, exist_ok=True)
+
+    stores = []
+    for instrument in instruments:
+        for period, maskname in STORE_PRODUCTS:
+            prefix = "{}_{}_{}_sig0".format(instrument, period, maskname)
+            mean_path = os.path.join(datadir, prefix + "_mean.nc")
+            std_path = os.path.join(datadir, prefix + "_StdDev.nc")
+            if not (os.path.exists(mean_path) and os.path.exists(std_path)):
+                continue
+
+            store_path = os.path.join(outdir, prefix + ".zarr")
+            if verbose:
+                print("writing store: {}".format(store_path))
+
+            merged_xr = _open_merged(mean_path, std_path)
+            try:
+                _write_store(merged_xr, store_path, tile)
+            finally:
+                merged_xr.close()
+            stores.append(store_path)
+
+    return stores
+
+
+def _write_store(ds, store_path, tile):
+    """
+    write a merged dataset to a zarr store band by band
+    """
+
+    ntime = ds.sizes["time"]
+    nlat = ds.sizes["lat"]
+    encoding = {}
+    for var in ["sig0", "sig0std"]:
+        chunks = [tile] * ds[var].ndim
+        chunks[ds[var].dims.index("time")] = ntime
+        encoding[var] = {"chunks": tuple(chunks)}
+
+    for start in range(0, nlat, tile):
+        band = ds.isel(lat=slice(start, start + tile)).load()
+
+        # drop the netcdf encodings (compression, chunksizes) of the source
+        for var in band.variables.values():
+            var.encoding = {}
+
+        if start == 0:
+            band.to_zarr(store_path, mode="w", encoding=encoding)
+        else:
+            band.drop_vars("spatial_ref", errors="ignore").to_zarr(
+                store_path, append_dim="lat"
+            )
+
+
+def _open_store(store_path, *metadata_paths):
+    """
+    open a zarr store written by build_store (the metadata paths are
+    only part of the cache key)
+    """
+
+    return xr.open_dataset(store_path, engine="zarr", chunks=None)
+
+
+def store_cache_paths(store_path):
+    """
+    Return the store path followed by its metadata files (zarr v3
+    zarr.json or v2 .zmetadata/.zarray, for the store and the sig0 and
+    sig0std arrays).  Their fingerprint changes when build_store rewrites
+    the store, unlike that of the store directory.
+    """
+
+    paths = [store_path]
+    for subdir in ["", "sig0", "sig0std"]:
+        for name in ["zarr.json", ".zmetadata", ".zarray"]:
+            path = os.path.join(store_path, subdir, name)
+            if os.path.exists(path):
+                paths.append(path)
+    return tuple(paths)
+
+
+def get_monthly_store_data(storedir, instrument, verbose=False, bbox=None):
+    """
+    function to read the monthly sig0 mean and stddev for a single
+    instrument from a zarr store written by build_store.  Same as
+    get_monthly_data except that the data are read from <storedir>.
+    """
+
+    if instrument not in ["SASS", "ERS", "QuikSCAT", "ASCAT"]:
+        errmsg = "instrument should be one of 'SASS' " + "'ERS', 'QuikSCAT' or 'ASCAT'"
+        raise ValueError(errmsg)
+
+    # set up path for the store
+    store = "{}_monthly_land_sig0.zarr".format(instrument)
+    store_path = os.path.join(storedir, store)
+    if verbose:
+        print("input store path: {}".format(store_path))
+
+    monthly_xr = DATASET_CACHE.get(store_cache_paths(store_path), _open_store)
+
+    # read only the cells inside the bounding box
+    merged_xr = monthly_xr
+    if bbox is not None:
+        monthly_xr = subset_bbox(monthly_xr, bbox)
+
+    return DATASET_CACHE.release(merged_xr, monthly_xr, bbox is not None)
+
+
+def get_seasonal_store_data(
+    storedir, instrument, season="JAS", masked=False, verbose=False, bbox=None
+):
+    """
+    function to read the seasonal sig0 mean and stddev for a single
+    instrument from a zarr store written by build_store.  Same as
+    get_seasonal_data except that the data are read from <storedir>.
+    """
+
+    if instrument not in ["SASS", "ERS", "QuikSCAT", "ASCAT"]:
+        errmsg = "instrument should be one of 'SASS' " + "'ERS', 'QuikSCAT' or 'ASCAT'"
+        raise ValueError(errmsg)
+
+    if season not in SEASON_LIST:
+        errmsg = "season should be one of 'JFM', 'AMJ', 'JAS' or 'OND'"
+        raise ValueError(errmsg)
+
+    if masked:
+        maskname = "urban"
+    else:
+        maskname = "land"
+
+    # set up path for the store
+    store = "{}_seasonal_{}_sig0.zarr".format(instrument, maskname)
+    store_path = os.path.join(storedir, store)
     if verbose:
-        print("input file path for StdDev: {}".format(inpath))
+        print("input store path: {}".format(store_path))
 
-    # Open up the data
-    with xr.open_dataset(inpath) as file_nc:
-        seasonal_std_xr = file_nc
+    seasonal_xr = DATASET_CACHE.get(store_cache_paths(store_path), _open_store)
 
     # select season
     month = SEASON_SEL[season]
-    season_std_xr = seasonal_std_xr.sel(time=seasonal_xr.time.dt.month == month)
+    with profiling.stage("sel"):
+        season_xr = seasonal_xr.sel(time=seasonal_xr.time.dt.month == month)
+
+    # read only the cells inside the bounding box
+    if bbox is not None:
+        season_xr = subset_bbox(season_xr, bbox)
 
-    # combine mean and standard deviation
-    season_xr = season_mean_xr.merge(season_std_xr.sig0std, join="exact")
-    return season_xr
+    return DATASET_CACHE.release(seasonal_xr, season_xr, bbox is not None)
@@ -13,14 +13,94 @@ in the southern hemisphere.
 """
 
 import sys
+import os
 import argparse
 import datetime
-import pandas as pd
-import matplotlib.pyplot as plt
 
 import urban_backscatter as ubs
 
 
+@ubs.profiling.profiled("box_timeseries", "instrument")
+def box_timeseries(ds, instrument, weights=None):
+    """
+    Return the mean over a box (weighted by the urban weights if given,
+    see zonal.weighted_box_mean) as a dataframe indexed by time with an
+    instr column
+    """
+
+    if weights is not None:
+        ts = ubs.zonal.weighted_box_mean(ds, weights)
+    else:
+        ts = ds.mean(dim=["lon", "lat"], skipna=True)
+    df = ts.to_dataframe()
+    df = df.drop(columns=["spatial_ref"])
+    df["instr"] = instrument
+    return df
+
+
+def power_ratio(df):
+    """
+    Add the power ratio (PR) of sig0 and of sig0 +/- sig0std to a box
+    mean dataframe
+    """
+
+    df["pr"] = 10.0 ** (df["sig0"] / 10.0)
+
+    # standard deviations are trickier since we're in dB space.
+    # so just calculate PR values for upper and lower values
+    df["pr_high"] = 10.0 ** ((df["sig0"] + df["sig0std"]) / 10.0)
+    df["pr_low"] = 10.0 ** ((df["sig0"] - df["sig0std"]) / 10.0)
+    return df
+
+
+def plot_timeseries(prdf, locname, lat, lon, season, outfile):
+    """
+    Plot the power ratio of each instrument (see power_ratio) for a box
+    and save the figure to outfile
+    """
+
+    # matplotlib is only needed for the figure
+    import matplotlib.pyplot as plt
+
+    # for plotting split back out into separate data frames
+    # for each instrument and reset index
+    ers_prdf = prdf[prdf["instr"] == "ERS"].reset_index()
+    qscat_prdf = prdf[prdf["instr"] == "QuikSCAT"].reset_index()
+    ascat_prdf = prdf[prdf["instr"] == "ASCAT"].reset_index()
+
+    # make plot
+    fig = plt.figure(figsize=(10, 6))
+    plt.plot(ers_prdf["time"], ers_prdf["pr"], marker="o")
+    plt.fill_between(
+        x=ers_prdf["time"], y1=ers_prdf["pr_low"], y2=ers_prdf["pr_high"], alpha=0.5
+    )
+    plt.plot(qscat_prdf["time"], qscat_prdf["pr"], marker="o")
+    plt.fill_between(
+        x=qscat_prdf["time"],
+        y1=qscat_prdf["pr_low"],
+        y2=qscat_prdf["pr_high"],
+        alpha=0.5,
+    )
+
+    plt.plot(ascat_prdf["time"], ascat_prdf["pr"], marker="o")
+    plt.fill_between(
+        x=ascat_prdf["time"],
+        y1=ascat_prdf["pr_low"],
+        y2=ascat_prdf["pr_high"],
+        alpha=0.5,
+    )
+
+    # add some anotations
+    plt.title("{} (lat:{:.4f} lon:{:.4f})".format(locname, lat, lon))
+    plt.ylabel("Mean {} Backscatter Power Ratio (PR)".format(season))
+    plt.xlabel("Year")
+
+    # save to file
+    with ubs.profiling.stage("savefig"):
+        plt.savefig(outfile)
+    plt.close(fig)
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(
@@ -35,10 +115,12 @@ if __name__ == "__main__":
     parser.add_argument(
         "-s",
         "--season",
-        nargs=1,
-        choices=["JFM", "AMJ", "JAS", "OND"],
-        help="season/quarter to select",
-        default=["JAS"],
+        action="append",
+        choices=["JFM", "AMJ", "JAS", "OND", "all"],
+        help=(
+            "season/quarter to select (default: JAS). Repeat for several"
+            + " seasons or use 'all' for all four"
+        ),
     )
 
     # add command options
@@ -59,6 +141,39 @@ if __name__ == "__main__":
         default="./data",
     )
 
+    parser.add_argument(
+        "-u",
+        "--urban-weights",
+        help=(
+            "weight the box means by the urban mask of each instrument"
+            + " (or the built fraction in --fraction-layer)"
+        ),
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--fraction-layer",
+        help="netcdf file with a (lat, lon) built-fraction layer for -u",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--profile",
+        help=(
+            "print the time, bytes read/written and peak memory of each"
+            + " stage and write a JSON trace (see --trace)"
+        ),
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--trace",
+        help="JSON trace file for --profile. Default: <locname>_profile.json",
+        default=None,
+    )
+
     # add positional arguments
     parser.add_argument("lat", type=float, help="Latitude of location")
 
@@ -67,8 +182,20 @@ if __name__ == "__main__":
     parser.add_argument("locname", help="location name")
 
     args = parser.parse_args()
+
+    # imported after parsing, so --help and usage errors return quickly
+    import pandas as pd
+
+    if args.profile:
+        ubs.profiling.enable()
+
     verbose = args.verbose
-    season = args.season[0]
+    if args.season is None:
+        seasons = ["JAS"]
+    elif "all" in args.season:
+        seasons = ubs.ncfileio.SEASON_LIST
+    else:
+        seasons = [x for x in ubs.ncfileio.SEASON_LIST if x in args.season]
     lat = args.lat
     lon = args.lon
     locname = args.locname
@@ -77,106 +204,63 @@ if __name__ == "__main__":
     if verbose:
         today = datetime.date.today()
         print("date: {}".format(today))
-        print("season: {}".format(season))
+        print("seasons: {}".format(" ".join(seasons)))
         print("location: {} {}".format(lon, lat))
         print("name: {}".format(locname))
         print("data directory: {}".format(datadir))
 
+    # per-cell urban weights, cached in <datadir>/weights
+    weights = {}
+    if args.urban_weights:
+        for instrument in ["ERS", "QuikSCAT", "ASCAT"]:
+            weights[instrument] = ubs.zonal.get_urban_weights(
+                datadir,
+                instrument,
+                cachedir=os.path.join(datadir, "weights"),
+                layer=args.fraction_layer,
+                verbose=verbose,
+            )
+
     # get 11x11 box around center location
-    lonmin, latmin, lonmax, latmax = ubs.cmgutils.box11(lon, lat, verbose=True)
+    bbox = ubs.cmgutils.box11(lon, lat, verbose=True)
+    lonmin, latmin, lonmax, latmax = bbox
 
     if verbose:
         print("Bounding Box:  {} {} {} {}".format(lonmin, latmin, lonmax, latmax))
 
-    # extract ERS1/2 data
-    ers_data = ubs.ncfileio.get_seasonal_data(
-        datadir, "ERS", season=season, masked=False, verbose=True
-    )
-
-    # subset ERS DataSet
-    ers_data_subset = ers_data.sel(
-        lon=slice(lonmin, lonmax), lat=slice(latmax, latmin),
-    )
-    ers_ts = ers_data_subset.mean(dim=["lon", "lat"], skipna=True)
-    edf = ers_ts.to_dataframe()
-    edf = edf.drop(axis=1, columns=["spatial_ref"])
-    edf["instr"] = "ERS"
-    if verbose:
-        print(edf.head())
-
-    # extract QSCAT data
-    qscat_data = ubs.ncfileio.get_seasonal_data(
-        datadir, "QuikSCAT", season=season, masked=False, verbose=True
+    # read each instrument once for all requested seasons
+    ers_data = ubs.ncfileio.get_all_seasons_data(
+        datadir, "ERS", seasons=seasons, masked=False, verbose=True, bbox=bbox
     )
-    qscat_data_subset = qscat_data.sel(
-        lon=slice(lonmin, lonmax), lat=slice(latmax, latmin),
+    qscat_data = ubs.ncfileio.get_all_seasons_data(
+        datadir, "QuikSCAT", seasons=seasons, masked=False, verbose=True, bbox=bbox
     )
-    qscat_ts = qscat_data_subset.mean(dim=["lon", "lat"], skipna=True)
-    qdf = qscat_ts.to_dataframe()
-    qdf = qdf.drop(axis=1, columns=["spatial_ref"])
-    qdf["instr"] = "QuikSCAT"
-    if verbose:
-        print(qdf.head())
-
-    # extract ASCAT data
-    ascat_data = ubs.ncfileio.get_seasonal_data(
-        datadir, "ASCAT", season=season, masked=False, verbose=True
+    ascat_data = ubs.ncfileio.get_all_seasons_data(
+        datadir, "ASCAT", seasons=seasons, masked=False, verbose=True, bbox=bbox
     )
-    ascat_data_subset = ascat_data.sel(
-        lon=slice(lonmin, lonmax), lat=slice(latmax, latmin),
-    )
-    ascat_ts = ascat_data_subset.mean(dim=["lon", "lat"], skipna=True)
-    adf = ascat_ts.to_dataframe()
-    adf = adf.drop(axis=1, columns=["spatial_ref"])
-    adf["instr"] = "ASCAT"
-    if verbose:
-        print(adf.head())
-
-    # combine the data frames
-    df = pd.concat([edf, qdf, adf])
-
-    # for plotting switch to power ratio (PR)
-    prdf = df
-    prdf["pr"] = 10.0 ** (prdf["sig0"] / 10.0)
-
-    # standard deviations are trickier since we're in dB space.
-    # so just calculate PR values for upper and lower values
-    prdf["pr_high"] = 10.0 ** ((prdf["sig0"] + prdf["sig0std"]) / 10.0)
-    prdf["pr_low"] = 10.0 ** ((prdf["sig0"] - prdf["sig0std"]) / 10.0)
-
-    # for plotting split back out into separate data frames
-    # for each instrument and reset index
-    ers_prdf = prdf[prdf["instr"] == "ERS"].reset_index()
-    qscat_prdf = prdf[prdf["instr"] == "QuikSCAT"].reset_index()
-    ascat_prdf = prdf[prdf["instr"] == "ASCAT"].reset_index()
 
-    # make plot
-    fig = plt.figure(figsize=(10, 6))
-    plt.plot(ers_prdf["time"], ers_prdf["pr"], marker="o")
-    plt.fill_between(
-        x=ers_prdf["time"], y1=ers_prdf["pr_low"], y2=ers_prdf["pr_high"], alpha=0.5
-    )
-    plt.plot(qscat_prdf["time"], qscat_prdf["pr"], marker="o")
-    plt.fill_between(
-        x=qscat_prdf["time"],
-        y1=qscat_prdf["pr_low"],
-        y2=qscat_prdf["pr_high"],
-        alpha=0.5,
-    )
+    for season in seasons:
+        # box means of each instrument
+        edf = box_timeseries(ers_data[season], "ERS", weights.get("ERS"))
+        if verbose:
+            print(edf.head())
+        qdf = box_timeseries(qscat_data[season], "QuikSCAT", weights.get("QuikSCAT"))
+        if verbose:
+            print(qdf.head())
+        adf = box_timeseries(ascat_data[season], "ASCAT", weights.get("ASCAT"))
+        if verbose:
+            print(adf.head())
 
-    plt.plot(ascat_prdf["time"], ascat_prdf["pr"], marker="o")
-    plt.fill_between(
-        x=ascat_prdf["time"],
-        y1=ascat_prdf["pr_low"],
-        y2=ascat_prdf["pr_high"],
-        alpha=0.5,
-    )
+        # combine the data frames and for plotting switch to
+        # power ratio (PR)
+        prdf = power_ratio(pd.concat([edf, qdf, adf]))
 
-    # add some anotations
-    plt.title("{} (lat:{:.4f} lon:{:.4f})".format(locname, lat, lon))
-    plt.ylabel("Mean {} Backscatter Power Ratio (PR)".format(season))
-    plt.xlabel("Year")
+        # save the plot to file
+        outfile = "{}_{}_timeseries_plot.pdf".format(locname, season)
+        plot_timeseries(prdf, locname, lat, lon, season, outfile)
 
-    # save to file
-    outfile = "{}_{}_timeseries_plot.pdf".format(locname, season)
-    plt.savefig(outfile)
+    if args.profile:
+        print(ubs.profiling.format_summary())
+        trace = args.trace or "{}_profile.json".format(locname)
+        ubs.profiling.write_trace(trace)
+        print("trace written to {}".format(trace))
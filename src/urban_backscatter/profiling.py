@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Stage-level timing of the extraction pipeline.  The loaders, table
+# builders and scripts wrap their stages in profiling.stage(name,
+# instrument) or the profiled decorator, which record the wall time,
+# the bytes read or written and the peak (python/numpy) memory of the
+# stage while the profiler is enabled.  Stages nest and inherit the
+# instrument of the enclosing stage.  Disabled (the default) stage()
+# returns a shared do-nothing context manager, so the instrumentation
+# costs one function call.
+# The records are summarized as a table or written as a Chrome/Perfetto
+# JSON trace.
+
+import os
+import json
+import time
+import inspect
+import functools
+import threading
+import tracemalloc
+
+SUMMARY_COLUMNS = [
+    "stage",
+    "instrument",
+    "calls",
+    "total_s",
+    "mean_ms",
+    "mb",
+    "peak_mb",
+]
+
+
+class _NullStage:
+    """
+    stage used while profiling is disabled
+    """
+
+    enabled = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add_bytes(self, nbytes):
+        pass
+
+
+NULL_STAGE = _NullStage()
+
+
+class Stage:
+    """
+    context manager timing one stage, see stage()
+    """
+
+    enabled = True
+
+    def __init__(self, profiler, name, instrument):
+        self.profiler = profiler
+        self.name = name
+        self.instrument = instrument
+        self.nbytes = 0
+        self.peak = 0
+
+    def add_bytes(self, nbytes):
+        self.nbytes += int(nbytes)
+
+    def __enter__(self):
+        stack = self.profiler._stack()
+        if self.instrument is None and stack:
+            self.instrument = stack[-1].instrument
+        self.profiler._update_peaks(stack)
+        self.memory = tracemalloc.get_traced_memory()[0]
+        self.peak = self.memory
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        stack = self.profiler._stack()
+        self.profiler._update_peaks(stack)
+        stack.pop()
+        self.profiler.records.append(
+            {
+                "stage": self.name,
+                "instrument": self.instrument,
+                "start": self.start,
+                "duration": end - self.start,
+                "nbytes": self.nbytes,
+                "peak": max(self.peak - self.memory, 0),
+                "depth": len(stack),
+                "thread": threading.get_ident(),
+            }
+        )
+        return False
+
+
+class Profiler:
+    """
+    Collects Stage records while enabled
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+        self.origin = time.perf_counter()
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _update_peaks(self, stack):
+        # the traced peak since the last update counts towards every
+        # open stage, then start a new peak interval
+        peak = tracemalloc.get_traced_memory()[1]
+        for open_stage in stack:
+            open_stage.peak = max(open_stage.peak, peak)
+        tracemalloc.reset_peak()
+
+    def enable(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def reset(self):
+        self.records = []
+        self.origin = time.perf_counter()
+
+
+# process-wide profiler used by the package
+PROFILER = Profiler()
+
+
+def enable():
+    """
+    start recording stages (and tracing memory allocations)
+    """
+
+    PROFILER.enable()
+
+
+def disable():
+    """
+    stop recording stages
+    """
+
+    PROFILER.disable()
+
+
+def reset():
+    """
+    drop the recorded stages
+    """
+
+    PROFILER.reset()
+
+
+def stage(name, instrument=None):
+    """
+    Return a context manager timing the stage name (for instrument, by
+    default the instrument of the enclosing stage).  The bytes read or
+    written by the stage can be added with add_bytes(), check .enabled
+    first if they are costly to work out.
+    """
+
+    if not PROFILER.enabled:
+        return NULL_STAGE
+    return Stage(PROFILER, name, instrument)
+
+
+def current():
+    """
+    return the innermost open stage of this thread (a do-nothing stage
+    if there is none or profiling is disabled)
+    """
+
+    if not PROFILER.enabled:
+        return NULL_STAGE
+    stack = PROFILER._stack()
+    return stack[-1] if stack else NULL_STAGE
+
+
+def profiled(name, instrument_arg=None):
+    """
+    Decorator timing every call of a function as the stage name.  If
+    instrument_arg names a parameter of the function its value is used
+    as the instrument of the stage.
+    """
+
+    def decorate(func):
+        position = None
+        if instrument_arg is not None:
+            position = list(inspect.signature(func).parameters).index(instrument_arg)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            instrument = None
+            if position is not None:
+                if position < len(args):
+                    instrument = args[position]
+                else:
+                    instrument = kwargs.get(instrument_arg)
+            with Stage(PROFILER, name, instrument):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def dataset_bytes(ds):
+    """
+    return the size in bytes of the data variables of a dataset
+    """
+
+    return sum(ds[var].nbytes for var in ds.data_vars)
+
+
+def path_bytes(path):
+    """
+    return the size in bytes of a file or of the files in a directory
+    """
+
+    if os.path.isdir(path):
+        return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, dirs, names in os.walk(path)
+            for name in names
+        )
+    return os.path.getsize(path)
+
+
+def summary():
+    """
+    Return a dataframe with the number of calls, total and mean wall
+    time, megabytes read or written and largest peak memory of each
+    stage and instrument, in the order the stages first ran
+    """
+
+    # pandas is only needed for reporting, keep it out of the import
+    import pandas as pd
+
+    if not PROFILER.records:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+
+    df = pd.DataFrame(PROFILER.records).sort_values("start", kind="stable")
+    df["instrument"] = df["instrument"].fillna("")
+    grouped = df.groupby(["stage", "instrument"], sort=False)
+    table = grouped.agg(
+        calls=("duration", "size"),
+        total_s=("duration", "sum"),
+        mean_ms=("duration", "mean"),
+        mb=("nbytes", "sum"),
+        peak_mb=("peak", "max"),
+    ).reset_index()
+    table["mean_ms"] = table["mean_ms"] * 1000.0
+    table["mb"] = table["mb"] / 2**20
+    table["peak_mb"] = table["peak_mb"] / 2**20
+    return table[SUMMARY_COLUMNS]
+
+
+def format_summary():
+    """
+    return the summary table as text
+    """
+
+    table = summary()
+    if table.empty:
+        return "no stages recorded"
+    return table.to_string(
+        index=False,
+        formatters={
+            "total_s": "{:.3f}".format,
+            "mean_ms": "{:.2f}".format,
+            "mb": "{:.2f}".format,
+            "peak_mb": "{:.2f}".format,
+        },
+    )
+
+
+def write_trace(path):
+    """
+    Write the recorded stages as a Chrome trace event JSON file, which
+    can be loaded in chrome://tracing or https://ui.perfetto.dev
+    """
+
+    pid = os.getpid()
+    events = []
+    for record in PROFILER.records:
+        name = record["stage"]
+        if record["instrument"]:
+            name = "{} [{}]".format(name, record["instrument"])
+        events.append(
+            {
+                "name": name,
+                "cat": record["stage"],
+                "ph": "X",
+                "ts": (record["start"] - PROFILER.origin) * 1e6,
+                "dur": record["duration"] * 1e6,
+                "pid": pid,
+                "tid": record["thread"],
+                "args": {
+                    "instrument": record["instrument"],
+                    "bytes": record["nbytes"],
+                    "peak_bytes": record["peak"],
+                },
+            }
+        )
+
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Flat binary (memory-mapped) copies of the backscatter cubes.  Each
+# variable is stored as a float32 (lat, lon, time) .npy file so the
+# time series for one grid cell is contiguous on disk, together with a
+# small JSON sidecar holding the CMG origin and the time axis.
+
+import os
+import json
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from numpy.lib.format import open_memmap
+
+from . import cmgutils
+from . import ncfileio
+
+VARIABLES = ["sig0", "sig0std"]
+
+# number of latitude rows copied at a time by the exporter
+EXPORT_ROWS = 64
+
+
+def cube_paths(cubedir, instrument, period, maskname):
+    """
+    return the sidecar path and a dictionary of .npy paths for one
+    instrument/product in <cubedir>.
+    """
+
+    prefix = "{}_{}_{}".format(instrument, period, maskname)
+    sidecar = os.path.join(cubedir, prefix + ".json")
+    arrays = {
+        var: os.path.join(cubedir, "{}_{}.npy".format(prefix, var)) for var in VARIABLES
+    }
+    return sidecar, arrays
+
+
+def export_rawcube(datadir, outdir, instruments=None, verbose=False):
+    """
+    export the monthly and seasonal netcdf files found in <datadir> to
+    memory-mapped .npy cubes in <outdir>.  Returns the list of sidecar
+    files written.
+    """
+
+    if instruments is None:
+        instruments = ncfileio.PLATFORMS
+
+    os.makedirs(outdir, exist_ok=True)
+
+    sidecars = []
+    for instrument in instruments:
+        for period, maskname in ncfileio.STORE_PRODUCTS:
+            prefix = "{}_{}_{}_sig0".format(instrument, period, maskname)
+            mean_path = os.path.join(datadir, prefix + "_mean.nc")
+            std_path = os.path.join(datadir, prefix + "_StdDev.nc")
+            if not (os.path.exists(mean_path) and os.path.exists(std_path)):
+                continue
+
+            sidecar, arrays = cube_paths(outdir, instrument, period, maskname)
+            if verbose:
+                print("writing cube: {}".format(sidecar))
+
+            merged_xr = ncfileio._open_merged(mean_path, std_path)
+            try:
+                _write_cube(merged_xr, sidecar, arrays)
+            finally:
+                merged_xr.close()
+            sidecars.append(sidecar)
+
+    return sidecars
+
+
+def _write_cube(ds, sidecar, arrays):
+    """
+    copy the variables of a merged dataset into (lat, lon, time) .npy
+    files and write the sidecar
+    """
+
+    lat = ds["lat"].values
+    lon = ds["lon"].values
+    nlat, nlon, ntime = len(lat), len(lon), ds.sizes["time"]
+
+    for var in VARIABLES:
+        cube = open_memmap(
+            arrays[var], mode="w+", dtype="float32", shape=(nlat, nlon, ntime)
+        )
+        for start in range(0, nlat, EXPORT_ROWS):
+            band = ds[var].isel(lat=slice(start, start + EXPORT_ROWS))
+            band = band.transpose("lat", "lon", "time").values
+            cube[start : start + band.shape[0]] = band
+        cube.flush()
+        del cube
+
+    # grid cell indices of the first row/column relative to the CMG origin
+    row0 = int(round((lat[0] - cmgutils.LATMIN) / cmgutils.GRDSIZE - 0.5))
+    col0 = int(round((lon[0] - cmgutils.LONMIN) / cmgutils.GRDSIZE - 0.5))
+
+    if "spatial_ref" in ds.coords:
+        spatial_ref = dict(ds["spatial_ref"].attrs)
+    else:
+        spatial_ref = None
+
+    meta = {
+        "lonmin": cmgutils.LONMIN,
+        "latmin": cmgutils.LATMIN,
+        "grdsize": cmgutils.GRDSIZE,
+        "row0": row0,
+        "col0": col0,
+        "nlat": nlat,
+        "nlon": nlon,
+        "lat_descending": bool(nlat > 1 and lat[0] > lat[-1]),
+        "time": [str(t) for t in pd.DatetimeIndex(ds["time"].values)],
+        "spatial_ref": spatial_ref,
+    }
+    with open(sidecar, "w") as fp:
+        json.dump(meta, fp, indent=1, default=str)
+
+
+def open_rawcube(sidecar, *npy_paths):
+    """
+    open a cube written by export_rawcube and return it as an xarray
+    Dataset with (time, lat, lon) dimensions.  The variables are views
+    on read-only memory maps so no data is copied.
+    """
+
+    with open(sidecar) as fp:
+        meta = json.load(fp)
+
+    grdsize = meta["grdsize"]
+    rows = np.arange(meta["nlat"])
+    if meta["lat_descending"]:
+        rows = -rows
+    lat = meta["latmin"] + (meta["row0"] + rows + 0.5) * grdsize
+    lon = meta["lonmin"] + (meta["col0"] + np.arange(meta["nlon"]) + 0.5) * grdsize
+    time = pd.DatetimeIndex(meta["time"])
+
+    coords = {"time": time, "lat": lat, "lon": lon}
+    if meta["spatial_ref"] is not None:
+        coords["spatial_ref"] = xr.DataArray(0, attrs=meta["spatial_ref"])
+
+    data_vars = {}
+    for var, path in zip(VARIABLES, npy_paths):
+        cube = np.load(path, mmap_mode="r")
+        data_vars[var] = (("time", "lat", "lon"), cube.transpose(2, 0, 1))
+
+    return xr.Dataset(data_vars, coords=coords)
+
+
+def subset_cells(ds, bbox):
+    """
+    select the grid cells inside bbox = (lonmin, latmin, lonmax, latmax)
+    by grid index arithmetic.  The result is still a view on the cube.
+    """
+
+    if len(bbox) != 4:
+        errmsg = "bbox should be (lonmin, latmin, lonmax, latmax)"
+        raise ValueError(errmsg)
+
+    lonmin, latmin, lonmax, latmax = bbox
+    if lonmin > lonmax or latmin > latmax:
+        errmsg = "bbox should be (lonmin, latmin, lonmax, latmax)"
+        raise ValueError(errmsg)
+
+    lat = ds["lat"].values
+    lon = ds["lon"].values
+    grdsize = cmgutils.GRDSIZE
+
+    # cells whose centers fall inside the box
+    i0 = int(np.ceil((lonmin - lon[0]) / grdsize - 1e-6))
+    i1 = int(np.floor((lonmax - lon[0]) / grdsize + 1e-6)) + 1
+    if lat[0] > lat[-1]:
+        j0 = int(np.ceil((lat[0] - latmax) / grdsize - 1e-6))
+        j1 = int(np.floor((lat[0] - latmin) / grdsize + 1e-6)) + 1
+    else:
+        j0 = int(np.ceil((latmin - lat[0]) / grdsize - 1e-6))
+        j1 = int(np.floor((latmax - lat[0]) / grdsize + 1e-6)) + 1
+
+    return ds.isel(lon=slice(max(i0, 0), max(i1, 0)), lat=slice(max(j0, 0), max(j1, 0)))
+
+
+def get_monthly_rawcube_data(cubedir, instrument, verbose=False, bbox=None):
+    """
+    function to read the monthly sig0 mean and stddev for a single
+    instrument from the memory-mapped cubes in <cubedir>.  Same as
+    get_monthly_data but the returned Dataset is backed by the page
+    cache instead of copies of the data.
+    """
+
+    if instrument not in ["SASS", "ERS", "QuikSCAT", "ASCAT"]:
+        errmsg = "instrument should be one of 'SASS' " + "'ERS', 'QuikSCAT' or 'ASCAT'"
+        raise ValueError(errmsg)
+
+    sidecar, arrays = cube_paths(cubedir, instrument, "monthly", "land")
+    if verbose:
+        print("input cube path: {}".format(sidecar))
+
+    paths = (sidecar,) + tuple(arrays[var] for var in VARIABLES)
+    monthly_xr = ncfileio.DATASET_CACHE.get(paths, open_rawcube)
+
+    # select the box by index arithmetic
+    if bbox is not None:
+        monthly_xr = subset_cells(monthly_xr, bbox)
+
+    return monthly_xr
+
+
+def get_seasonal_rawcube_data(
+    cubedir, instrument, season="JAS", masked=False, verbose=False, bbox=None
+):
+    """
+    function to read the seasonal sig0 mean and stddev for a single
+    instrument from the memory-mapped cubes in <cubedir>.  Same as
+    get_seasonal_data but backed by the page cache.
+    """
+
+    if instrument not in ["SASS", "ERS", "QuikSCAT", "ASCAT"]:
+        errmsg = "instrument should be one of 'SASS' " + "'ERS', 'QuikSCAT' or 'ASCAT'"
+        raise ValueError(errmsg)
+
+    if season not in ncfileio.SEASON_LIST:
+        errmsg = "season should be one of 'JFM', 'AMJ', 'JAS' or 'OND'"
+        raise ValueError(errmsg)
+
+    if masked:
+        maskname = "urban"
+    else:
+        maskname = "land"
+
+    sidecar, arrays = cube_paths(cubedir, instrument, "seasonal", maskname)
+    if verbose:
+        print("input cube path: {}".format(sidecar))
+
+    paths = (sidecar,) + tuple(arrays[var] for var in VARIABLES)
+    seasonal_xr = ncfileio.DATASET_CACHE.get(paths, open_rawcube)
+
+    # select the box first so only the box is copied by the time selection
+    if bbox is not None:
+        seasonal_xr = subset_cells(seasonal_xr, bbox)
+
+    # select season
+    month = ncfileio.SEASON_SEL[season]
+    season_xr = seasonal_xr.sel(time=seasonal_xr.time.dt.month == month)
+    return season_xr
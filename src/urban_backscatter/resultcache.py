@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Two-tier cache of extracted city tables.  A table is keyed on the
+# center cell of the box (as snapped by box11), the box size, the
+# instruments, the monthly mode or the season, the layout and the
+# (path, mtime, size) fingerprint of the input files of those
+# instruments.  Tables are kept in an in-process LRU and, if a cache
+# directory is given, as zstd-compressed parquet files that are evicted
+# (least recently used first) once the directory grows past a size cap.
+# A repeated request only stats the input files, and changing a data
+# file changes the key so the stale entries are never used again and
+# age out of the cache.
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from . import batch
+from . import cmgutils
+from . import ncfileio
+
+# default number of tables kept in memory
+MEMORY_SIZE = 256
+
+# default size cap of the cache directory in bytes
+DISK_BYTES = 2**30
+
+
+class ResultCache:
+    """
+    LRU cache of tables in memory (maxsize tables) with an optional
+    second tier of compressed parquet files in cachedir, capped at
+    max_bytes.  maxsize=0 disables the memory tier.
+    """
+
+    def __init__(self, cachedir=None, maxsize=MEMORY_SIZE, max_bytes=DISK_BYTES):
+        self.cachedir = cachedir
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if cachedir is not None:
+            os.makedirs(cachedir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cachedir, "{}.parquet".format(key))
+
+    def get(self, key):
+        """
+        return a copy of the cached table for key, or None
+        """
+
+        with self._lock:
+            df = self._entries.get(key)
+            if df is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return df.copy()
+
+        if self.cachedir is not None:
+            path = self._path(key)
+            try:
+                df = pd.read_parquet(path)
+                # the modification time orders the files for eviction
+                os.utime(path)
+            except (FileNotFoundError, OSError):
+                df = None
+            if df is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._remember(key, df)
+                return df.copy()
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, df):
+        """
+        store a table in both tiers
+        """
+
+        with self._lock:
+            self._remember(key, df.copy())
+
+        if self.cachedir is not None:
+            path = self._path(key)
+            tmppath = "{}.{}.tmp".format(path, threading.get_ident())
+            df.to_parquet(tmppath, index=False, compression="zstd")
+            os.replace(tmppath, path)
+            self._evict_files()
+
+    def clear(self):
+        """
+        drop all tables from memory and disk and reset the counters
+        """
+
+        with self._lock:
+            self._entries.clear()
+            self.memory_hits = 0
+            self.disk_hits = 0
+            self.misses = 0
+            self.evictions = 0
+        for path in self._files():
+            os.remove(path)
+
+    def stats(self):
+        """
+        return a dictionary with cache counters and current sizes
+        """
+
+        with self._lock:
+            stats = {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+            }
+        stats["disk_bytes"] = sum(os.path.getsize(x) for x in self._files())
+        return stats
+
+    def _remember(self, key, df):
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = df
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _files(self):
+        if self.cachedir is None:
+            return []
+        return [
+            os.path.join(self.cachedir, x)
+            for x in os.listdir(self.cachedir)
+            if x.endswith(".parquet")
+        ]
+
+    def _evict_files(self):
+        # remove the least recently used files until under the cap
+        files = []
+        for path in self._files():
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime_ns, st.st_size, path))
+        total = sum(x[1] for x in files)
+        for mtime, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+
+# process-wide cache (memory only unless set_cache_dir is called)
+RESULT_CACHE = ResultCache()
+
+
+def set_cache_dir(cachedir, max_bytes=DISK_BYTES):
+    """
+    add an on-disk tier in cachedir (capped at max_bytes) to the
+    process-wide result cache
+    """
+
+    global RESULT_CACHE
+    RESULT_CACHE = ResultCache(cachedir, RESULT_CACHE.maxsize, max_bytes)
+
+
+def instrument_paths(datadir, instruments, mode, masked=False):
+    """
+    return the input files read for the instruments (the monthly data
+    only come unmasked)
+    """
+
+    maskname = "urban" if masked and mode == "seasonal" else "land"
+    paths = []
+    for instrument in instruments:
+        prefix = "{}_{}_{}_sig0".format(instrument, mode, maskname)
+        paths.append(os.path.join(datadir, prefix + "_mean.nc"))
+        paths.append(os.path.join(datadir, prefix + "_StdDev.nc"))
+    return paths
+
+
+def result_key(
+    datadir,
+    lon,
+    lat,
+    mode="seasonal",
+    season="JAS",
+    instruments=None,
+    halfwidth=cmgutils.HALFWIDTH,
+    layout="wide",
+    masked=False,
+):
+    """
+    Return the cache key (a hex digest) of a city table.  Locations in
+    the same center cell give the same key.
+    """
+
+    instruments = _instruments(mode, instruments)
+    row, col = cmgutils.grid_index(lon, lat)
+    paths = instrument_paths(datadir, instruments, mode, masked)
+    fingerprint = [
+        (os.path.basename(path), mtime, size)
+        for path, mtime, size in ncfileio.file_fingerprint(paths)
+    ]
+    params = {
+        "cell": [int(row), int(col)],
+        "halfwidth": int(halfwidth),
+        "instruments": instruments,
+        "mode": mode,
+        "season": season if mode == "seasonal" else None,
+        "layout": layout,
+        "masked": bool(masked) if mode == "seasonal" else None,
+        "inputs": fingerprint,
+    }
+    text = json.dumps(params, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def _instruments(mode, instruments):
+    # requested instruments in the order of the extract scripts
+    specs = batch.table_specs(mode)
+    known = [x for x, spec in specs]
+    if instruments is None:
+        return known
+    for instrument in instruments:
+        if instrument not in known:
+            errmsg = "instrument should be one of {}".format(", ".join(known))
+            raise ValueError(errmsg)
+    return [x for x in known if x in instruments]
+
+
+def extract_table(
+    datadir,
+    lon,
+    lat,
+    mode="seasonal",
+    season="JAS",
+    instruments=None,
+    halfwidth=cmgutils.HALFWIDTH,
+    layout="wide",
+    masked=False,
+    verbose=False,
+):
+    """
+    Read the box around lon/lat for each instrument and build the table
+    written by the extract scripts (without the cache)
+    """
+
+    if mode not in batch.MODES:
+        errmsg = "mode should be one of 'monthly' or 'seasonal'"
+        raise ValueError(errmsg)
+
+    instruments = _instruments(mode, instruments)
+    bbox = cmgutils.box_bounds(lon, lat, halfwidth)
+    specs = dict(batch.table_specs(mode, season, layout))
+
+    dfs = []
+    for instrument in instruments:
+        if mode == "monthly":
+            srctag, start_date, end_date = batch.MONTHLY_INSTRUMENTS[instrument]
+            ds = ncfileio.get_monthly_data(
+                datadir, instrument, verbose=verbose, bbox=bbox
+            )
+            ds = ds.sel(time=slice(start_date, end_date))
+        else:
+            ds = ncfileio.get_seasonal_data(
+                datadir,
+                instrument,
+                season=season,
+                masked=masked,
+                verbose=verbose,
+                bbox=bbox,
+            )
+        dfs.append(batch.convert_box(ds, *specs[instrument]))
+
+    return batch.merge_tables(dfs, layout)
+
+
+def cached_table(
+    datadir,
+    lon,
+    lat,
+    mode="seasonal",
+    season="JAS",
+    instruments=None,
+    halfwidth=cmgutils.HALFWIDTH,
+    layout="wide",
+    masked=False,
+    cache=None,
+    verbose=False,
+):
+    """
+    Return the table of extract_table from the result cache (by default
+    the process-wide RESULT_CACHE), extracting and storing it on a miss
+    """
+
+    if cache is None:
+        cache = RESULT_CACHE
+
+    key = result_key(
+        datadir, lon, lat, mode, season, instruments, halfwidth, layout, masked
+    )
+    df = cache.get(key)
+    if df is not None:
+        if verbose:
+            print("result cache hit: {}".format(key))
+        return df
+
+    df = extract_table(
+        datadir,
+        lon,
+        lat,
+        mode,
+        season,
+        instruments,
+        halfwidth,
+        layout,
+        masked,
+        verbose,
+    )
+    cache.put(key, df)
+    return df
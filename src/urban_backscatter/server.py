@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Local HTTP server answering box extractions from resident data.  The
+monthly and seasonal data of every instrument are opened (and by
+default loaded into memory) once at startup, each query only gathers
+its box from memory and builds the table as the batch extraction does.
+Requests are handled by a pool of threads.
+
+Endpoints:
+
+/extract   lat, lon, box (cells per side, odd, default 11),
+           instrument (repeat or comma separated, default all),
+           mode (monthly/seasonal), season, layout (wide/long) and
+           format (csv/json/parquet)
+/health    status, instruments and uptime
+/metrics   request counters and latency histograms per endpoint
+"""
+
+import io
+import sys
+import json
+import time
+import argparse
+import datetime
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import urban_backscatter as ubs
+from urban_backscatter import batch
+
+# upper bounds (ms) of the latency histogram buckets, the last bucket
+# counts everything slower
+LATENCY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+# largest box (cells per side) served
+MAX_BOX = 201
+
+RESPONSE_FORMATS = {
+    "csv": "text/csv",
+    "json": "application/json",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+ENDPOINTS = ["/extract", "/health", "/metrics"]
+
+
+class ResidentData:
+    """
+    Monthly and seasonal datasets of every instrument, opened once (as
+    batch.load_monthly and batch.load_seasonal) and with load=True read
+    into memory
+    """
+
+    def __init__(self, datadir, cubedir=None, load=True, verbose=False):
+        self.datadir = datadir
+        self.monthly = batch.load_monthly(datadir, cubedir=cubedir, verbose=verbose)
+        self.seasonal = batch.load_seasonal(
+            datadir, ubs.ncfileio.SEASON_LIST, cubedir=cubedir, verbose=verbose
+        )
+        if load:
+            for instrument, ds in self.monthly.items():
+                if verbose:
+                    print("loading monthly {}".format(instrument))
+                self.monthly[instrument] = ds.load()
+            for instrument, seasons in self.seasonal.items():
+                if verbose:
+                    print("loading seasonal {}".format(instrument))
+                for season, ds in seasons.items():
+                    seasons[season] = ds.load()
+        self.started = time.time()
+
+    @property
+    def instruments(self):
+        return list(self.monthly)
+
+    def datasets(self, mode, instruments, season=None):
+        """
+        return the datasets of the instruments for a mode (and season)
+        """
+
+        if mode == "monthly":
+            return [self.monthly[x] for x in instruments]
+        return [self.seasonal[x][season] for x in instruments]
+
+
+def extract_box(
+    data,
+    lat,
+    lon,
+    box=2 * ubs.cmgutils.HALFWIDTH + 1,
+    instruments=None,
+    mode="seasonal",
+    season="JAS",
+    layout="wide",
+):
+    """
+    Return the table for a box of box x box cells around lat/lon from
+    the resident data, the same table the batch extraction writes for
+    a city.  instruments defaults to all of them.
+    """
+
+    if mode not in batch.MODES:
+        errmsg = "mode should be one of 'monthly' or 'seasonal'"
+        raise ValueError(errmsg)
+
+    if mode == "seasonal" and season not in ubs.ncfileio.SEASON_LIST:
+        errmsg = "season should be one of 'JFM', 'AMJ', 'JAS' or 'OND'"
+        raise ValueError(errmsg)
+
+    if layout not in ubs.dsutils.LAYOUTS:
+        errmsg = "layout should be one of 'wide' or 'long'"
+        raise ValueError(errmsg)
+
+    if box < 1 or box > MAX_BOX or box % 2 == 0:
+        errmsg = "box should be an odd number of cells between 1 and {}".format(MAX_BOX)
+        raise ValueError(errmsg)
+
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+        errmsg = "lat should be in -90..90 and lon in -180..180"
+        raise ValueError(errmsg)
+
+    specs = batch.table_specs(mode, season, layout)
+    if instruments is not None:
+        unknown = set(instruments) - set(x for x, spec in specs)
+        if unknown:
+            errmsg = "instrument should be one of {}".format(
+                ", ".join(x for x, spec in specs)
+            )
+            raise ValueError(errmsg)
+        specs = [(x, spec) for x, spec in specs if x in instruments]
+
+    datasets = data.datasets(mode, [x for x, spec in specs], season)
+    tables = batch.city_tables(
+        datasets, [spec for x, spec in specs], [lon], [lat], halfwidth=box // 2
+    )
+    return tables[0]
+
+
+def encode_table(df, fmt="csv"):
+    """
+    Return a table as bytes in the csv (as written by dsutils.write_table),
+    json (list of records) or parquet format
+    """
+
+    if fmt == "csv":
+        return df.to_csv(na_rep="-9999.0", index=False).encode()
+    if fmt == "json":
+        return df.to_json(orient="records", date_format="iso").encode()
+    if fmt == "parquet":
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, index=False)
+        return buffer.getvalue()
+
+    errmsg = "format should be one of 'csv', 'json' or 'parquet'"
+    raise ValueError(errmsg)
+
+
+class Metrics:
+    """
+    Thread-safe request counters and latency histograms per endpoint
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = list(buckets)
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def observe(self, endpoint, status, seconds):
+        """
+        record one request
+        """
+
+        ms = seconds * 1000.0
+        with self.lock:
+            entry = self.endpoints.setdefault(
+                endpoint,
+                {
+                    "count": 0,
+                    "status": {},
+                    "latency_ms_sum": 0.0,
+                    "latency_ms_max": 0.0,
+                    "latency_ms_buckets": [0] * (len(self.buckets) + 1),
+                },
+            )
+            entry["count"] += 1
+            entry["status"][str(status)] = entry["status"].get(str(status), 0) + 1
+            entry["latency_ms_sum"] += ms
+            entry["latency_ms_max"] = max(entry["latency_ms_max"], ms)
+            position = len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if ms <= bound:
+                    position = i
+                    break
+            entry["latency_ms_buckets"][position] += 1
+
+    def snapshot(self):
+        """
+        Return the counters as a dictionary, the histogram buckets are
+        keyed by their upper bound in ms ('inf' for the last one)
+        """
+
+        bounds = [str(x) for x in self.buckets] + ["inf"]
+        with self.lock:
+            endpoints = {}
+            for endpoint, entry in self.endpoints.items():
+                endpoints[endpoint] = {
+                    "count": entry["count"],
+                    "status": dict(entry["status"]),
+                    "latency_ms_sum": entry["latency_ms_sum"],
+                    "latency_ms_max": entry["latency_ms_max"],
+                    "latency_ms_buckets": dict(
+                        zip(bounds, entry["latency_ms_buckets"])
+                    ),
+                }
+        return {
+            "requests": sum(x["count"] for x in endpoints.values()),
+            "endpoints": endpoints,
+        }
+
+
+def _query_params(query):
+    """
+    convert the /extract query string to extract_box keyword arguments
+    and the response format
+    """
+
+    params = parse_qs(query)
+
+    def single(name, default=None):
+        values = params.get(name)
+        return values[-1] if values else default
+
+    try:
+        lat = float(single("lat"))
+        lon = float(single("lon"))
+        box = int(single("box", 2 * ubs.cmgutils.HALFWIDTH + 1))
+    except (TypeError, ValueError):
+        errmsg = "lat and lon should be numbers and box an integer"
+        raise ValueError(errmsg)
+
+    instruments = None
+    if "instrument" in params:
+        instruments = [
+            x for value in params["instrument"] for x in value.split(",") if x
+        ]
+
+    kwargs = {
+        "lat": lat,
+        "lon": lon,
+        "box": box,
+        "instruments": instruments,
+        "mode": single("mode", "seasonal"),
+        "season": single("season", "JAS"),
+        "layout": single("layout", "wide"),
+    }
+    fmt = single("format", "csv")
+    if fmt not in RESPONSE_FORMATS:
+        errmsg = "format should be one of 'csv', 'json' or 'parquet'"
+        raise ValueError(errmsg)
+    return kwargs, fmt
+
+
+def make_handler(data, metrics, verbose=False):
+    """
+    Return a request handler class answering from data and counting
+    requests in metrics
+    """
+
+    class ExtractionHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            start = time.perf_counter()
+            url = urlparse(self.path)
+            endpoint = url.path if url.path in ENDPOINTS else "other"
+            fmt = "json"
+            try:
+                if url.path == "/extract":
+                    kwargs, fmt = _query_params(url.query)
+                    df = extract_box(data, **kwargs)
+                    status, body = 200, encode_table(df, fmt)
+                elif url.path == "/health":
+                    health = {
+                        "status": "ok",
+                        "datadir": data.datadir,
+                        "instruments": data.instruments,
+                        "uptime_s": time.time() - data.started,
+                    }
+                    status, body = 200, json.dumps(health).encode()
+                elif url.path == "/metrics":
+                    status, body = 200, json.dumps(metrics.snapshot()).encode()
+                else:
+                    status, body = 404, json.dumps({"error": "not found"}).encode()
+            except ValueError as err:
+                fmt = "json"
+                status, body = 400, json.dumps({"error": str(err)}).encode()
+            except Exception as err:
+                fmt = "json"
+                status, body = 500, json.dumps({"error": str(err)}).encode()
+
+            # count the request before answering, so a client sees its
+            # own requests in /metrics
+            metrics.observe(endpoint, status, time.perf_counter() - start)
+            self.send_response(status)
+            self.send_header("Content-Type", RESPONSE_FORMATS[fmt])
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            if verbose:
+                BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    return ExtractionHandler
+
+
+def make_server(data, host="127.0.0.1", port=8000, verbose=False):
+    """
+    Return a threading HTTP server answering from data (a ResidentData),
+    its request metrics are in server.metrics.  port=0 picks a free port
+    (see server.server_address).
+    """
+
+    metrics = Metrics()
+    server = ThreadingHTTPServer((host, port), make_handler(data, metrics, verbose))
+    server.daemon_threads = True
+    server.metrics = metrics
+    return server
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description=(
+            "serve box extractions over HTTP from the monthly and seasonal"
+            + " data of all instruments kept in memory."
+        )
+    )
+
+    parser.add_argument(
+        "-d",
+        "--datadir",
+        help="directory with the netcdf files. Default: ./data",
+        default="./data",
+    )
+
+    parser.add_argument(
+        "-c",
+        "--cubedir",
+        help="read the memory-mapped cubes in CUBEDIR instead of the netcdf files",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--host",
+        help="address to listen on. Default: 127.0.0.1",
+        default="127.0.0.1",
+    )
+
+    parser.add_argument(
+        "-p",
+        "--port",
+        type=int,
+        help="port to listen on. Default: 8000",
+        default=8000,
+    )
+
+    parser.add_argument(
+        "--lazy",
+        help="keep the data on disk instead of loading it into memory",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        help="increase output verbosity and log every request",
+        action="store_true",
+        default=False,
+    )
+
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+    verbose = args.verbose
+
+    if verbose:
+        today = datetime.date.today()
+        print("date: {}".format(today))
+        print("data directory: {}".format(args.datadir))
+
+    data = ResidentData(
+        args.datadir, cubedir=args.cubedir, load=not args.lazy, verbose=verbose
+    )
+    server = make_server(data, args.host, args.port, verbose=verbose)
+    host, port = server.server_address[:2]
+    print("serving on http://{}:{}".format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    return 0
+
+
+def run():
+    sys.exit(main(sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    run()
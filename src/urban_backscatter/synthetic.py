@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Synthetic backscatter data on the CMG grid.  Writes monthly and
+seasonal mean/StdDev netcdf files with the names, variables and time
+axes of the real data files, so the extraction code can be exercised
+and benchmarked without the real data.  With scale=1 the files cover
+the whole CMG grid, a smaller scale keeps that fraction of the rows and
+columns (still on the CMG cell centers) around a center location.  The
+cubes are written one band of rows at a time, so memory does not
+depend on the grid size.
+"""
+
+import sys
+import os
+import argparse
+import datetime
+
+import netCDF4
+import numpy as np
+import pandas as pd
+
+import urban_backscatter as ubs
+
+# time axes of the real monthly files: (first month, number of months)
+MONTHLY_TIMES = {
+    "ERS": ("1993-01-01", 96),
+    "QuikSCAT": ("1999-07-01", 125),
+    "ASCAT": ("2007-01-01", 168),
+}
+
+# years covered by the real seasonal files
+SEASONAL_YEARS = {
+    "ERS": (1993, 2000),
+    "QuikSCAT": (1999, 2009),
+    "ASCAT": (2007, 2020),
+}
+
+# default center of a scaled down region (Boston)
+CENTER = (-71.06, 42.36)
+
+# number of latitude rows written at a time
+BAND_ROWS = 8
+
+# cells with an urban fraction above this are in the urban files
+URBAN_THRESHOLD = 0.3
+
+
+def region_indices(scale=1.0, center=CENTER):
+    """
+    Return the CMG (row0, row1, col0, col1) index range of the region
+    kept for a scale factor, scale is the fraction of the rows and
+    columns of the grid kept around center (lon, lat)
+    """
+
+    if not 0.0 < scale <= 1.0:
+        errmsg = "scale should be larger than 0 and at most 1"
+        raise ValueError(errmsg)
+
+    nrows = max(1, int(round(ubs.cmgutils.NROWS * scale)))
+    ncols = max(1, int(round(ubs.cmgutils.NCOLS * scale)))
+    row, col = ubs.cmgutils.grid_index(center[0], center[1])
+    row0 = min(max(int(row) - nrows // 2, 0), ubs.cmgutils.NROWS - nrows)
+    col0 = min(max(int(col) - ncols // 2, 0), ubs.cmgutils.NCOLS - ncols)
+    return row0, row0 + nrows, col0, col0 + ncols
+
+
+def monthly_times(instrument):
+    """
+    return the monthly time axis of an instrument
+    """
+
+    start, nmonths = MONTHLY_TIMES[instrument]
+    return pd.date_range(start, periods=nmonths, freq="MS")
+
+
+def seasonal_times(instrument):
+    """
+    return the seasonal time axis of an instrument (the 15th of the
+    middle month of each quarter)
+    """
+
+    year0, year1 = SEASONAL_YEARS[instrument]
+    return pd.to_datetime(
+        [
+            "{}-{:02d}-15".format(year, month)
+            for year in range(year0, year1 + 1)
+            for month in ubs.ncfileio.SEASON_SEL.values()
+        ]
+    )
+
+
+def cell_fields(lon, lat, seed=0):
+    """
+    Return the land mask and urban fraction of the cells of a band of
+    rows with centers lon (ncol,) and lat (nrow,).  The fields only
+    depend on the cell and seed, so every file agrees on them.
+    """
+
+    lon2, lat2 = np.meshgrid(lon, lat)
+    land = np.sin(np.radians(3.0 * lon2)) + np.cos(np.radians(4.0 * lat2)) > -0.5
+
+    # pseudo-random but fixed per cell, mostly close to 0
+    rows, cols = ubs.cmgutils.grid_index(lon2, lat2)
+    cells = (rows * ubs.cmgutils.NCOLS + cols).astype("uint64")
+    hashed = (cells * np.uint64(2654435761) + np.uint64(seed)) % np.uint64(2**32)
+    fraction = (hashed.astype("float64") / 2**32) ** 6
+    fraction[~land] = 0.0
+    return land, fraction
+
+
+def band_values(times, land, fraction, mask, rng):
+    """
+    Return sig0 and sig0std (time, nrow, ncol) float32 values for a band
+    of rows: a brighter base level for urban cells, a seasonal cycle, a
+    small trend and noise, NaN outside mask and for a few random values
+    """
+
+    times = pd.DatetimeIndex(times)
+    years = np.asarray(times.year + (times.month - 1) / 12.0, dtype="float64")
+    shape = (len(times),) + land.shape
+
+    base = -14.0 + 8.0 * fraction
+    cycle = np.cos(2.0 * np.pi * (times.month.values - 7) / 12.0)
+    trend = 0.02 * (years - years[0])
+    offset = (cycle + trend)[:, np.newaxis, np.newaxis]
+
+    sig0 = base + offset + rng.normal(0.0, 0.5, shape)
+    sig0std = rng.uniform(0.5, 2.0, shape)
+
+    missing = ~mask | (rng.random(shape) < 0.02)
+    sig0[missing] = np.nan
+    sig0std[missing] = np.nan
+    return sig0.astype("float32"), sig0std.astype("float32")
+
+
+def _create(path, variable, times, lat, lon):
+    """
+    create a netcdf file with the coordinates and an empty variable laid
+    out like the real data files
+    """
+
+    nc = netCDF4.Dataset(path, "w")
+    nc.createDimension("time", len(times))
+    nc.createDimension("lat", len(lat))
+    nc.createDimension("lon", len(lon))
+
+    time_var = nc.createVariable("time", "f8", ("time",))
+    time_var.units = "days since 1970-01-01"
+    time_var.calendar = "standard"
+    time_var[:] = (pd.DatetimeIndex(times) - pd.Timestamp("1970-01-01")).days
+
+    lat_var = nc.createVariable("lat", "f8", ("lat",))
+    lat_var.units = "degrees_north"
+    lat_var[:] = lat
+    lon_var = nc.createVariable("lon", "f8", ("lon",))
+    lon_var.units = "degrees_east"
+    lon_var[:] = lon
+
+    crs = nc.createVariable("spatial_ref", "i4")
+    crs.crs_wkt = "EPSG:4326"
+    crs.assignValue(0)
+
+    var = nc.createVariable(
+        variable, "f4", ("time", "lat", "lon"), fill_value=np.float32(np.nan)
+    )
+    var.units = "dB"
+    var.coordinates = "spatial_ref"
+    return nc
+
+
+def write_cube(prefix, times, region, mask="land", seed=0, verbose=False):
+    """
+    Write the <prefix>_sig0_mean.nc and <prefix>_sig0_StdDev.nc files
+    for a region given by region_indices.  mask is 'land' or 'urban' and
+    selects the cells with data.  Returns the two paths.
+    """
+
+    row0, row1, col0, col1 = region
+    lon, lat = ubs.cmgutils.cell_centers(np.arange(row0, row1), np.arange(col0, col1))
+    mean_path = "{}_sig0_mean.nc".format(prefix)
+    std_path = "{}_sig0_StdDev.nc".format(prefix)
+    if verbose:
+        print(
+            "writing: {} ({} x {} x {})".format(
+                mean_path, len(times), len(lat), len(lon)
+            )
+        )
+
+    mean_nc = _create(mean_path, "sig0", times, lat, lon)
+    std_nc = _create(std_path, "sig0std", times, lat, lon)
+    try:
+        for start in range(0, len(lat), BAND_ROWS):
+            band_lat = lat[start : start + BAND_ROWS]
+            land, fraction = cell_fields(lon, band_lat, seed)
+            cells = land if mask == "land" else fraction > URBAN_THRESHOLD
+            rng = np.random.default_rng([seed, len(times), row0 + start])
+            sig0, sig0std = band_values(times, land, fraction, cells, rng)
+            stop = start + len(band_lat)
+            mean_nc["sig0"][:, start:stop, :] = sig0
+            std_nc["sig0std"][:, start:stop, :] = sig0std
+    finally:
+        mean_nc.close()
+        std_nc.close()
+
+    return mean_path, std_path
+
+
+def write_synthetic_data(
+    outdir,
+    scale=1.0,
+    instruments=None,
+    center=CENTER,
+    monthly=True,
+    seasonal=True,
+    seed=0,
+    verbose=False,
+):
+    """
+    Write synthetic monthly (land) and seasonal (land and urban) files
+    for each instrument to outdir, with the file names and time axes
+    of the real data, see region_indices for scale and center.  Returns
+    the list of files written.
+    """
+
+    if instruments is None:
+        instruments = list(MONTHLY_TIMES)
+    for instrument in instruments:
+        if instrument not in MONTHLY_TIMES:
+            errmsg = "instrument should be one of {}".format(", ".join(MONTHLY_TIMES))
+            raise ValueError(errmsg)
+
+    os.makedirs(outdir, exist_ok=True)
+    region = region_indices(scale, center)
+
+    written = []
+    for instrument in instruments:
+        if monthly:
+            prefix = os.path.join(outdir, "{}_monthly_land".format(instrument))
+            written.extend(
+                write_cube(
+                    prefix, monthly_times(instrument), region, "land", seed, verbose
+                )
+            )
+        if seasonal:
+            for mask in ["land", "urban"]:
+                prefix = os.path.join(outdir, "{}_seasonal_{}".format(instrument, mask))
+                written.extend(
+                    write_cube(
+                        prefix, seasonal_times(instrument), region, mask, seed, verbose
+                    )
+                )
+
+    return written
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description=(
+            "write synthetic monthly and seasonal backscatter netcdf files"
+            + " on the CMG grid with the names and time axes of the real data."
+        )
+    )
+
+    parser.add_argument(
+        "-s",
+        "--scale",
+        type=float,
+        help=(
+            "fraction of the CMG rows and columns to write, 1 for the"
+            + " whole grid. Default: 1"
+        ),
+        default=1.0,
+    )
+
+    parser.add_argument(
+        "-i",
+        "--instrument",
+        action="append",
+        choices=list(MONTHLY_TIMES),
+        help="instrument to write (repeat for several). Default: all",
+    )
+
+    parser.add_argument(
+        "-c",
+        "--center",
+        type=float,
+        nargs=2,
+        metavar=("LON", "LAT"),
+        help="center of a scaled down region. Default: {} {}".format(*CENTER),
+        default=CENTER,
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="random seed. Default: 0",
+        default=0,
+    )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        help="increase output verbosity",
+        action="store_true",
+        default=False,
+    )
+
+    # add positional arguments
+    parser.add_argument("outdir", help="output directory")
+
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+    verbose = args.verbose
+
+    if verbose:
+        today = datetime.date.today()
+        print("date: {}".format(today))
+        print("scale: {}".format(args.scale))
+        print("output directory: {}".format(args.outdir))
+
+    written = write_synthetic_data(
+        args.outdir,
+        scale=args.scale,
+        instruments=args.instrument,
+        center=tuple(args.center),
+        seed=args.seed,
+        verbose=verbose,
+    )
+
+    if verbose:
+        print("wrote {} files".format(len(written)))
+
+    return 0
+
+
+def run():
+    sys.exit(main(sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Per grid cell linear trends of the backscatter cubes.  A closed-form
+least-squares line is fitted to the valid values of each cell over the
+time axis, one tile of cells at a time so the whole CMG grid can be
+processed in bounded memory, optionally with several threads.  The
+slope, intercept, r2 and valid count maps are written as netcdf or zarr
+on the CMG coordinates of the input.
+"""
+
+import sys
+import argparse
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import urban_backscatter as ubs
+
+# tile size in grid cells
+TILE = 256
+
+# smallest number of valid values for a trend
+MIN_COUNT = 3
+
+TREND_VARIABLES = ["slope", "intercept", "r2", "count"]
+
+
+def decimal_years(times):
+    """
+    Return the times as years since the first time step
+    """
+
+    times = pd.DatetimeIndex(times)
+    days = (times - times[0]) / pd.Timedelta(days=1)
+    return np.asarray(days, dtype="float64") / 365.25
+
+
+def fit_block(values, years, min_count=MIN_COUNT):
+    """
+    Fit a least-squares line to each cell of a (time, ...) block of
+    values against years, skipping NaN values.  Returns a dictionary of
+    slope, intercept (value at years = 0), r2 and count arrays with the
+    shape of one time step.  Cells with fewer than min_count values get
+    NaN trends.
+    """
+
+    values = np.asarray(values, dtype="float64")
+    valid = ~np.isnan(values)
+    t = np.where(valid, years.reshape((-1,) + (1,) * (values.ndim - 1)), 0.0)
+    y = np.where(valid, values, 0.0)
+
+    n = valid.sum(axis=0)
+    st = t.sum(axis=0)
+    sy = y.sum(axis=0)
+    stt = (t * t).sum(axis=0)
+    sty = (t * y).sum(axis=0)
+    syy = (y * y).sum(axis=0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        dtt = n * stt - st * st
+        dty = n * sty - st * sy
+        dyy = n * syy - sy * sy
+        slope = dty / dtt
+        intercept = (sy - slope * st) / n
+        r2 = np.where(dyy > 0, dty * dty / (dtt * dyy), np.nan)
+
+    # too few values or all at the same time
+    bad = (n < min_count) | ~(dtt > 0)
+    slope[bad] = np.nan
+    intercept[bad] = np.nan
+    r2[bad] = np.nan
+
+    return {"slope": slope, "intercept": intercept, "r2": r2, "count": n}
+
+
+def iter_tiles(nlat, nlon, tile=TILE):
+    """
+    Yield (lat slice, lon slice) pairs covering a nlat x nlon grid
+    """
+
+    if tile < 1:
+        errmsg = "tile should be at least 1"
+        raise ValueError(errmsg)
+
+    for row in range(0, nlat, tile):
+        for col in range(0, nlon, tile):
+            yield slice(row, min(row + tile, nlat)), slice(col, min(col + tile, nlon))
+
+
+def cell_trends(ds, variable="sig0", tile=TILE, workers=1, min_count=MIN_COUNT):
+    """
+    Fit a trend (per year) to every grid cell of one variable of a
+    (time, lat, lon) dataset as returned by the ncfileio, rawcube or
+    store loaders.  The dataset may be lazy, it is read one tile at a
+    time, by a pool of workers threads if workers > 1.  Returns a
+    Dataset with slope, intercept, r2 and count maps on the lat/lon
+    coordinates of ds.
+    """
+
+    if variable not in ds.data_vars:
+        errmsg = "variable should be one of {}".format(", ".join(ds.data_vars))
+        raise ValueError(errmsg)
+
+    years = decimal_years(ds["time"].values)
+    nlat, nlon = ds.sizes["lat"], ds.sizes["lon"]
+    maps = {
+        "slope": np.full((nlat, nlon), np.nan, dtype="float32"),
+        "intercept": np.full((nlat, nlon), np.nan, dtype="float32"),
+        "r2": np.full((nlat, nlon), np.nan, dtype="float32"),
+        "count": np.zeros((nlat, nlon), dtype="int32"),
+    }
+
+    def fit_tile(tile_slices):
+        lat_slice, lon_slice = tile_slices
+        block = ds[variable].isel(lat=lat_slice, lon=lon_slice)
+        fit = fit_block(block.transpose("time", "lat", "lon").values, years, min_count)
+        for name, values in fit.items():
+            maps[name][lat_slice, lon_slice] = values
+
+    tiles = iter_tiles(nlat, nlon, tile)
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for _ in pool.map(fit_tile, tiles):
+                pass
+    else:
+        for tile_slices in tiles:
+            fit_tile(tile_slices)
+
+    coords = {"lat": ds["lat"].values, "lon": ds["lon"].values}
+    if "spatial_ref" in ds.coords:
+        coords["spatial_ref"] = ds["spatial_ref"]
+
+    units = ds[variable].attrs.get("units", "dB")
+    attrs = {
+        "slope": {"units": "{} per year".format(units)},
+        "intercept": {
+            "units": units,
+            "long_name": "trend value at {}".format(
+                pd.Timestamp(ds["time"].values[0]).date()
+            ),
+        },
+        "r2": {"long_name": "coefficient of determination"},
+        "count": {"long_name": "number of valid values"},
+    }
+    data_vars = {
+        name: xr.DataArray(maps[name], dims=("lat", "lon"), attrs=attrs[name])
+        for name in TREND_VARIABLES
+    }
+    trends = xr.Dataset(data_vars, coords=coords)
+    trends.attrs["variable"] = variable
+    trends.attrs["time_start"] = str(pd.Timestamp(ds["time"].values[0]))
+    trends.attrs["time_end"] = str(pd.Timestamp(ds["time"].values[-1]))
+    return trends
+
+
+def write_trends(trends, outpath):
+    """
+    Write the trend maps to netcdf, or to a zarr store if outpath ends
+    in .zarr
+    """
+
+    if outpath.rstrip("/").endswith(".zarr"):
+        trends.to_zarr(outpath, mode="w")
+    else:
+        trends.to_netcdf(outpath)
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description=(
+            "fit a linear trend to the values of each grid cell over"
+            + " time and write the slope, intercept, r2 and count maps."
+        )
+    )
+
+    parser.add_argument(
+        "-m",
+        "--mode",
+        choices=["monthly", "seasonal"],
+        help="fit monthly or seasonal values. Default: seasonal",
+        default="seasonal",
+    )
+
+    parser.add_argument(
+        "-s",
+        "--season",
+        choices=ubs.ncfileio.SEASON_LIST,
+        help="season/quarter to select. Default: JAS",
+        default="JAS",
+    )
+
+    parser.add_argument(
+        "-i",
+        "--instrument",
+        choices=["ERS", "QuikSCAT", "ASCAT"],
+        help="instrument to fit. Default: ASCAT",
+        default="ASCAT",
+    )
+
+    parser.add_argument(
+        "--variable",
+        choices=["sig0", "sig0std"],
+        help="variable to fit. Default: sig0",
+        default="sig0",
+    )
+
+    parser.add_argument(
+        "--masked",
+        help="use the urban masked seasonal files",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "-b",
+        "--bbox",
+        type=float,
+        nargs=4,
+        metavar=("LONMIN", "LATMIN", "LONMAX", "LATMAX"),
+        help="only fit the grid cells inside this box",
+        default=None,
+    )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        help="increase output verbosity",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "-d",
+        "--datadir",
+        help="directory with the netcdf files. Default: ./data",
+        default="./data",
+    )
+
+    parser.add_argument(
+        "-t",
+        "--tile",
+        type=int,
+        help="tile size in grid cells. Default: {}".format(TILE),
+        default=TILE,
+    )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="number of worker threads. Default: 1",
+        default=1,
+    )
+
+    # add positional arguments
+    parser.add_argument("outpath", help="output netcdf file or .zarr store")
+
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+    verbose = args.verbose
+
+    if verbose:
+        today = datetime.date.today()
+        print("date: {}".format(today))
+        print("mode: {}".format(args.mode))
+        print("instrument: {}".format(args.instrument))
+        print("data directory: {}".format(args.datadir))
+        print("output: {}".format(args.outpath))
+
+    if args.mode == "monthly":
+        myds = ubs.ncfileio.get_monthly_data(
+            args.datadir, args.instrument, verbose=verbose
+        )
+    else:
+        myds = ubs.ncfileio.get_seasonal_data(
+            args.datadir,
+            args.instrument,
+            season=args.season,
+            masked=args.masked,
+            verbose=verbose,
+        )
+
+    if args.bbox is not None:
+        myds = ubs.ncfileio.subset_bbox(myds, args.bbox, load=False)
+
+    trends = cell_trends(
+        myds, variable=args.variable, tile=args.tile, workers=args.workers
+    )
+    write_trends(trends, args.outpath)
+
+    if verbose:
+        ncells = int((trends["count"] >= MIN_COUNT).sum())
+        print("wrote trends for {} grid cells to {}".format(ncells, args.outpath))
+
+    return 0
+
+
+def run():
+    sys.exit(main(sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    run()
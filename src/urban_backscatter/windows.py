@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Seasonal and other month-window aggregates computed from the monthly
+# cubes.  A window is a tuple of calendar months, possibly wrapping
+# around the end of the year (the window then belongs to the year of
+# its last month).  For a time axis the assignment of months to window
+# years is built once and cached (LRU) as a (group, time) matrix, so all
+# requested windows are reduced with one matrix product per band of
+# rows.  The results have the same (time, lat, lon) shape as the
+# datasets returned by ncfileio.get_seasonal_data, with the time set to
+# the 15th of the middle month of each window.  Hemisphere-aware
+# windows (SUMMER, ...) use the months of each hemisphere for its
+# latitude rows.
+
+import functools
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from . import ncfileio
+
+# named windows, the four quarters match ncfileio.SEASON_LIST
+WINDOWS = {
+    "JFM": (1, 2, 3),
+    "AMJ": (4, 5, 6),
+    "JAS": (7, 8, 9),
+    "OND": (10, 11, 12),
+    "DJF": (12, 1, 2),
+    "MAM": (3, 4, 5),
+    "JJA": (6, 7, 8),
+    "SON": (9, 10, 11),
+    "JJAS": (6, 7, 8, 9),
+    "ANN": tuple(range(1, 13)),
+}
+
+# hemisphere-aware windows: (northern, southern) hemisphere window names
+HEMISPHERE_WINDOWS = {
+    "SUMMER": ("JJA", "DJF"),
+    "WINTER": ("DJF", "JJA"),
+    "SPRING": ("MAM", "SON"),
+    "AUTUMN": ("SON", "MAM"),
+}
+
+# number of group matrices (time axis and windows) kept in memory
+GROUP_CACHE_SIZE = 32
+
+# number of latitude rows reduced at a time
+BAND_ROWS = 64
+
+
+def parse_window(window, lat=None):
+    """
+    Return the months of a window given by name (see WINDOWS), by a
+    hemisphere-aware name (see HEMISPHERE_WINDOWS, needs lat), by a
+    'start-end' month range such as '11-4', or as a sequence of months.
+    """
+
+    if isinstance(window, str):
+        if window in WINDOWS:
+            return WINDOWS[window]
+        if window in HEMISPHERE_WINDOWS:
+            if lat is None:
+                errmsg = "a latitude is needed for the {} window".format(window)
+                raise ValueError(errmsg)
+            north, south = HEMISPHERE_WINDOWS[window]
+            return WINDOWS[north] if lat >= 0 else WINDOWS[south]
+        try:
+            start, end = [int(x) for x in window.split("-")]
+        except ValueError:
+            errmsg = "window should be a name, a month range like '11-4' or months"
+            raise ValueError(errmsg)
+        window = [(start - 1 + i) % 12 + 1 for i in range((end - start) % 12 + 1)]
+
+    months = tuple(int(x) for x in window)
+    if not months or any(x < 1 or x > 12 for x in months):
+        errmsg = "window months should be between 1 and 12"
+        raise ValueError(errmsg)
+    if len(set(months)) != len(months):
+        errmsg = "window months should not repeat"
+        raise ValueError(errmsg)
+    return months
+
+
+def window_groups(times, months):
+    """
+    Return the window years and their times (15th of the middle month)
+    and a list of the time step indices in each window year, keeping
+    only the years with every month of the window in times.
+    """
+
+    times = pd.DatetimeIndex(times)
+
+    # months after the last month of the window belong to the next year
+    last = months[-1]
+    wraps = months[0] > last
+    index = {}
+    for i, (year, month) in enumerate(zip(times.year, times.month)):
+        if month not in months:
+            continue
+        label = year + 1 if wraps and month > last else year
+        index.setdefault(label, {})[month] = i
+
+    middle = months[len(months) // 2]
+    labels, stamps, members = [], [], []
+    for label in sorted(index):
+        if len(index[label]) != len(months):
+            continue
+        year = label - 1 if wraps and middle > last else label
+        labels.append(label)
+        stamps.append(pd.Timestamp(year=year, month=middle, day=15))
+        members.append([index[label][x] for x in months])
+    return labels, pd.DatetimeIndex(stamps), members
+
+
+def group_matrix(times, windows):
+    """
+    Return (matrix, groups) for a time axis and a dictionary of windows
+    (name -> months).  matrix is a (group, time) 0/1 matrix assigning
+    time steps to window years and groups a list of (name, start, stop,
+    times, years) giving the rows of each window.  The result is cached
+    (see cached_groups).
+    """
+
+    times = np.asarray(pd.DatetimeIndex(times).values, dtype="datetime64[ns]")
+    return cached_groups(
+        times.tobytes(), tuple((name, months) for name, months in windows.items())
+    )
+
+
+@functools.lru_cache(maxsize=GROUP_CACHE_SIZE)
+def cached_groups(times, windows):
+    # group_matrix for hashable arguments: the datetime64[ns] time axis
+    # as bytes and a tuple of (name, months)
+    times = pd.DatetimeIndex(np.frombuffer(times, dtype="datetime64[ns]"))
+    rows = []
+    groups = []
+    for name, months in windows:
+        labels, stamps, members = window_groups(times, months)
+        start = len(rows)
+        for member in members:
+            row = np.zeros(len(times))
+            row[member] = 1.0
+            rows.append(row)
+        groups.append((name, start, len(rows), stamps, labels))
+
+    matrix = np.array(rows).reshape(len(rows), len(times))
+    return matrix, groups
+
+
+def window_aggregates(ds, windows, min_count=1, band_rows=BAND_ROWS):
+    """
+    Compute month-window aggregates of a monthly (time, lat, lon)
+    dataset for several windows at once.  windows is a list of window
+    names/months (see parse_window) or a dictionary name -> window.
+    sig0 is the mean of the valid monthly means and sig0std the pooled
+    std of the months (within- and between-month spread, months equally
+    weighted).  Cells with fewer than min_count valid months in a window
+    year are NaN.  A hemisphere-aware window uses the northern months for
+    the rows with lat >= 0 and the southern months for the others, the
+    window years are matched by the year of the last month of the window
+    and the time is that of the northern window when both hemispheres
+    are present.  Returns a dictionary name -> Dataset shaped like the
+    result of ncfileio.get_seasonal_data.
+    """
+
+    if not isinstance(windows, dict):
+        windows = {
+            x if isinstance(x, str) else "-".join(str(m) for m in x): x for x in windows
+        }
+
+    # hemisphere windows covering both hemispheres are computed for each
+    # hemisphere and combined below
+    north = ds["lat"].values >= 0
+    months = {}
+    for name, window in windows.items():
+        if isinstance(window, str) and window in HEMISPHERE_WINDOWS:
+            if north.all() or not north.any():
+                months[name] = parse_window(window, 1.0 if north.any() else -1.0)
+            else:
+                months[(name, "north")] = parse_window(window, 1.0)
+                months[(name, "south")] = parse_window(window, -1.0)
+        else:
+            months[name] = parse_window(window)
+
+    matrix, groups = group_matrix(ds["time"].values, months)
+    ngroup, ntime = matrix.shape
+    nlat, nlon = ds.sizes["lat"], ds.sizes["lon"]
+    mean = np.full((ngroup, nlat, nlon), np.nan, dtype="float32")
+    std = np.full((ngroup, nlat, nlon), np.nan, dtype="float32")
+
+    for start in range(0, nlat, band_rows):
+        band = ds.isel(lat=slice(start, start + band_rows))
+        sig0 = band["sig0"].transpose("time", "lat", "lon").values
+        sig0std = band["sig0std"].transpose("time", "lat", "lon").values
+        nrows = sig0.shape[1]
+        sig0 = sig0.reshape(ntime, -1).astype("float64")
+        sig0std = sig0std.reshape(ntime, -1).astype("float64")
+        valid = ~np.isnan(sig0) & ~np.isnan(sig0std)
+
+        # one product per sum for every window year of every window
+        count = matrix @ valid
+        total = matrix @ np.where(valid, sig0, 0.0)
+        total2 = matrix @ np.where(valid, sig0 * sig0 + sig0std * sig0std, 0.0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            m = np.where(count >= max(min_count, 1), total / count, np.nan)
+            s = np.sqrt(np.maximum(total2 / count - m * m, 0.0))
+
+        mean[:, start : start + nrows] = m.reshape(ngroup, nrows, nlon)
+        std[:, start : start + nrows] = s.reshape(ngroup, nrows, nlon)
+
+    results = {}
+    rows = {}
+    for name, first, last, stamps, labels in groups:
+        if isinstance(name, tuple):
+            rows[name] = (mean[first:last], std[first:last], stamps, labels)
+        else:
+            results[name] = _window_dataset(
+                ds, mean[first:last], std[first:last], stamps
+            )
+
+    # put the rows of each hemisphere together on the union of the years
+    for name in windows:
+        if name in results:
+            continue
+        nmean, nstd, nstamps, nlabels = rows[(name, "north")]
+        smean, sstd, sstamps, slabels = rows[(name, "south")]
+        stamp = dict(zip(slabels, sstamps))
+        stamp.update(zip(nlabels, nstamps))
+        labels = sorted(stamp)
+        shape = (len(labels), nlat, nlon)
+        wmean = np.full(shape, np.nan, dtype="float32")
+        wstd = np.full(shape, np.nan, dtype="float32")
+        for hmean, hstd, hlabels, hrows in [
+            (nmean, nstd, nlabels, north),
+            (smean, sstd, slabels, ~north),
+        ]:
+            position = [labels.index(x) for x in hlabels]
+            for k, i in enumerate(position):
+                wmean[i, hrows] = hmean[k, hrows]
+                wstd[i, hrows] = hstd[k, hrows]
+        stamps = pd.DatetimeIndex([stamp[x] for x in labels])
+        results[name] = _window_dataset(ds, wmean, wstd, stamps)
+
+    return {name: results[name] for name in windows}
+
+
+def _window_dataset(ds, mean, std, stamps):
+    # (time, lat, lon) dataset on the grid of ds
+    coords = {"time": stamps, "lat": ds["lat"].values, "lon": ds["lon"].values}
+    if "spatial_ref" in ds.coords:
+        coords["spatial_ref"] = ds["spatial_ref"]
+    return xr.Dataset(
+        {
+            "sig0": (("time", "lat", "lon"), mean),
+            "sig0std": (("time", "lat", "lon"), std),
+        },
+        coords=coords,
+    )
+
+
+def get_window_data(datadir, instrument, windows, verbose=False, bbox=None):
+    """
+    Read the monthly data for a single instrument (see
+    ncfileio.get_monthly_data) and return the aggregates for each of the
+    windows as a dictionary name -> Dataset.
+    """
+
+    monthly_xr = ncfileio.get_monthly_data(
+        datadir, instrument, verbose=verbose, bbox=bbox
+    )
+    return window_aggregates(monthly_xr, windows)
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Zonal statistics over city polygons.  Each polygon is rasterized once
+# to the CMG grid and the result is kept as a sparse (city x cell)
+# weight matrix in compressed row form, which can be cached on disk.
+# The mean, std and valid-cell count for all cities and time steps are
+# then computed with one sparse matrix product per instrument cube.
+# The weights can be scaled by per-cell urban weights derived from the
+# urban mask or a built-fraction layer.
+
+import os
+import json
+import hashlib
+
+import numpy as np
+import xarray as xr
+
+from . import cmgutils
+from . import dsutils
+from . import ncfileio
+
+# largest number of values per variable read from a cube at a time
+CHUNK_VALUES = 2**26
+
+
+def read_polygons(path, name_field="locname"):
+    """
+    read a GeoJSON file of Polygon/MultiPolygon features (lon/lat
+    coordinates) and return the list of names (from the name_field
+    property) and the list of polygons, each a list of (n, 2) arrays of
+    ring vertices.
+    """
+
+    with open(path) as fp:
+        collection = json.load(fp)
+
+    names = []
+    polygons = []
+    for feature in collection.get("features", []):
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") == "Polygon":
+            parts = [geometry["coordinates"]]
+        elif geometry.get("type") == "MultiPolygon":
+            parts = geometry["coordinates"]
+        else:
+            errmsg = "features should be Polygon or MultiPolygon geometries"
+            raise ValueError(errmsg)
+
+        properties = feature.get("properties") or {}
+        if name_field not in properties:
+            errmsg = "feature without a '{}' property".format(name_field)
+            raise ValueError(errmsg)
+
+        names.append(str(properties[name_field]))
+        polygons.append(
+            [
+                np.asarray(ring, dtype="float64")[:, :2]
+                for part in parts
+                for ring in part
+            ]
+        )
+
+    return names, polygons
+
+
+def rasterize_polygon(rings):
+    """
+    return the CMG cell indices (row * NCOLS + col) of the cells whose
+    centers fall inside a polygon given as a list of (n, 2) lon/lat
+    rings (even-odd rule, so holes are left out).  A polygon smaller
+    than a grid cell gets the cell containing the mean of its vertices.
+    """
+
+    vertices = np.concatenate(rings)
+    lonmin, latmin = vertices.min(axis=0)
+    lonmax, latmax = vertices.max(axis=0)
+
+    # candidate cells covering the polygon's bounding box
+    rowmax, colmin = cmgutils.grid_index(lonmin, latmin)
+    rowmin, colmax = cmgutils.grid_index(lonmax, latmax)
+    rowmin, rowmax = max(int(rowmin), 0), min(int(rowmax), cmgutils.NROWS - 1)
+    colmin, colmax = max(int(colmin), 0), min(int(colmax), cmgutils.NCOLS - 1)
+    rows, cols = np.meshgrid(
+        np.arange(rowmin, rowmax + 1), np.arange(colmin, colmax + 1), indexing="ij"
+    )
+    px, py = cmgutils.cell_centers(rows, cols)
+
+    inside = np.zeros(rows.shape, dtype=bool)
+    for ring in rings:
+        x1, y1 = ring[:, 0], ring[:, 1]
+        x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+        for i in range(len(ring)):
+            if y1[i] == y2[i]:
+                continue
+            crosses = (y1[i] > py) != (y2[i] > py)
+            xcross = x1[i] + (py - y1[i]) * (x2[i] - x1[i]) / (y2[i] - y1[i])
+            inside ^= crosses & (px < xcross)
+
+    if not inside.any():
+        row, col = cmgutils.grid_index(*vertices.mean(axis=0))
+        return np.array([row * cmgutils.NCOLS + col], dtype="int64")
+
+    return (rows[inside] * cmgutils.NCOLS + cols[inside]).astype("int64")
+
+
+class CellWeights:
+    """
+    Sparse (city x cell) weight matrix in compressed row form: the cells
+    of city i are cells[indptr[i]:indptr[i + 1]] (CMG cell indices
+    row * NCOLS + col) with weights weights[indptr[i]:indptr[i + 1]].
+    """
+
+    def __init__(self, names, indptr, cells, weights):
+        self.names = list(names)
+        self.indptr = np.asarray(indptr, dtype="int64")
+        self.cells = np.asarray(cells, dtype="int64")
+        self.weights = np.asarray(weights, dtype="float64")
+
+    @classmethod
+    def from_polygons(cls, names, polygons):
+        """
+        rasterize each polygon (see rasterize_polygon) with unit weights
+        """
+
+        cells = [rasterize_polygon(rings) for rings in polygons]
+        indptr = np.concatenate([[0], np.cumsum([len(x) for x in cells])])
+        cells = np.concatenate(cells) if cells else np.zeros(0, dtype="int64")
+        return cls(names, indptr, cells, np.ones(len(cells)))
+
+    @classmethod
+    def from_boxes(cls, names, rows, cols):
+        """
+        unit weights for the boxes given by the CMG row and column index
+        arrays from cmgutils.box_indices
+        """
+
+        rows = np.atleast_2d(rows)
+        cols = np.atleast_2d(cols)
+        cells = rows[:, :, np.newaxis] * cmgutils.NCOLS + cols[:, np.newaxis, :]
+        cells = cells.reshape(len(rows), -1)
+        indptr = np.arange(len(rows) + 1) * cells.shape[1]
+        return cls(names, indptr, cells.ravel(), np.ones(cells.size))
+
+    def scaled(self, grid):
+        """
+        return a copy with the weight of each cell multiplied by the
+        value of a (lat, lon) DataArray of per-cell weights such as the
+        one from get_urban_weights.  Cells outside the grid or with NaN
+        values get zero weight.
+        """
+
+        row0, col0 = dsutils.grid_offset(grid)
+        nlat, nlon = grid.sizes["lat"], grid.sizes["lon"]
+        irow = self.cells // cmgutils.NCOLS - row0
+        icol = self.cells % cmgutils.NCOLS - col0
+        inside = (irow >= 0) & (irow < nlat) & (icol >= 0) & (icol < nlon)
+
+        values = grid.transpose("lat", "lon").values
+        factor = np.zeros(len(self.cells))
+        factor[inside] = values[irow[inside], icol[inside]]
+        factor = np.nan_to_num(factor, nan=0.0)
+        return CellWeights(self.names, self.indptr, self.cells, self.weights * factor)
+
+    @classmethod
+    def load(cls, path):
+        """
+        read a weight matrix written by save()
+        """
+
+        with np.load(path, allow_pickle=False) as npz:
+            return cls(npz["names"], npz["indptr"], npz["cells"], npz["weights"])
+
+    def save(self, path):
+        """
+        write the weight matrix to a .npz file
+        """
+
+        np.savez(
+            path,
+            names=np.array(self.names, dtype=str),
+            indptr=self.indptr,
+            cells=self.cells,
+            weights=self.weights,
+        )
+
+    def __len__(self):
+        return len(self.names)
+
+
+def get_weights(polygon_path, cachedir=None, name_field="locname", verbose=False):
+    """
+    return the CellWeights for the polygons in a GeoJSON file.  If
+    cachedir is given the rasterized weights are stored there, keyed by
+    the file's path, size and modification time, and reused on later
+    calls.
+    """
+
+    if cachedir is None:
+        return CellWeights.from_polygons(*read_polygons(polygon_path, name_field))
+
+    record = [list(x) for x in ncfileio.file_fingerprint([polygon_path])]
+    text = json.dumps([record, name_field])
+    key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    cachepath = os.path.join(cachedir, "weights_{}.npz".format(key))
+    if os.path.exists(cachepath):
+        if verbose:
+            print("reading weights: {}".format(cachepath))
+        return CellWeights.load(cachepath)
+
+    weights = CellWeights.from_polygons(*read_polygons(polygon_path, name_field))
+    os.makedirs(cachedir, exist_ok=True)
+    if verbose:
+        print("writing weights: {}".format(cachepath))
+    weights.save(cachepath)
+    return weights
+
+
+def urban_fraction(ds, band_rows=64):
+    """
+    return the fraction of the time steps of a masked (urban) dataset
+    with data in each cell as a (lat, lon) DataArray, reading ds one
+    band of rows at a time.  Cells outside the urban mask get 0.
+    """
+
+    ntime = ds.sizes["time"]
+    fraction = np.zeros((ds.sizes["lat"], ds.sizes["lon"]), dtype="float32")
+    for start in range(0, ds.sizes["lat"], band_rows):
+        band = ds["sig0"].isel(lat=slice(start, start + band_rows))
+        valid = ~np.isnan(band.transpose("time", "lat", "lon").values)
+        fraction[start : start + band_rows] = valid.sum(axis=0) / max(ntime, 1)
+
+    coords = {"lat": ds["lat"].values, "lon": ds["lon"].values}
+    return xr.DataArray(fraction, coords=coords, dims=("lat", "lon"), name="weight")
+
+
+def read_fraction_layer(path, variable=None):
+    """
+    read a (lat, lon) built-fraction layer from a netcdf file and return
+    it as a DataArray of weights clipped to [0, 1] with NaN set to 0.
+    The first data variable is used if variable is not given.
+    """
+
+    with xr.open_dataset(path) as layer_xr:
+        if variable is None:
+            variable = list(layer_xr.data_vars)[0]
+        layer = layer_xr[variable].squeeze(drop=True).load()
+
+    if set(layer.dims) != {"lat", "lon"}:
+        errmsg = "fraction layer should have lat and lon dimensions"
+        raise ValueError(errmsg)
+
+    layer = layer.fillna(0.0).clip(0.0, 1.0).astype("float32")
+    return layer.transpose("lat", "lon").rename("weight")
+
+
+def get_urban_weights(datadir, instrument, cachedir=None, layer=None, verbose=False):
+    """
+    return per-cell urban weights as a (lat, lon) DataArray.  With layer
+    (a netcdf file) the built fraction in it is used, otherwise the
+    weights are the fraction of time steps with data in the masked
+    seasonal files of the instrument in <datadir>.  If cachedir is given
+    the weights are stored there, keyed by the fingerprint of the source
+    files, so repeat runs do not derive them again.
+    """
+
+    if layer is not None:
+        sources = [layer]
+    else:
+        prefix = "{}_seasonal_urban_sig0".format(instrument)
+        sources = [
+            os.path.join(datadir, prefix + "_mean.nc"),
+            os.path.join(datadir, prefix + "_StdDev.nc"),
+        ]
+
+    cachepath = None
+    if cachedir is not None:
+        record = [list(x) for x in ncfileio.file_fingerprint(sources)]
+        key = hashlib.sha1(json.dumps(record).encode("utf-8")).hexdigest()
+        cachepath = os.path.join(cachedir, "urban_weights_{}.nc".format(key))
+        if os.path.exists(cachepath):
+            if verbose:
+                print("reading urban weights: {}".format(cachepath))
+            with xr.open_dataarray(cachepath) as cached:
+                return cached.load()
+
+    if layer is not None:
+        weights = read_fraction_layer(layer)
+    else:
+        masked_xr = ncfileio._open_merged(*sources)
+        try:
+            weights = urban_fraction(masked_xr)
+        finally:
+            masked_xr.close()
+
+    if cachepath is not None:
+        os.makedirs(cachedir, exist_ok=True)
+        if verbose:
+            print("writing urban weights: {}".format(cachepath))
+        weights.to_netcdf(cachepath)
+
+    return weights
+
+
+def weighted_box_mean(ds, grid):
+    """
+    Weighted counterpart of ds.mean(dim=["lon", "lat"], skipna=True)
+    for a box read with the loaders' bbox option, using the per-cell
+    weights in the (lat, lon) DataArray grid.
+    """
+
+    box_weights = grid.reindex_like(
+        ds, method="nearest", tolerance=cmgutils.GRDSIZE / 2.0
+    )
+    return ds.weighted(box_weights.fillna(0.0)).mean(dim=["lon", "lat"], skipna=True)
+
+
+def zonal_stats(ds, weights, variables=("sig0",)):
+    """
+    Return the weighted mean, (population) std and valid-cell count of
+    each variable of ds over the cells of every city for every time
+    step, as a Dataset with (time, city) dimensions and <var>_mean,
+    <var>_std and <var>_count (valid cells with a non-zero weight)
+    variables.  NaN values and cells outside ds are left out.  Only the
+    region covering the weighted cells is read, a few time steps at a
+    time.
+    """
+
+    ncity = len(weights)
+    ntime = ds.sizes["time"]
+    row0, col0 = dsutils.grid_offset(ds)
+    nlat, nlon = ds.sizes["lat"], ds.sizes["lon"]
+
+    # cells of the weight matrix that fall inside ds
+    irow = weights.cells // cmgutils.NCOLS - row0
+    icol = weights.cells % cmgutils.NCOLS - col0
+    inside = (irow >= 0) & (irow < nlat) & (icol >= 0) & (icol < nlon)
+    city = np.repeat(np.arange(ncity), np.diff(weights.indptr))[inside]
+    w = weights.weights[inside]
+    irow, icol = irow[inside], icol[inside]
+
+    if len(w):
+        rmin, rmax = irow.min(), irow.max() + 1
+        cmin, cmax = icol.min(), icol.max() + 1
+    else:
+        rmin = rmax = cmin = cmax = 0
+    region = ds.isel(lat=slice(rmin, rmax), lon=slice(cmin, cmax))
+    flat = (irow - rmin) * (cmax - cmin) + (icol - cmin)
+    nchunk = max(1, CHUNK_VALUES // max(len(w), (rmax - rmin) * (cmax - cmin), 1))
+
+    # compressed rows of the cells inside ds, cities are already sorted
+    starts = np.searchsorted(city, np.arange(ncity))
+    nonempty = starts < np.searchsorted(city, np.arange(ncity), side="right")
+
+    data_vars = {}
+    for var in variables:
+        sums = np.zeros((4, ntime, ncity))
+        for t0 in range(0, ntime, nchunk):
+            values = region[var].isel(time=slice(t0, t0 + nchunk))
+            values = values.transpose("time", "lat", "lon").values
+            values = values.reshape(len(values), -1)[:, flat]
+            valid = ~np.isnan(values)
+            values = np.where(valid, values, 0.0)
+
+            # one product of the values with the weight matrix per sum
+            nonzero = np.where(w > 0, 1.0, 0.0)
+            products = [valid * nonzero, valid * w, values * w, values**2 * w]
+            for k, terms in enumerate(products):
+                if len(w):
+                    block = np.add.reduceat(terms, starts[nonempty], axis=1)
+                    sums[k, t0 : t0 + len(terms)][:, nonempty] = block
+
+        count, wsum, total, total2 = sums
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(wsum > 0, total / wsum, np.nan)
+            var2 = np.maximum(total2 / wsum - mean**2, 0.0)
+        data_vars[var + "_mean"] = (("time", "city"), mean)
+        data_vars[var + "_std"] = (("time", "city"), np.sqrt(var2))
+        data_vars[var + "_count"] = (("time", "city"), count.astype("int64"))
+
+    coords = {"time": ds["time"].values, "city": weights.names}
+    return xr.Dataset(data_vars, coords=coords)
@@ -7,4 +7,85 @@
     - https://docs.pytest.org/en/stable/writing_plugins.html
 """
 
-# import pytest
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import urban_backscatter as ubs
+
+# small synthetic region on the CMG grid (around Boston, 40x40 cells)
+TEST_LONMIN = -72.0
+TEST_LATMAX = 44.0
+TEST_NCELLS = 40
+
+# time ranges matching the real data files
+TEST_MONTHLY = {
+    "ERS": ("1993-01-01", 96),
+    "QuikSCAT": ("1999-07-01", 125),
+    "ASCAT": ("2007-01-01", 168),
+}
+TEST_YEARS = {
+    "ERS": (1993, 2000),
+    "QuikSCAT": (1999, 2009),
+    "ASCAT": (2007, 2020),
+}
+
+
+def _write_cube(datadir, prefix, times, seed):
+    """
+    write a mean/StdDev pair of netcdf files on a small piece of the CMG
+    """
+
+    ix0 = int(round((TEST_LONMIN - ubs.cmgutils.LONMIN) / ubs.cmgutils.GRDSIZE))
+    iy0 = int(round((TEST_LATMAX - ubs.cmgutils.LATMIN) / ubs.cmgutils.GRDSIZE))
+    lon = ubs.cmgutils.LONMIN + (np.arange(ix0, ix0 + TEST_NCELLS) + 0.5) * 0.05
+    lat = ubs.cmgutils.LATMIN + (np.arange(iy0, iy0 - TEST_NCELLS, -1) - 0.5) * 0.05
+
+    rng = np.random.default_rng(seed)
+    shape = (len(times), TEST_NCELLS, TEST_NCELLS)
+    sig0 = rng.normal(-10.0, 2.0, shape).astype("float32")
+    sig0std = rng.uniform(0.5, 2.0, shape).astype("float32")
+
+    # a few missing values and one cell with no data at all
+    sig0[:, 0, 0] = np.nan
+    sig0std[:, 0, 0] = np.nan
+    sig0[0, 1, :5] = np.nan
+    sig0std[0, 1, :5] = np.nan
+
+    coords = {"time": times, "lat": lat, "lon": lon, "spatial_ref": 0}
+    dims = ("time", "lat", "lon")
+    xr.Dataset({"sig0": (dims, sig0)}, coords=coords).to_netcdf(
+        "{}/{}_sig0_mean.nc".format(datadir, prefix)
+    )
+    xr.Dataset({"sig0std": (dims, sig0std)}, coords=coords).to_netcdf(
+        "{}/{}_sig0_StdDev.nc".format(datadir, prefix)
+    )
+
+
+@pytest.fixture(scope="session")
+def synthetic_datadir(tmp_path_factory):
+    """
+    directory with small synthetic monthly and seasonal netcdf files
+    for ERS, QuikSCAT and ASCAT
+    """
+
+    datadir = tmp_path_factory.mktemp("data")
+    for seed, instrument in enumerate(TEST_MONTHLY):
+        start, nmonths = TEST_MONTHLY[instrument]
+        times = pd.date_range(start, periods=nmonths, freq="MS")
+        _write_cube(datadir, "{}_monthly_land".format(instrument), times, seed)
+
+        year0, year1 = TEST_YEARS[instrument]
+        times = pd.to_datetime(
+            [
+                "{}-{:02d}-15".format(year, month)
+                for year in range(year0, year1 + 1)
+                for month in ubs.ncfileio.SEASON_SEL.values()
+            ]
+        )
+        for maskname in ["land", "urban"]:
+            prefix = "{}_seasonal_{}".format(instrument, maskname)
+            _write_cube(datadir, prefix, times, seed + 10)
+
+    return str(datadir)
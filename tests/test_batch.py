@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import multiprocessing
+
+import pandas as pd
+import pytest
+import urban_backscatter as ubs
+from urban_backscatter import batch
+
+CITIES = "locname,lat,lon\nboston,42.36,-71.06\nconcord,43.21,-71.54\n"
+
+
+def single_city_seasonal(datadir, lat, lon, season):
+    # same steps as extract_grid_cells_from_seasonal.py
+    bbox = ubs.cmgutils.box11(lon, lat)
+    df = None
+    for instrument, srctag in batch.SEASONAL_INSTRUMENTS.items():
+        ds = ubs.ncfileio.get_seasonal_data(datadir, instrument, season, bbox=bbox)
+        df2 = ubs.dsutils.seasonal_ds_to_df(ds, season, srctag)
+        if df is None:
+            df = df2
+        else:
+            df = pd.merge(df, df2, how="left", on=["latitude", "longitude"])
+    return df
+
+
+@pytest.mark.parametrize("region_limit", [batch.REGION_LIMIT, 0])
+def test_batch_matches_single_city(
+    synthetic_datadir, tmp_path, monkeypatch, region_limit
+):
+    """
+    pytest function comparing batch output with single city extraction
+    """
+
+    monkeypatch.setattr(batch, "REGION_LIMIT", region_limit)
+    citylist = tmp_path / "cities.csv"
+    citylist.write_text(CITIES)
+    cities = batch.read_city_list(str(citylist))
+
+    outdir = tmp_path / "out"
+    written, failed = batch.run_batch(
+        cities, synthetic_datadir, str(outdir), seasons=["JAS", "OND"]
+    )
+    assert len(written) == 4
+    assert not failed
+
+    expected = single_city_seasonal(synthetic_datadir, 43.21, -71.54, "OND")
+    expected_path = tmp_path / "expected.csv"
+    expected.to_csv(expected_path, na_rep="-9999.0", index=False)
+    assert (outdir / "concord_bs_grid_OND.csv").read_bytes() == (
+        expected_path.read_bytes()
+    )
+
+
+def test_batch_monthly_combined(synthetic_datadir, tmp_path):
+    """
+    pytest function for a monthly batch run written to one file
+    """
+
+    citylist = tmp_path / "cities.tsv"
+    citylist.write_text(CITIES.replace(",", "\t"))
+
+    outdir = tmp_path / "out"
+    batch.main(
+        [
+            "-m",
+            "monthly",
+            "-d",
+            synthetic_datadir,
+            "-o",
+            str(outdir),
+            "--combined",
+            "all.csv",
+            str(citylist),
+        ]
+    )
+    df = pd.read_csv(outdir / "all.csv")
+    assert len(df) == 2 * 121
+    assert list(df.columns[:3]) == ["locname", "latitude", "longitude"]
+    assert "ERS1993_01_mean" in df.columns
+    assert "ASCAT2020_12_std" in df.columns
+
+
+def test_batch_long_parquet_combined(synthetic_datadir, tmp_path):
+    """
+    pytest function for a long layout batch run written as a parquet
+    dataset partitioned by locname
+    """
+
+    citylist = tmp_path / "cities.csv"
+    citylist.write_text(CITIES)
+    outdir = tmp_path / "out"
+    args = [
+        "-d",
+        synthetic_datadir,
+        "-o",
+        str(outdir),
+        "--format",
+        "parquet",
+        "--layout",
+        "long",
+        str(citylist),
+    ]
+    assert batch.main(args) == 0
+    df = pd.read_parquet(outdir / "boston_bs_grid_JAS_long.parquet")
+    assert set(df["instrument"]) == set(batch.SEASONAL_INSTRUMENTS)
+    assert (df["time"].dt.month == 8).all()
+
+    assert batch.main(args[:-1] + ["--combined", "all.parquet", "-f", args[-1]]) == 0
+    assert batch.main(args[:-1] + ["--combined", "all.parquet", "-f", args[-1]]) == 0
+    combined = pd.read_parquet(outdir / "all.parquet")
+    assert sorted(os.listdir(outdir / "all.parquet")) == [
+        "locname=boston",
+        "locname=concord",
+    ]
+    boston = combined[combined["locname"] == "boston"].drop(columns=["locname"])
+    assert len(boston) == len(df)
+
+
+def test_bad_city_list_raises_value_error(tmp_path):
+    """
+    pytest function for a city list without the required columns
+    """
+
+    citylist = tmp_path / "cities.csv"
+    citylist.write_text("name,lat,lon\nboston,42.36,-71.06\n")
+    with pytest.raises(ValueError):
+        batch.read_city_list(str(citylist))
+
+
+def test_parallel_batch_matches_serial(synthetic_datadir, tmp_path):
+    """
+    pytest function comparing a process-pool batch run with a serial run
+    and checking that a failing city does not stop the others
+    """
+
+    # the last city cannot be written (no such directory)
+    citylist = tmp_path / "cities.csv"
+    citylist.write_text(CITIES + "nodir/salem,42.52,-70.9\n")
+    cities = batch.read_city_list(str(citylist))
+
+    serial, failed = batch.run_batch(
+        cities, synthetic_datadir, str(tmp_path / "serial"), combined="all.csv"
+    )
+    assert len(failed) == 0
+
+    parallel, failed = batch.run_batch(
+        cities,
+        synthetic_datadir,
+        str(tmp_path / "parallel"),
+        combined="all.csv",
+        workers=2,
+    )
+    assert (tmp_path / "serial" / "all.csv").read_bytes() == (
+        tmp_path / "parallel" / "all.csv"
+    ).read_bytes()
+
+    written, failed = batch.run_batch(
+        cities, synthetic_datadir, str(tmp_path / "files"), workers=2
+    )
+    assert len(written) == 2
+    assert failed[0][0] == "nodir/salem"
+
+
+@pytest.mark.skipif(
+    multiprocessing.get_start_method() != "fork",
+    reason="the workers need to inherit the patched city_table",
+)
+def test_batch_worker_crash(synthetic_datadir, tmp_path, monkeypatch):
+    """
+    pytest function checking a dying worker process fails its cities
+    instead of aborting the run
+    """
+
+    city_table = batch.city_table
+
+    def crashing_city_table(boxes, specs, city):
+        # the workers are forked and see the patched function
+        if city == 1:
+            os._exit(1)
+        return city_table(boxes, specs, city)
+
+    monkeypatch.setattr(batch, "city_table", crashing_city_table)
+    citylist = tmp_path / "cities.csv"
+    citylist.write_text(CITIES + "salem,42.52,-70.9\n")
+    cities = batch.read_city_list(str(citylist))
+
+    written, failed = batch.run_batch(
+        cities, synthetic_datadir, str(tmp_path / "out"), workers=2
+    )
+    assert len(written) + len(failed) == 3
+    assert ("concord", "JAS") in [(x[0], x[1]) for x in failed]
+    assert all(x[2].startswith("BrokenProcessPool") for x in failed)
+
+
+def test_incremental_batch_skips_current_outputs(synthetic_datadir, tmp_path):
+    """
+    pytest function for reruns using the output manifest
+    """
+
+    datadir = tmp_path / "data"
+    datadir.mkdir()
+    for path in os.listdir(synthetic_datadir):
+        if "_seasonal_land_" in path:
+            shutil.copy2(os.path.join(synthetic_datadir, path), datadir)
+
+    citylist = tmp_path / "cities.csv"
+    citylist.write_text(CITIES)
+    cities = batch.read_city_list(str(citylist))
+    outdir = tmp_path / "out"
+
+    written, failed = batch.run_batch(cities, str(datadir), str(outdir))
+    assert len(written) == 2
+
+    # nothing to do on a rerun
+    written, failed = batch.run_batch(cities, str(datadir), str(outdir))
+    assert written == []
+
+    # a missing output (e.g. after an interrupted run) is redone
+    os.remove(outdir / "boston_bs_grid_JAS.csv")
+    written, failed = batch.run_batch(cities, str(datadir), str(outdir))
+    assert [os.path.basename(x) for x in written] == ["boston_bs_grid_JAS.csv"]
+
+    # a changed input file invalidates every output
+    path = datadir / "ERS_seasonal_land_sig0_mean.nc"
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+    written, failed = batch.run_batch(cities, str(datadir), str(outdir))
+    assert len(written) == 2
+
+    written, failed = batch.run_batch(
+        cities, str(datadir), str(outdir), incremental=False
+    )
+    assert len(written) == 2
+
+
+def test_batch_result_cache(synthetic_datadir, tmp_path, monkeypatch):
+    """
+    pytest function checking a batch run with a result cache writes the
+    same files and a second run reads no boxes
+    """
+
+    citylist = tmp_path / "cities.csv"
+    citylist.write_text(CITIES)
+    cities = batch.read_city_list(str(citylist))
+    cachedir = str(tmp_path / "cache")
+
+    cache = ubs.resultcache.ResultCache(cachedir)
+    written, failed = batch.run_batch(
+        cities, synthetic_datadir, str(tmp_path / "first"), cache=cache
+    )
+    assert len(written) == 2
+    assert cache.stats()["misses"] == 2
+
+    def no_gather(*args, **kwargs):
+        raise AssertionError("boxes read despite the result cache")
+
+    monkeypatch.setattr(batch, "gather", no_gather)
+    cache = ubs.resultcache.ResultCache(cachedir)
+    written, failed = batch.run_batch(
+        cities, synthetic_datadir, str(tmp_path / "second"), cache=cache
+    )
+    assert len(written) == 2
+    assert not failed
+    assert cache.stats()["disk_hits"] == 2
+    for name in ["boston_bs_grid_JAS.csv", "concord_bs_grid_JAS.csv"]:
+        assert (tmp_path / "second" / name).read_bytes() == (
+            tmp_path / "first" / name
+        ).read_bytes()
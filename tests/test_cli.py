@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+import pandas as pd
+import pytest
+import urban_backscatter as ubs
+from urban_backscatter import batch
+from urban_backscatter import cli
+from urban_backscatter import plot_seasonal_timeseries as pst
+
+CITIES = "locname,lat,lon\nboston,42.36,-71.06\nconcord,43.21,-71.54\n"
+
+
+def test_commands_share_session(synthetic_datadir, tmp_path, monkeypatch):
+    """
+    pytest function running several commands in one call, the boxes of
+    each mode and season are read once and the tables match ubs-batch
+    """
+
+    calls = []
+    gather = batch.gather
+
+    def counting_gather(ds, rows, cols, instrument=None):
+        calls.append(len(rows))
+        return gather(ds, rows, cols, instrument=instrument)
+
+    monkeypatch.setattr(batch, "gather", counting_gather)
+    citylist = tmp_path / "cities.csv"
+    citylist.write_text(CITIES)
+    outdir = tmp_path / "out"
+    args = ["-d", synthetic_datadir, "-o", str(outdir), "--cities", str(citylist)]
+    args += ["extract-seasonal", "-s", "JAS", "-s", "OND", "extract-monthly"]
+    args += ["plot", "-s", "JAS"]
+    assert cli.main(args) == 0
+
+    # three instruments for JAS, OND and monthly, all cities at once
+    assert calls == [2] * 9
+    for name in [
+        "boston_bs_grid_JAS.csv",
+        "concord_bs_grid_OND.csv",
+        "concord_bs_grid_monthly.csv",
+        "boston_JAS_timeseries_plot.pdf",
+        "concord_JAS_timeseries_plot.pdf",
+    ]:
+        assert (outdir / name).exists()
+
+    monkeypatch.setattr(batch, "gather", gather)
+    cities = batch.read_city_list(str(citylist))
+    batchdir = tmp_path / "batch"
+    batch.run_batch(cities, synthetic_datadir, str(batchdir), seasons=["OND"])
+    assert (outdir / "concord_bs_grid_OND.csv").read_bytes() == (
+        batchdir / "concord_bs_grid_OND.csv"
+    ).read_bytes()
+
+
+def test_plot_matches_script_box(synthetic_datadir):
+    """
+    pytest function checking the box means plotted from the session
+    match those of the plot script, which reads the box with bbox
+    """
+
+    session = cli.Session(synthetic_datadir, [-71.06], [42.36])
+    box = session.box("seasonal", "ASCAT", 0, "JAS")
+    bbox = ubs.cmgutils.box11(-71.06, 42.36)
+    data = ubs.ncfileio.get_all_seasons_data(
+        synthetic_datadir, "ASCAT", seasons=["JAS"], bbox=bbox
+    )
+    df = pst.box_timeseries(box, "ASCAT")
+    expected = pst.box_timeseries(data["JAS"], "ASCAT")
+    pd.testing.assert_frame_equal(df, expected)
+
+
+def test_parse_args():
+    """
+    pytest function for the command line of ubs
+    """
+
+    args = cli.parse_args(
+        ["-l", "42.36", "-71.06", "boston", "extract-seasonal", "-s", "all", "plot"]
+    )
+    assert args.locations == [("boston", 42.36, -71.06)]
+    assert [x for x, cargs in args.commands] == ["extract-seasonal", "plot"]
+    assert cli.seasons_arg(args.commands[0][1].season) == ubs.ncfileio.SEASON_LIST
+    assert cli.seasons_arg(args.commands[1][1].season) == ["JAS"]
+
+    for bad in [
+        ["-l", "42.36", "-71.06", "boston"],
+        ["-l", "42.36", "-71.06", "boston", "extract-daily"],
+        ["extract-monthly"],
+        ["-l", "x", "-71.06", "boston", "plot"],
+    ]:
+        with pytest.raises(SystemExit):
+            cli.parse_args(bad)
+
+
+def test_result_cache(synthetic_datadir, tmp_path, monkeypatch):
+    """
+    pytest function checking ubs --cache-dir reuses the tables of an
+    earlier run
+    """
+
+    monkeypatch.setattr(ubs.resultcache, "RESULT_CACHE", ubs.resultcache.ResultCache())
+    args = ["-d", synthetic_datadir, "--cache-dir", str(tmp_path / "cache")]
+    args += ["-l", "42.36", "-71.06", "boston"]
+    assert cli.main(args + ["-o", str(tmp_path / "first"), "extract-monthly"]) == 0
+
+    def no_gather(*args, **kwargs):
+        raise AssertionError("boxes read despite the result cache")
+
+    monkeypatch.setattr(batch, "gather", no_gather)
+    assert cli.main(args + ["-o", str(tmp_path / "second"), "extract-monthly"]) == 0
+    name = "boston_bs_grid_monthly.csv"
+    assert (tmp_path / "second" / name).read_bytes() == (
+        tmp_path / "first" / name
+    ).read_bytes()
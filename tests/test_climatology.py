@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+import urban_backscatter as ubs
+
+
+def test_climatology_and_anomalies(synthetic_datadir, tmp_path):
+    """
+    pytest function comparing the stored climatology and anomalies with
+    xarray groupby results
+    """
+
+    climdir = str(tmp_path / "clim")
+    written = ubs.climatology.build_climatology(synthetic_datadir, climdir)
+    assert len(written) == 3
+
+    clim = ubs.climatology.get_climatology(climdir, "ERS")
+    myds = ubs.ncfileio.get_monthly_data(synthetic_datadir, "ERS")
+    groups = myds["sig0"].groupby("time.month")
+    np.testing.assert_allclose(clim["sig0_mean"], groups.mean(), rtol=1e-5)
+    np.testing.assert_allclose(clim["sig0_std"], groups.std(), rtol=1e-4, atol=1e-6)
+    np.testing.assert_array_equal(clim["sig0_count"], groups.count())
+
+    # anomalies of a bbox box
+    bbox = ubs.cmgutils.box11(-71.06, 42.36)
+    box = ubs.ncfileio.get_monthly_data(synthetic_datadir, "ERS", bbox=bbox)
+    anoms = ubs.climatology.anomalies(box, ubs.climatology.box_climatology(clim, box))
+    expected = box["sig0"].groupby("time.month") - groups.mean()
+    np.testing.assert_allclose(
+        anoms["sig0"], expected.transpose(*box["sig0"].dims), atol=1e-5
+    )
+
+    # anomalies of a batch of city boxes, a chunk at a time
+    lons = np.array([-71.06, -70.5, -71.9])
+    lats = np.array([42.36, 43.5, 43.97])
+    rows, cols = ubs.cmgutils.box_indices(lons, lats)
+    chunks = list(
+        ubs.climatology.iter_anomaly_boxes(
+            myds, clim, rows, cols, chunk=2, standardize=True
+        )
+    )
+    assert [start for start, anoms in chunks] == [0, 2]
+    first = chunks[0][1]["sig0"].isel(city=0)
+    box_clim = ubs.climatology.box_climatology(clim, box)
+    zscores = ubs.climatology.anomalies(box, box_clim, standardize=True)
+    np.testing.assert_allclose(first, zscores["sig0"], atol=1e-4)
+
+    with pytest.raises(ValueError):
+        ubs.climatology.get_climatology(climdir, "XXX")
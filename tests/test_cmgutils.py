@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+import urban_backscatter as ubs
+
+
+def test_box_indices_match_box11():
+    """
+    pytest function comparing the vectorized box indices with box11
+    """
+
+    lons = np.array([-71.06, 2.35, 151.21, -179.99, 139.69])
+    lats = np.array([42.36, 48.86, -33.87, 0.01, 35.69])
+
+    rows, cols = ubs.cmgutils.box_indices(lons, lats)
+    assert rows.shape == (5, 11)
+    assert cols.shape == (5, 11)
+
+    lon, lat = ubs.cmgutils.cell_centers(rows, cols)
+    for i in range(len(lons)):
+        lonmin, latmin, lonmax, latmax = ubs.cmgutils.box11(lons[i], lats[i])
+        assert lon[i, 0] == pytest.approx(lonmin + 0.025)
+        assert lon[i, -1] == pytest.approx(lonmax - 0.025)
+        assert lat[i, 0] == pytest.approx(latmax - 0.025)
+        assert lat[i, -1] == pytest.approx(latmin + 0.025)
+
+    rows, cols = ubs.cmgutils.box_indices(-71.06, 42.36, halfwidth=1)
+    assert rows.shape == (1, 3)
+
+    with pytest.raises(ValueError):
+        ubs.cmgutils.box_indices(lons, lats, halfwidth=-1)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pandas as pd
+import urban_backscatter as ubs
+
+
+def test_gather_boxes_matches_bbox(synthetic_datadir):
+    """
+    pytest function comparing a multi-city gather with per-city bbox reads
+    """
+
+    lons = np.array([-71.06, -70.5, -71.9])
+    lats = np.array([42.36, 43.5, 43.97])
+
+    myds = ubs.ncfileio.get_monthly_data(synthetic_datadir, "ERS").load()
+    rows, cols = ubs.cmgutils.box_indices(lons, lats)
+    boxes = ubs.dsutils.gather_boxes(myds, rows, cols)
+    assert boxes["sig0"].shape == (96, 3, 11, 11)
+
+    for i in range(2):
+        bbox = ubs.cmgutils.box11(lons[i], lats[i])
+        expected = ubs.ncfileio.get_monthly_data(synthetic_datadir, "ERS", bbox=bbox)
+        box = ubs.dsutils.city_box(boxes, i)
+        np.testing.assert_array_equal(box["sig0"], expected["sig0"])
+        np.testing.assert_array_equal(box["sig0std"], expected["sig0std"])
+        np.testing.assert_array_equal(box["lat"], expected["lat"])
+        np.testing.assert_array_equal(box["lon"], expected["lon"])
+
+    # the third box hangs over the edge of the synthetic grid
+    box = ubs.dsutils.city_box(boxes, 2)
+    assert np.isnan(box["sig0"].values[:, :5, :]).all()
+
+
+def test_numpy_engine_matches_pandas(synthetic_datadir, tmp_path):
+    """
+    pytest function checking the numpy wide-table engine writes the same
+    CSV as the pandas to_dataframe/pivot/merge path
+    """
+
+    # box over the corner of the grid with missing cells and values
+    bbox = ubs.cmgutils.box11(-71.95, 43.95)
+
+    myds = ubs.ncfileio.get_seasonal_data(
+        synthetic_datadir, "QuikSCAT", season="JAS", bbox=bbox
+    )
+    # a season without any data
+    myds["sig0"][0] = np.nan
+
+    for engine in ubs.dsutils.ENGINES:
+        df = ubs.dsutils.seasonal_ds_to_df(myds, "JAS", "QSCAT", engine=engine)
+        df.to_csv(tmp_path / "{}.csv".format(engine), na_rep="-9999.0", index=False)
+    numpy_csv = (tmp_path / "numpy.csv").read_bytes()
+    assert numpy_csv == (tmp_path / "pandas.csv").read_bytes()
+    assert b"QSCAT1999_JAS_mean" not in numpy_csv
+
+    myds = ubs.ncfileio.get_monthly_data(synthetic_datadir, "ASCAT", bbox=bbox)
+    for engine in ubs.dsutils.ENGINES:
+        df = ubs.dsutils.monthly_ds_to_df(myds, "ASCAT", engine=engine)
+        df.to_csv(tmp_path / "{}.csv".format(engine), na_rep="-9999.0", index=False)
+    numpy_csv = (tmp_path / "numpy.csv").read_bytes()
+    assert numpy_csv == (tmp_path / "pandas.csv").read_bytes()
+    assert len(df.columns) == 2 + 2 * 168
+
+
+def test_long_table_round_trip(synthetic_datadir, tmp_path):
+    """
+    pytest function checking the long layout against the wide table and
+    a parquet round trip
+    """
+
+    bbox = ubs.cmgutils.box11(-71.95, 43.95)
+    myds = ubs.ncfileio.get_monthly_data(synthetic_datadir, "ERS", bbox=bbox)
+
+    df = ubs.dsutils.long_table(myds, "ERS")
+    assert list(df.columns) == [
+        "latitude",
+        "longitude",
+        "instrument",
+        "time",
+        "sig0",
+        "sig0std",
+    ]
+    # rows without data are dropped
+    assert not df["sig0"].isna().all()
+    assert len(df) == int(myds["sig0"].notnull().sum())
+
+    wide = ubs.dsutils.monthly_ds_to_df(myds, "ERS").set_index(
+        ["latitude", "longitude"]
+    )
+    row = df.iloc[0]
+    name = "ERS{}_mean".format(row["time"].strftime("%Y_%m"))
+    assert wide.loc[(row["latitude"], row["longitude"]), name] == row["sig0"]
+
+    outpath = tmp_path / "long.parquet"
+    ubs.dsutils.write_table(df, outpath, "parquet")
+    pd.testing.assert_frame_equal(pd.read_parquet(outpath), df)
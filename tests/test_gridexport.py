@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pandas as pd
+import pytest
+import urban_backscatter as ubs
+from urban_backscatter import gridexport
+
+
+def whole_table(datasets, season):
+    # same merge as extract_grid_cells_from_seasonal.py on the whole region
+    df = None
+    for ds, srctag in datasets:
+        df2 = ubs.dsutils.seasonal_ds_to_df(ds, season, srctag)
+        if df is None:
+            df = df2
+        else:
+            df = pd.merge(df, df2, how="left", on=["latitude", "longitude"])
+    return df
+
+
+def test_streamed_csv_matches_whole_table(synthetic_datadir, tmp_path):
+    """
+    pytest function comparing the streamed export with converting the
+    whole region at once
+    """
+
+    datasets = gridexport.load_datasets(synthetic_datadir, "seasonal", "JAS")
+    # a year with data only in the first band
+    ers = datasets[0][0].load()
+    ers["sig0"][1, 5:] = np.nan
+    ers["sig0std"][1, 5:] = np.nan
+    datasets[0] = (ers, "ERS")
+
+    expected = tmp_path / "expected.csv"
+    whole_table(datasets, "JAS").to_csv(expected, na_rep="-9999.0", index=False)
+
+    done = []
+    outpath = tmp_path / "streamed.csv"
+    nrows = gridexport.export_table(
+        datasets,
+        outpath,
+        "seasonal",
+        "JAS",
+        band_rows=7,
+        progress=lambda x, total: done.append((x, total)),
+    )
+    assert outpath.read_bytes() == expected.read_bytes()
+    assert nrows == 40 * 40 - 1
+    assert done == [(x, 40) for x in [7, 14, 21, 28, 35, 40]]
+
+    # the blocks have the same columns even if a band has no data for a year
+    blocks = gridexport.iter_table_blocks(datasets, "seasonal", "JAS", band_rows=7)
+    columns = [list(df.columns) for df in blocks]
+    assert columns[-1] == columns[0]
+    assert "ERS1994_JAS_mean" in columns[-1]
+
+
+def test_streamed_parquet_bbox(synthetic_datadir, tmp_path):
+    """
+    pytest function for a monthly parquet export of a region
+    """
+
+    bbox = (-71.5, 42.5, -70.5, 43.5)
+    datasets = gridexport.load_datasets(
+        synthetic_datadir, "monthly", instruments=["ASCAT"], bbox=bbox
+    )
+    outpath = tmp_path / "region.parquet"
+    gridexport.main(
+        [
+            "-m",
+            "monthly",
+            "-i",
+            "ASCAT",
+            "-b",
+            *[str(x) for x in bbox],
+            "-d",
+            synthetic_datadir,
+            "--format",
+            "parquet",
+            "-r",
+            "3",
+            str(outpath),
+        ]
+    )
+    df = pd.read_parquet(outpath)
+    expected = ubs.dsutils.monthly_ds_to_df(datasets[0][0].load(), "ASCAT")
+    pd.testing.assert_frame_equal(df, expected.reset_index(drop=True))
+    assert len(df) == 20 * 20
+
+    with pytest.raises(ValueError):
+        gridexport.export_table(
+            datasets, tmp_path / "x.feather", "monthly", fmt="feather"
+        )
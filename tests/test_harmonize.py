@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import urban_backscatter as ubs
+from urban_backscatter import harmonize
+
+
+def synthetic_instruments():
+    # one truth series seen by three instruments with known offsets/gains
+    times = pd.date_range("1993-01-01", "2020-12-01", freq="MS")
+    rows, cols = np.meshgrid(np.arange(1200, 1208), np.arange(2160, 2168))
+    lon, lat = ubs.cmgutils.cell_centers(rows[0], cols[:, 0])
+    rng = np.random.default_rng(1)
+    truth = xr.DataArray(
+        rng.normal(-10.0, 2.0, (len(times), 8, 8)),
+        coords={"time": times, "lat": lat, "lon": lon},
+        dims=("time", "lat", "lon"),
+    )
+    truth[:, 0, 0] = np.nan
+
+    def instrument(sig0, start, end):
+        ds = xr.Dataset({"sig0": sig0, "sig0std": xr.ones_like(sig0)})
+        return ds.sel(time=slice(start, end))
+
+    return truth, {
+        "ASCAT": instrument(truth, "2007-01-01", "2020-12-31"),
+        "QuikSCAT": instrument(truth - 2.0, "1999-07-01", "2009-12-01"),
+        "ERS": instrument(0.5 * truth + 1.0, "1993-01-01", "2001-01-01"),
+    }
+
+
+def test_harmonized_series_recovers_truth():
+    """
+    pytest function checking the fitted coefficients and merged series
+    on synthetic instruments with known offsets and gains
+    """
+
+    truth, datasets = synthetic_instruments()
+    coeffs = harmonize.build_coefficients(datasets, gains=True, band_rows=3)
+    np.testing.assert_allclose(coeffs["QuikSCAT_gain"][1:, 1:], 1.0, rtol=1e-5)
+    np.testing.assert_allclose(coeffs["QuikSCAT_offset"][1:, 1:], 2.0, rtol=1e-5)
+    np.testing.assert_allclose(coeffs["ERS_gain"][1:, 1:], 2.0, rtol=1e-5)
+    np.testing.assert_allclose(coeffs["ERS_offset"][1:, 1:], -2.0, atol=1e-4)
+    assert int(coeffs["ERS_count"][1, 1]) == 19
+    assert np.isnan(coeffs["ERS_gain"][0, 0])
+
+    merged = harmonize.merged_series(datasets, coeffs)
+    assert merged.sizes["time"] == 336
+    np.testing.assert_allclose(merged["sig0"], truth, atol=1e-4)
+    assert (merged["instrument"].sel(time="1995-01-01")[1:, 1:] == 2).all()
+    np.testing.assert_allclose(merged["sig0std"].sel(time="1995-01-01")[1:, 1:], 2.0)
+
+    # offsets only
+    coeffs = harmonize.build_coefficients(datasets)
+    assert (coeffs["ERS_gain"][1:, 1:] == 1.0).all()
+
+    # city boxes from one gather per instrument
+    rows, cols = ubs.cmgutils.box_indices([-71.96, -71.7], [29.93, 29.7], 1)
+    boxes = {
+        name: ubs.dsutils.gather_boxes(ds, rows, cols) for name, ds in datasets.items()
+    }
+    city_coeffs = harmonize.city_coefficients(coeffs, rows, cols)
+    merged = harmonize.merged_series(boxes, city_coeffs)
+    assert merged["sig0"].dims == ("time", "city", "y", "x")
+    expected = harmonize.merged_series(datasets, coeffs)
+    np.testing.assert_allclose(
+        merged["sig0"].isel(city=0, y=1, x=1),
+        expected["sig0"].sel(lat=29.925, lon=-71.975, method="nearest"),
+    )
+
+
+def test_overlap_matches_months(monkeypatch):
+    """
+    pytest function checking the overlap is matched on year and month
+    when the instruments stamp their months differently, and that each
+    instrument is read once per band
+    """
+
+    _, datasets = synthetic_instruments()
+    expected = harmonize.build_coefficients(datasets, gains=True, band_rows=3)
+    qs = datasets["QuikSCAT"]
+    datasets["QuikSCAT"] = qs.assign_coords(
+        time=qs["time"].values + np.timedelta64(14, "D")
+    )
+
+    reads = []
+    isel = xr.DataArray.isel
+
+    def counting_isel(self, *args, **kwargs):
+        reads.append(self.name)
+        return isel(self, *args, **kwargs)
+
+    monkeypatch.setattr(xr.DataArray, "isel", counting_isel)
+    coeffs = harmonize.build_coefficients(datasets, gains=True, band_rows=3)
+    monkeypatch.undo()
+    xr.testing.assert_allclose(coeffs, expected)
+    assert int(coeffs["QuikSCAT_count"][1, 1]) == 36
+    # three bands of three instruments
+    assert len(reads) == 9
+
+
+def test_harmonize_command(synthetic_datadir, tmp_path):
+    """
+    pytest function for the harmonization command on the synthetic files
+    """
+
+    outpath = tmp_path / "coeffs.nc"
+    assert harmonize.main(["-g", "-d", synthetic_datadir, str(outpath)]) == 0
+    coeffs = xr.open_dataset(outpath)
+    assert coeffs["ERS_gain"].shape == (40, 40)
+    assert int(coeffs["QuikSCAT_count"].max()) == 35
+    assert coeffs.attrs["gains"] == 1
+    coeffs.close()
+
+    box = ubs.cmgutils.box11(-71.06, 42.36)
+    datasets = {
+        name: ubs.ncfileio.get_monthly_data(synthetic_datadir, name, bbox=box)
+        for name in harmonize.CHAIN
+    }
+    with xr.open_dataset(outpath) as coeffs:
+        box_coeffs = harmonize.box_coefficients(coeffs, datasets["ASCAT"])
+        merged = harmonize.merged_series(datasets, box_coeffs)
+    assert merged["sig0"].shape[1:] == (11, 11)
+    assert merged["time"].values[0] == np.datetime64("1993-01-01")
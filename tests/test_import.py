@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import subprocess
+
+import urban_backscatter as ubs
+
+HEAVY_MODULES = ["xarray", "pandas", "numpy", "matplotlib", "netCDF4"]
+
+# generous bound on the package import (a few ms without the heavy
+# modules, most of a second with them)
+IMPORT_SECONDS = 0.25
+
+SCRIPTS = [
+    "extract_grid_cells_from_monthly.py",
+    "extract_grid_cells_from_seasonal.py",
+    "plot_seasonal_timeseries.py",
+    "cli.py",
+]
+
+
+def _run(code, *args):
+    result = subprocess.run(
+        [sys.executable, "-c", code] + list(args),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_is_lazy():
+    """
+    pytest function checking that importing the package is fast and
+    does not import xarray, pandas, ... until a submodule is used
+    """
+
+    code = (
+        "import sys, time, json\n"
+        "start = time.perf_counter()\n"
+        "import urban_backscatter\n"
+        "seconds = time.perf_counter() - start\n"
+        "print(json.dumps({'seconds': seconds, 'modules': sorted(sys.modules)}))\n"
+    )
+    info = _run(code)
+    loaded = [x for x in HEAVY_MODULES if x in info["modules"]]
+    assert loaded == []
+    assert info["seconds"] < IMPORT_SECONDS
+
+
+def test_lazy_attributes():
+    """
+    pytest function checking the submodules and version are still
+    available as package attributes
+    """
+
+    assert ubs.ncfileio.SEASON_LIST == ["JFM", "AMJ", "JAS", "OND"]
+    assert ubs.cmgutils.NROWS == 3000
+    assert isinstance(ubs.__version__, str)
+    assert set(ubs.__all__) <= set(dir(ubs))
+    try:
+        ubs.nosuchmodule
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError("expected an AttributeError")
+
+
+def test_script_help_is_lazy():
+    """
+    pytest function checking that the scripts print their help without
+    importing xarray, pandas or matplotlib
+    """
+
+    srcdir = os.path.dirname(ubs.__file__)
+    for script in SCRIPTS:
+        code = (
+            "import sys, json, runpy\n"
+            "sys.argv = [sys.argv[1], '--help']\n"
+            "try:\n"
+            "    runpy.run_path(sys.argv[0], run_name='__main__')\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            "print(json.dumps(sorted(sys.modules)))\n"
+        )
+        modules = _run(code, os.path.join(srcdir, script))
+        loaded = [x for x in HEAVY_MODULES if x in modules]
+        assert loaded == [], script
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+import urban_backscatter as ubs
+
+
+def test_box_means_match_direct_means(synthetic_datadir, tmp_path):
+    """
+    pytest function comparing integral image box means with the mean
+    over the cells of each box
+    """
+
+    integraldir = str(tmp_path / "integral")
+    sidecars = ubs.integral.build_integral(
+        synthetic_datadir, integraldir, instruments=["ERS"]
+    )
+    assert len(sidecars) == 3
+
+    # the last city is near the corner of the grid (with the all-NaN cell)
+    lons = np.array([-71.06, -70.5, -71.98])
+    lats = np.array([42.36, 43.5, 43.99])
+
+    myds = ubs.ncfileio.get_seasonal_data(synthetic_datadir, "ERS", season="JAS")
+    integral = ubs.integral.get_integral(integraldir, "ERS", "seasonal")
+    for halfwidth in [0, 1, 5, 20]:
+        rows, cols = ubs.cmgutils.box_indices(lons, lats, halfwidth)
+        means = ubs.integral.box_means(integral, rows, cols)
+        means = means.sel(time=myds["time"])
+
+        boxes = ubs.dsutils.gather_boxes(myds.load(), rows, cols)
+        for var in ["sig0", "sig0std"]:
+            expected = boxes[var].mean(dim=["y", "x"], skipna=True)
+            np.testing.assert_allclose(means[var], expected, rtol=1e-5)
+            counts = boxes[var].notnull().sum(dim=["y", "x"])
+            np.testing.assert_array_equal(means[var + "_count"], counts)
+
+    # a single cell without data
+    rows, cols = ubs.cmgutils.box_indices(-71.99, 43.99, 0)
+    means = ubs.integral.box_means(integral, rows, cols)
+    assert np.isnan(means["sig0"]).all()
+
+    with pytest.raises(ValueError):
+        ubs.integral.get_integral(integraldir, "ERS", "monthly", masked=True)
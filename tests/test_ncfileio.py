@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import os
 from contextlib import contextmanager
 import pytest
 import urban_backscatter as ubs
@@ -119,3 +120,188 @@ def test_bad_platform_raises_value_error():
         ubs.ncfileio.get_seasonal_data(
             "./data", "XXX", season="JAS", masked=False, verbose=True
         )
+
+
+def test_dataset_cache_reuses_and_invalidates(synthetic_datadir):
+    """
+    pytest function for the dataset cache used by the loaders
+    """
+
+    ubs.ncfileio.clear_cache()
+
+    myds = ubs.ncfileio.get_monthly_data(synthetic_datadir, "ERS")
+    myds = ubs.ncfileio.get_monthly_data(synthetic_datadir, "ERS")
+    stats = ubs.ncfileio.cache_stats()
+    assert len(myds["time"]) == 96
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+
+    # seasonal calls for different seasons share one cache entry
+    for season in ubs.ncfileio.SEASON_LIST:
+        myds = ubs.ncfileio.get_seasonal_data(synthetic_datadir, "ERS", season=season)
+        assert len(myds["time"]) == 8
+    stats = ubs.ncfileio.cache_stats()
+    assert stats["misses"] == 2
+    assert stats["size"] == 2
+
+    # a changed file forces a reload
+    path = os.path.join(synthetic_datadir, "ERS_monthly_land_sig0_mean.nc")
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+    ubs.ncfileio.get_monthly_data(synthetic_datadir, "ERS")
+    assert ubs.ncfileio.cache_stats()["misses"] == 3
+
+    # LRU eviction and explicit clearing
+    ubs.ncfileio.set_cache_size(1)
+    assert ubs.ncfileio.cache_stats()["size"] == 1
+    ubs.ncfileio.set_cache_size(ubs.ncfileio.CACHE_SIZE)
+    ubs.ncfileio.clear_cache()
+    assert ubs.ncfileio.cache_stats()["size"] == 0
+
+
+def _open_files(datadir):
+    # data files open in this process (linux only)
+    paths = []
+    for fd in os.listdir("/proc/self/fd"):
+        try:
+            paths.append(os.readlink(os.path.join("/proc/self/fd", fd)))
+        except OSError:
+            pass
+    return [x for x in paths if x.startswith(str(datadir))]
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc")
+def test_dataset_cache_disabled_closes_files(synthetic_datadir):
+    """
+    pytest function checking the loaders do not leave files open with
+    the dataset cache disabled
+    """
+
+    ubs.ncfileio.clear_cache()
+    ubs.ncfileio.set_cache_size(0)
+    try:
+        bbox = ubs.cmgutils.box11(-71.06, 42.36)
+        myds = ubs.ncfileio.get_monthly_data(synthetic_datadir, "ERS", bbox=bbox)
+        data = ubs.ncfileio.get_all_seasons_data(synthetic_datadir, "ERS", bbox=bbox)
+        assert _open_files(synthetic_datadir) == []
+        assert float(myds["sig0"].mean()) < 0
+        assert data["JAS"]["sig0"].shape == (8, 11, 11)
+
+        # without bbox closing the returned dataset closes the files
+        myds = ubs.ncfileio.get_seasonal_data(synthetic_datadir, "ERS", season="JFM")
+        assert len(_open_files(synthetic_datadir)) == 2
+        myds.close()
+        assert _open_files(synthetic_datadir) == []
+        assert ubs.ncfileio.cache_stats()["size"] == 0
+    finally:
+        ubs.ncfileio.set_cache_size(ubs.ncfileio.CACHE_SIZE)
+
+
+def test_bbox_subset_matches_sel(synthetic_datadir):
+    """
+    pytest function for reading only an 11x11 box with bbox
+    """
+
+    bbox = ubs.cmgutils.box11(-71.06, 42.36)
+    lonmin, latmin, lonmax, latmax = bbox
+
+    myds = ubs.ncfileio.get_monthly_data(synthetic_datadir, "ASCAT", bbox=bbox)
+    assert myds["sig0"].shape == (168, 11, 11)
+
+    fullds = ubs.ncfileio.get_seasonal_data(synthetic_datadir, "ERS", season="JFM")
+    expected = fullds.sel(lon=slice(lonmin, lonmax), lat=slice(latmax, latmin))
+    myds = ubs.ncfileio.get_seasonal_data(
+        synthetic_datadir, "ERS", season="JFM", bbox=bbox
+    )
+    assert myds["sig0std"].shape == (8, 11, 11)
+    assert myds.identical(expected.load())
+
+    with pytest.raises(ValueError):
+        ubs.ncfileio.get_monthly_data(synthetic_datadir, "ERS", bbox=(0, 0, 1))
+
+
+def test_store_matches_netcdf(synthetic_datadir, tmp_path):
+    """
+    pytest function for the time series (zarr) store readers
+    """
+
+    storedir = str(tmp_path / "store")
+    stores = ubs.ncfileio.build_store(
+        synthetic_datadir, storedir, instruments=["ERS"], tile=16
+    )
+    assert len(stores) == 3
+
+    bbox = ubs.cmgutils.box11(-71.06, 42.36)
+    expected = ubs.ncfileio.get_monthly_data(synthetic_datadir, "ERS", bbox=bbox)
+    myds = ubs.ncfileio.get_monthly_store_data(storedir, "ERS", bbox=bbox)
+    assert myds["sig0"].equals(expected["sig0"])
+    assert myds["sig0std"].equals(expected["sig0std"])
+
+    expected = ubs.ncfileio.get_seasonal_data(
+        synthetic_datadir, "ERS", season="OND", masked=True
+    )
+    myds = ubs.ncfileio.get_seasonal_store_data(
+        storedir, "ERS", season="OND", masked=True
+    )
+    assert myds["sig0"].shape == (8, 40, 40)
+    assert myds["sig0"].equals(expected["sig0"])
+
+
+def test_store_cache_sees_rebuilt_store(synthetic_datadir, tmp_path):
+    """
+    pytest function checking a rebuilt store is read again even if the
+    store directory looks unchanged
+    """
+
+    import shutil
+    import xarray as xr
+
+    datadir = tmp_path / "data"
+    datadir.mkdir()
+    for suffix in ["mean", "StdDev"]:
+        name = "ERS_monthly_land_sig0_{}.nc".format(suffix)
+        shutil.copy(os.path.join(synthetic_datadir, name), datadir)
+    storedir = str(tmp_path / "store")
+    ubs.ncfileio.build_store(str(datadir), storedir, instruments=["ERS"])
+    store_path = os.path.join(storedir, "ERS_monthly_land_sig0.zarr")
+    st = os.stat(store_path)
+
+    bbox = ubs.cmgutils.box11(-71.06, 42.36)
+    before = ubs.ncfileio.get_monthly_store_data(storedir, "ERS", bbox=bbox)
+
+    # new values in the source file and a rebuilt store
+    path = str(datadir / "ERS_monthly_land_sig0_mean.nc")
+    with xr.open_dataset(path) as ds:
+        ds = ds.load()
+    (ds + 1.0).to_netcdf(path)
+    ubs.ncfileio.build_store(str(datadir), storedir, instruments=["ERS"])
+    os.utime(store_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    misses = ubs.ncfileio.cache_stats()["misses"]
+    after = ubs.ncfileio.get_monthly_store_data(storedir, "ERS", bbox=bbox)
+    assert ubs.ncfileio.cache_stats()["misses"] == misses + 1
+    diff = (after["sig0"] - before["sig0"]).values
+    assert abs(diff[~(diff != diff)] - 1.0).max() < 1e-5
+
+
+def test_all_seasons_matches_single_season(synthetic_datadir):
+    """
+    pytest function for reading all seasons in one pass
+    """
+
+    bbox = ubs.cmgutils.box11(-71.06, 42.36)
+    season_data = ubs.ncfileio.get_all_seasons_data(
+        synthetic_datadir, "QuikSCAT", bbox=bbox
+    )
+    assert list(season_data) == ubs.ncfileio.SEASON_LIST
+
+    for season, myds in season_data.items():
+        expected = ubs.ncfileio.get_seasonal_data(
+            synthetic_datadir, "QuikSCAT", season=season, bbox=bbox
+        )
+        assert myds.identical(expected)
+
+    with pytest.raises(ValueError):
+        ubs.ncfileio.get_all_seasons_data(
+            synthetic_datadir, "QuikSCAT", seasons=["JAS", "JOS"]
+        )
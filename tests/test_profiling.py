@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+import json
+
+import urban_backscatter as ubs
+
+
+def test_profile_stages(synthetic_datadir, tmp_path):
+    """
+    pytest function checking the stages recorded for a seasonal
+    extraction and the trace file
+    """
+
+    ubs.ncfileio.clear_cache()
+    ubs.profiling.reset()
+    ubs.profiling.enable()
+    try:
+        bbox = ubs.cmgutils.box11(-71.0, 43.0)
+        myds = ubs.ncfileio.get_seasonal_data(synthetic_datadir, "ERS", bbox=bbox)
+        df = ubs.dsutils.seasonal_ds_to_df(myds, "JAS", "ERS")
+        outpath = str(tmp_path / "box.csv")
+        ubs.dsutils.write_table(df, outpath)
+    finally:
+        ubs.profiling.disable()
+
+    table = ubs.profiling.summary().set_index(["stage", "instrument"])
+    for key in [
+        ("get_seasonal_data", "ERS"),
+        ("open_dataset", "ERS"),
+        ("merge", "ERS"),
+        ("sel", "ERS"),
+        ("load", "ERS"),
+        ("seasonal_ds_to_df", "ERS"),
+        ("write_table", ""),
+    ]:
+        assert key in table.index
+
+    # one 11x11 box of 8 float32 values for each variable
+    assert table.loc[("load", "ERS"), "mb"] * 2**20 == 2 * 8 * 121 * 4
+    assert table.loc[("write_table", ""), "mb"] > 0
+    assert (table["total_s"] > 0).all()
+
+    tracepath = tmp_path / "trace.json"
+    ubs.profiling.write_trace(str(tracepath))
+    with open(tracepath) as f:
+        events = json.load(f)["traceEvents"]
+    assert len(events) == len(ubs.profiling.PROFILER.records)
+    assert {x["ph"] for x in events} == {"X"}
+
+    # nothing is recorded while disabled
+    ubs.profiling.reset()
+    ubs.ncfileio.get_seasonal_data(synthetic_datadir, "ERS", bbox=bbox)
+    assert ubs.profiling.summary().empty
+
+
+def test_profile_batch_reads(synthetic_datadir, tmp_path):
+    """
+    pytest function checking the box reads of a batch run are recorded
+    per instrument with the bytes read
+    """
+
+    from urban_backscatter import batch
+
+    citylist = tmp_path / "cities.csv"
+    citylist.write_text("locname,lat,lon\nboston,42.36,-71.06\n")
+    cities = batch.read_city_list(str(citylist))
+
+    ubs.ncfileio.clear_cache()
+    ubs.profiling.reset()
+    ubs.profiling.enable()
+    try:
+        batch.run_batch(cities, synthetic_datadir, str(tmp_path / "out"))
+    finally:
+        ubs.profiling.disable()
+
+    table = ubs.profiling.summary().set_index(["stage", "instrument"])
+    for instrument in batch.SEASONAL_INSTRUMENTS:
+        assert ("gather", instrument) in table.index
+        assert ("gather_boxes", instrument) in table.index
+        assert table.loc[("load", instrument), "mb"] > 0
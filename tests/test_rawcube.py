@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+import urban_backscatter as ubs
+
+
+def test_rawcube_matches_netcdf(synthetic_datadir, tmp_path):
+    """
+    pytest function for the memory-mapped cube exporter and readers
+    """
+
+    cubedir = str(tmp_path / "cubes")
+    sidecars = ubs.rawcube.export_rawcube(
+        synthetic_datadir, cubedir, instruments=["QuikSCAT"]
+    )
+    assert len(sidecars) == 3
+
+    # whole cube is a view on the memory map
+    myds = ubs.rawcube.get_monthly_rawcube_data(cubedir, "QuikSCAT")
+    expected = ubs.ncfileio.get_monthly_data(synthetic_datadir, "QuikSCAT")
+    assert myds["sig0"].shape == expected["sig0"].shape
+    assert isinstance(myds["sig0"].values.base, np.memmap)
+    np.testing.assert_allclose(myds["lat"], expected["lat"])
+    np.testing.assert_allclose(myds["lon"], expected["lon"])
+
+    # box selection picks the same cells as the netcdf loader
+    bbox = ubs.cmgutils.box11(-71.06, 42.36)
+    myds = ubs.rawcube.get_monthly_rawcube_data(cubedir, "QuikSCAT", bbox=bbox)
+    expected = ubs.ncfileio.get_monthly_data(synthetic_datadir, "QuikSCAT", bbox=bbox)
+    assert myds["sig0"].shape == (125, 11, 11)
+    np.testing.assert_array_equal(myds["sig0"], expected["sig0"])
+    np.testing.assert_array_equal(myds["sig0std"], expected["sig0std"])
+
+    myds = ubs.rawcube.get_seasonal_rawcube_data(
+        cubedir, "QuikSCAT", season="AMJ", bbox=bbox
+    )
+    expected = ubs.ncfileio.get_seasonal_data(
+        synthetic_datadir, "QuikSCAT", season="AMJ", bbox=bbox
+    )
+    np.testing.assert_array_equal(myds["sig0"], expected["sig0"])
+    assert (myds["time"].values == expected["time"].values).all()
+
+    with pytest.raises(ValueError):
+        ubs.rawcube.get_seasonal_rawcube_data(cubedir, "QuikSCAT", season="XXX")
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+
+import urban_backscatter as ubs
+from urban_backscatter import resultcache
+
+
+def test_result_cache(synthetic_datadir, tmp_path):
+    """
+    pytest function checking the memory and disk tiers of the result
+    cache and the invalidation when a data file changes
+    """
+
+    datadir = str(tmp_path / "data")
+    os.makedirs(datadir)
+    for name in os.listdir(synthetic_datadir):
+        if name.startswith("ERS_seasonal_land"):
+            shutil.copy(os.path.join(synthetic_datadir, name), datadir)
+
+    cachedir = str(tmp_path / "cache")
+    cache = resultcache.ResultCache(cachedir)
+    kwargs = {"instruments": ["ERS"], "season": "AMJ", "cache": cache}
+
+    expected = resultcache.extract_table(
+        datadir, -71.02, 43.02, "seasonal", "AMJ", ["ERS"]
+    )
+    bbox = ubs.cmgutils.box11(-71.02, 43.02)
+    myds = ubs.ncfileio.get_seasonal_data(datadir, "ERS", season="AMJ", bbox=bbox)
+    assert expected.equals(ubs.dsutils.seasonal_ds_to_df(myds, "AMJ", "ERS"))
+
+    df = resultcache.cached_table(datadir, -71.02, 43.02, **kwargs)
+    assert df.equals(expected)
+    assert cache.stats()["misses"] == 1
+
+    # another location in the same center cell hits the memory tier
+    df = resultcache.cached_table(datadir, -71.03, 43.03, **kwargs)
+    assert df.equals(expected)
+    assert cache.stats()["memory_hits"] == 1
+
+    # a new process (cache) reads the disk tier without opening any file
+    ubs.ncfileio.clear_cache()
+    cache = resultcache.ResultCache(cachedir)
+    kwargs["cache"] = cache
+    df = resultcache.cached_table(datadir, -71.02, 43.02, **kwargs)
+    assert df.to_csv() == expected.to_csv()
+    assert cache.stats()["disk_hits"] == 1
+    assert ubs.ncfileio.cache_stats()["misses"] == 0
+
+    # a changed data file invalidates the entry
+    path = os.path.join(datadir, "ERS_seasonal_land_sig0_mean.nc")
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    resultcache.cached_table(datadir, -71.02, 43.02, **kwargs)
+    assert cache.stats()["misses"] == 1
+
+    # the disk tier stays under its size cap
+    cache = resultcache.ResultCache(str(tmp_path / "small"), max_bytes=1)
+    kwargs["cache"] = cache
+    resultcache.cached_table(datadir, -71.02, 43.02, **kwargs)
+    resultcache.cached_table(datadir, -71.2, 43.0, **kwargs)
+    stats = cache.stats()
+    assert stats["evictions"] == 2
+    assert stats["disk_bytes"] == 0
+
+
+def test_result_cache_monthly_masked(synthetic_datadir):
+    """
+    pytest function checking masked is ignored for the (unmasked)
+    monthly data
+    """
+
+    cache = resultcache.ResultCache()
+    df = resultcache.cached_table(
+        synthetic_datadir, -71.02, 43.02, mode="monthly", masked=True, cache=cache
+    )
+    expected = resultcache.extract_table(synthetic_datadir, -71.02, 43.02, "monthly")
+    assert df.equals(expected)
+    assert resultcache.result_key(
+        synthetic_datadir, -71.02, 43.02, "monthly", masked=True
+    ) == resultcache.result_key(synthetic_datadir, -71.02, 43.02, "monthly")
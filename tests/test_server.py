@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+import io
+import json
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+from urban_backscatter import batch
+from urban_backscatter import server
+
+
+@pytest.fixture(scope="module")
+def base_url(synthetic_datadir):
+    data = server.ResidentData(synthetic_datadir)
+    httpd = server.make_server(data, "127.0.0.1", 0)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    host, port = httpd.server_address[:2]
+    yield "http://{}:{}".format(host, port)
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def fetch(url):
+    with urllib.request.urlopen(url) as response:
+        return response.status, response.read()
+
+
+def test_server_extract(base_url, synthetic_datadir):
+    """
+    pytest function comparing served boxes with the batch extraction
+    and checking the health and metrics endpoints
+    """
+
+    status, body = fetch(base_url + "/health")
+    assert status == 200
+    assert json.loads(body)["instruments"] == ["ERS", "QuikSCAT", "ASCAT"]
+
+    # the served csv matches the table written by the batch extraction
+    status, body = fetch(base_url + "/extract?lat=43.0&lon=-71.0&season=AMJ")
+    assert status == 200
+    datasets = batch.load_seasonal(synthetic_datadir, ["AMJ"])
+    specs = batch.table_specs("seasonal", "AMJ")
+    expected = batch.city_tables(
+        [datasets[x]["AMJ"] for x, spec in specs],
+        [spec for x, spec in specs],
+        [-71.0],
+        [43.0],
+    )[0]
+    assert body == expected.to_csv(na_rep="-9999.0", index=False).encode()
+
+    # other box sizes, instruments, modes and formats
+    status, body = fetch(
+        base_url
+        + "/extract?lat=43.0&lon=-71.0&box=3&mode=monthly&instrument=ERS,ASCAT"
+        + "&format=json"
+    )
+    records = json.loads(body)
+    assert len(records) == 9
+    assert "ERS1993_01_mean" in records[0]
+    assert not any(x.startswith("QuikSCAT") for x in records[0])
+    status, body = fetch(
+        base_url + "/extract?lat=43.0&lon=-71.0&layout=long&format=parquet"
+    )
+    df = pd.read_parquet(io.BytesIO(body))
+    assert set(df["instrument"]) == {"ERS", "QuikSCAT", "ASCAT"}
+
+    # concurrent requests
+    urls = [
+        base_url + "/extract?lat={}&lon=-71.0&box=5".format(42.5 + 0.05 * i)
+        for i in range(16)
+    ]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        statuses = [x[0] for x in pool.map(fetch, urls)]
+    assert statuses == [200] * 16
+
+    # bad queries
+    for query in ["lat=43.0", "lat=43&lon=-71&box=4", "lat=43&lon=-71&season=DJF"]:
+        with pytest.raises(urllib.error.HTTPError) as err:
+            fetch(base_url + "/extract?" + query)
+        assert err.value.code == 400
+
+    status, body = fetch(base_url + "/metrics")
+    metrics = json.loads(body)
+    extract = metrics["endpoints"]["/extract"]
+    assert extract["count"] == 22
+    assert extract["status"] == {"200": 19, "400": 3}
+    assert sum(extract["latency_ms_buckets"].values()) == 22
+    assert metrics["endpoints"]["/health"]["count"] == 1
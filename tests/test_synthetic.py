@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+import urban_backscatter as ubs
+from urban_backscatter import synthetic
+
+
+def test_write_synthetic_data(tmp_path):
+    """
+    pytest function checking the geometry and time axes of the synthetic
+    files and that they are read by the loaders
+    """
+
+    datadir = str(tmp_path)
+    written = synthetic.write_synthetic_data(datadir, scale=0.005, instruments=["ERS"])
+    assert len(written) == 6
+
+    # the region is on the CMG cell centers around the center location
+    row0, row1, col0, col1 = synthetic.region_indices(0.005)
+    assert (row1 - row0, col1 - col0) == (15, 36)
+    monthly = ubs.ncfileio.get_monthly_data(datadir, "ERS")
+    assert monthly["sig0"].shape == (96, 15, 36)
+    lon, lat = ubs.cmgutils.cell_centers(np.arange(row0, row1), np.arange(col0, col1))
+    np.testing.assert_allclose(monthly["lat"], lat)
+    np.testing.assert_allclose(monthly["lon"], lon)
+    assert "spatial_ref" in monthly.coords
+
+    # a box around the center is read and converted
+    bbox = ubs.cmgutils.box11(*synthetic.CENTER)
+    seasonal = ubs.ncfileio.get_seasonal_data(datadir, "ERS", season="JAS", bbox=bbox)
+    assert seasonal["sig0"].shape == (8, 11, 11)
+    df = ubs.dsutils.seasonal_ds_to_df(seasonal, "JAS", "ERS", keep_nodata=True)
+    assert len(df) == 121
+
+    # urban cells are a subset of the land cells
+    land = ubs.ncfileio.get_seasonal_data(datadir, "ERS")["sig0"].notnull().any("time")
+    urban = ubs.ncfileio.get_seasonal_data(datadir, "ERS", masked=True)
+    urban = urban["sig0"].notnull().any("time")
+    assert urban.sum() > 0
+    assert not (urban & ~land).any()
+
+    with pytest.raises(ValueError):
+        synthetic.region_indices(0.0)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+import xarray as xr
+import urban_backscatter as ubs
+from urban_backscatter import trend
+
+
+def test_cell_trends_match_polyfit(synthetic_datadir, tmp_path):
+    """
+    pytest function comparing the per-cell trends with numpy polyfit
+    """
+
+    myds = ubs.ncfileio.get_monthly_data(synthetic_datadir, "QuikSCAT")
+    trends = trend.cell_trends(myds, tile=7)
+    assert trends["slope"].shape == (40, 40)
+    np.testing.assert_array_equal(trends["lat"], myds["lat"])
+
+    years = trend.decimal_years(myds["time"].values)
+    values = myds["sig0"].values
+    for row, col in [(5, 5), (1, 2), (39, 39)]:
+        y = values[:, row, col]
+        valid = ~np.isnan(y)
+        slope, intercept = np.polyfit(years[valid], y[valid], 1)
+        r2 = np.corrcoef(years[valid], y[valid])[0, 1] ** 2
+        assert float(trends["slope"][row, col]) == pytest.approx(slope, rel=1e-4)
+        assert float(trends["intercept"][row, col]) == pytest.approx(
+            intercept, rel=1e-5
+        )
+        assert float(trends["r2"][row, col]) == pytest.approx(r2, rel=1e-3)
+        assert int(trends["count"][row, col]) == valid.sum()
+
+    # the cell without data
+    assert np.isnan(trends["slope"][0, 0])
+    assert int(trends["count"][0, 0]) == 0
+
+    # threads and other tile sizes give the same maps
+    parallel = trend.cell_trends(myds, tile=16, workers=4)
+    xr.testing.assert_identical(parallel, trends)
+
+    # exact line
+    block = 2.0 + 0.5 * years[:, np.newaxis]
+    fit = trend.fit_block(block, years)
+    assert fit["slope"][0] == pytest.approx(0.5)
+    assert fit["r2"][0] == pytest.approx(1.0)
+
+
+def test_trend_command_writes_zarr(synthetic_datadir, tmp_path):
+    """
+    pytest function for the trend command with a bbox and zarr output
+    """
+
+    outpath = str(tmp_path / "trend.zarr")
+    bbox = ["-71.5", "42.5", "-70.5", "43.5"]
+    args = ["-i", "ERS", "-s", "AMJ", "-b", *bbox, "-d", synthetic_datadir, outpath]
+    assert trend.main(args) == 0
+
+    trends = xr.open_zarr(outpath)
+    assert trends["slope"].shape == (20, 20)
+    assert trends.attrs["variable"] == "sig0"
+    assert int(trends["count"].max()) == 8
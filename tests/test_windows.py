@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+import urban_backscatter as ubs
+
+
+def test_window_aggregates_match_groupby(synthetic_datadir):
+    """
+    pytest function comparing window aggregates with xarray groupby
+    """
+
+    bbox = ubs.cmgutils.box11(-71.06, 42.36)
+    box = ubs.ncfileio.get_monthly_data(synthetic_datadir, "ERS", bbox=bbox)
+
+    ubs.windows.cached_groups.cache_clear()
+    results = ubs.windows.window_aggregates(box, ["JAS", "DJF", "11-4", (5, 6)])
+    assert list(results) == ["JAS", "DJF", "11-4", "5-6"]
+    assert ubs.windows.cached_groups.cache_info().currsize == 1
+
+    # same shape as the seasonal loader
+    seasonal = ubs.ncfileio.get_seasonal_data(
+        synthetic_datadir, "ERS", season="JAS", bbox=bbox
+    )
+    jas = results["JAS"]
+    assert jas["sig0"].dims == seasonal["sig0"].dims
+    assert jas["sig0"].shape == seasonal["sig0"].shape
+    assert (jas["time"].values == seasonal["time"].values).all()
+
+    summer = box.sel(time=box["time"].dt.month.isin([7, 8, 9]))
+    expected = summer["sig0"].groupby("time.year").mean()
+    np.testing.assert_allclose(jas["sig0"], expected, rtol=1e-5)
+    pooled = np.sqrt(
+        (summer["sig0"] ** 2 + summer["sig0std"] ** 2).groupby("time.year").mean()
+        - expected**2
+    )
+    np.testing.assert_allclose(jas["sig0std"], pooled, rtol=1e-4)
+
+    # December counts towards the next year, years without a December
+    # (1993) or the following months (2001) are left out
+    djf = results["DJF"]
+    assert str(djf["time"].values[0])[:10] == "1994-01-15"
+    assert djf.sizes["time"] == 7
+    winter = box["sig0"].sel(time=["1993-12-01", "1994-01-01", "1994-02-01"])
+    np.testing.assert_allclose(djf["sig0"][0], winter.mean(dim="time"), rtol=1e-5)
+
+    # November to April is centred on February
+    assert str(results["11-4"]["time"].values[0])[:10] == "1994-02-15"
+
+    # the cached group index is reused
+    ubs.windows.window_aggregates(box, ["JAS", "DJF", "11-4", (5, 6)])
+    assert ubs.windows.cached_groups.cache_info().currsize == 1
+
+
+def test_parse_window():
+    """
+    pytest function for window names, ranges and hemispheres
+    """
+
+    assert ubs.windows.parse_window("SUMMER", lat=42.0) == (6, 7, 8)
+    assert ubs.windows.parse_window("SUMMER", lat=-33.9) == (12, 1, 2)
+    assert ubs.windows.parse_window("10-3") == (10, 11, 12, 1, 2, 3)
+    with pytest.raises(ValueError):
+        ubs.windows.parse_window("SUMMER")
+    with pytest.raises(ValueError):
+        ubs.windows.parse_window("XYZ")
+    with pytest.raises(ValueError):
+        ubs.windows.parse_window((1, 13))
+
+
+def test_hemisphere_windows(synthetic_datadir):
+    """
+    pytest function for hemisphere-aware windows on northern, southern
+    and mixed latitude rows
+    """
+
+    # a box in the northern hemisphere only
+    bbox = ubs.cmgutils.box11(-71.06, 42.36)
+    results = ubs.windows.get_window_data(
+        synthetic_datadir, "ERS", ["SUMMER", "JJA"], bbox=bbox
+    )
+    assert results["SUMMER"].equals(results["JJA"])
+
+    # one row on each side of the equator
+    times = pd.date_range("2000-01-01", periods=36, freq="MS")
+    rng = np.random.default_rng(0)
+    shape = (len(times), 2, 3)
+    ds = xr.Dataset(
+        {
+            "sig0": (("time", "lat", "lon"), rng.normal(-10.0, 2.0, shape)),
+            "sig0std": (("time", "lat", "lon"), rng.uniform(0.5, 2.0, shape)),
+        },
+        coords={"time": times, "lat": [0.025, -0.025], "lon": [0.025, 0.075, 0.125]},
+    )
+    results = ubs.windows.window_aggregates(ds, ["SUMMER", "JJA", "DJF"])
+    summer, jja, djf = results["SUMMER"], results["JJA"], results["DJF"]
+
+    # JJA 2000-2002 and DJF of the winters ending in 2001 and 2002
+    assert list(summer["time"].dt.year.values) == [2000, 2001, 2002]
+    np.testing.assert_allclose(summer["sig0"][:, 0], jja["sig0"][:, 0], rtol=1e-6)
+    assert np.isnan(summer["sig0"][0, 1]).all()
+    np.testing.assert_allclose(summer["sig0"][1:, 1], djf["sig0"][:, 1], rtol=1e-6)
+    np.testing.assert_allclose(
+        summer["sig0std"][1:, 1], djf["sig0std"][:, 1], rtol=1e-6
+    )
+
+
+def test_group_cache_is_bounded():
+    """
+    pytest function checking the group matrix cache keeps at most
+    GROUP_CACHE_SIZE entries
+    """
+
+    ubs.windows.cached_groups.cache_clear()
+    for start in range(ubs.windows.GROUP_CACHE_SIZE + 5):
+        times = pd.date_range("2000-01-01", periods=12 + start, freq="MS")
+        ubs.windows.group_matrix(times, {"JAS": (7, 8, 9)})
+    info = ubs.windows.cached_groups.cache_info()
+    assert info.currsize == ubs.windows.GROUP_CACHE_SIZE
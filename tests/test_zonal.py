@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+import json
+
+import numpy as np
+import urban_backscatter as ubs
+
+
+def write_geojson(path, features):
+    collection = {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "properties": {"locname": name},
+                "geometry": {"type": kind, "coordinates": coordinates},
+            }
+            for name, kind, coordinates in features
+        ],
+    }
+    path.write_text(json.dumps(collection))
+
+
+def test_zonal_stats_match_box_means(synthetic_datadir, tmp_path):
+    """
+    pytest function comparing polygon zonal statistics with means over
+    the same cells
+    """
+
+    # polygon just inside the edges of the 11x11 box around boston
+    lonmin, latmin, lonmax, latmax = ubs.cmgutils.box11(-71.06, 42.36)
+    square = [
+        [lonmin + 0.01, latmin + 0.01],
+        [lonmax - 0.01, latmin + 0.01],
+        [lonmax - 0.01, latmax - 0.01],
+        [lonmin + 0.01, latmax - 0.01],
+        [lonmin + 0.01, latmin + 0.01],
+    ]
+    # the same square with a hole of 3x3 cells
+    lon0, lat0 = (lonmin + lonmax) / 2, (latmin + latmax) / 2
+    hole = [
+        [lon0 - 0.07, lat0 - 0.07],
+        [lon0 - 0.07, lat0 + 0.07],
+        [lon0 + 0.07, lat0 + 0.07],
+        [lon0 + 0.07, lat0 - 0.07],
+        [lon0 - 0.07, lat0 - 0.07],
+    ]
+    tiny = [[-70.501, 43.501], [-70.502, 43.501], [-70.501, 43.502]]
+    polygons = tmp_path / "cities.geojson"
+    write_geojson(
+        polygons,
+        [
+            ("boston", "Polygon", [square]),
+            ("donut", "MultiPolygon", [[square, hole]]),
+            ("tiny", "Polygon", [tiny]),
+            ("faraway", "Polygon", [[[10, 10], [11, 10], [11, 11], [10, 10]]]),
+        ],
+    )
+
+    cachedir = str(tmp_path / "cache")
+    weights = ubs.zonal.get_weights(str(polygons), cachedir)
+    assert np.diff(weights.indptr).tolist()[:3] == [121, 112, 1]
+    cached = ubs.zonal.get_weights(str(polygons), cachedir)
+    np.testing.assert_array_equal(cached.cells, weights.cells)
+    assert cached.names == ["boston", "donut", "tiny", "faraway"]
+
+    myds = ubs.ncfileio.get_monthly_data(synthetic_datadir, "ERS")
+    stats = ubs.zonal.zonal_stats(myds, weights, variables=["sig0", "sig0std"])
+    assert stats["sig0_mean"].shape == (96, 4)
+
+    box = ubs.ncfileio.get_monthly_data(
+        synthetic_datadir, "ERS", bbox=ubs.cmgutils.box11(-71.06, 42.36)
+    )
+    for var in ["sig0", "sig0std"]:
+        boston = stats.sel(city="boston")
+        expected = box[var].mean(dim=["lat", "lon"], skipna=True)
+        np.testing.assert_allclose(boston[var + "_mean"], expected, rtol=1e-5)
+        expected = box[var].std(dim=["lat", "lon"], skipna=True)
+        np.testing.assert_allclose(boston[var + "_std"], expected, rtol=1e-4)
+
+    inner = box["sig0"].values.copy()
+    inner[:, 4:7, 4:7] = np.nan
+    np.testing.assert_allclose(
+        stats["sig0_mean"].sel(city="donut"),
+        np.nanmean(inner.reshape(96, -1), axis=1),
+        rtol=1e-5,
+    )
+    assert (stats["sig0_count"].sel(city="tiny") == 1).all()
+    assert (stats["sig0_count"].sel(city="faraway") == 0).all()
+    assert np.isnan(stats["sig0_mean"].sel(city="faraway")).all()
+
+
+def test_urban_weighted_means(synthetic_datadir, tmp_path):
+    """
+    pytest function for urban weights applied to box and polygon means
+    """
+
+    cachedir = str(tmp_path / "weights")
+    grid = ubs.zonal.get_urban_weights(synthetic_datadir, "ERS", cachedir=cachedir)
+    assert grid.shape == (40, 40)
+    assert float(grid[0, 0]) == 0.0
+    assert float(grid[2, 2]) == 1.0
+    assert float(grid[1, 1]) < 1.0
+    assert len(list((tmp_path / "weights").iterdir())) == 1
+    cached = ubs.zonal.get_urban_weights(synthetic_datadir, "ERS", cachedir=cachedir)
+    np.testing.assert_array_equal(cached, grid)
+
+    # a built-fraction layer with a gradient across the grid
+    layer = grid.copy(data=np.tile(np.linspace(0.0, 1.5, 40), (40, 1)))
+    layer.to_dataset(name="built").to_netcdf(tmp_path / "built.nc")
+    grid = ubs.zonal.get_urban_weights(
+        synthetic_datadir, "ERS", layer=str(tmp_path / "built.nc")
+    )
+    assert float(grid.max()) == 1.0
+
+    lons = np.array([-71.06, -71.96])
+    lats = np.array([42.36, 43.96])
+    rows, cols = ubs.cmgutils.box_indices(lons, lats)
+    weights = ubs.zonal.CellWeights.from_boxes(["boston", "corner"], rows, cols)
+    stats = ubs.zonal.zonal_stats(
+        ubs.ncfileio.get_monthly_data(synthetic_datadir, "ERS"),
+        weights.scaled(grid),
+    )
+
+    for i, (lon, lat) in enumerate(zip(lons, lats)):
+        box = ubs.ncfileio.get_monthly_data(
+            synthetic_datadir, "ERS", bbox=ubs.cmgutils.box11(lon, lat)
+        )
+        expected = ubs.zonal.weighted_box_mean(box, grid)
+        np.testing.assert_allclose(
+            stats["sig0_mean"][:, i], expected["sig0"], rtol=1e-5
+        )
+    # the first column of the grid has zero weight
+    assert int(stats["sig0_count"][0, 1]) < int(box["sig0"][0].count())